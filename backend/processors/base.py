@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 
 class BaseProcessor(ABC):
     @abstractmethod
@@ -17,3 +17,12 @@ class BaseProcessor(ABC):
         2. A list of debug/excluded item dictionaries (if debug mode is enabled).
         """
         pass
+
+    def iter_process(self, file_path: str, original_filename: str, sibling_files: List[str] = None, **kwargs) -> Iterator[tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+        """
+        Streaming form of process(): yields (shards, excluded) batches as they
+        are extracted, so callers can write output before the whole file is
+        parsed. Processors that can stream override this; the default yields
+        the full process() result as a single batch.
+        """
+        yield self.process(file_path, original_filename, sibling_files, **kwargs)
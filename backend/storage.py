@@ -5,8 +5,10 @@ import json
 import io
 from google.cloud import storage
 import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
+from drive_transport import DriveTransport
 
 class StorageAdapter(ABC):
     @abstractmethod
@@ -94,7 +96,9 @@ class DriveStorageAdapter(StorageAdapter):
         root_folder_id: Optional ID to act as the 'root' for relative paths.
         """
         creds, _ = google.auth.default()
-        self.service = build('drive', 'v3', credentials=creds)
+        # Pooled, rate-limited and retrying; shares the service account's bucket
+        self.transport = DriveTransport("service-account", session_factory=lambda: AuthorizedSession(creds))
+        self.service = build('drive', 'v3', http=self.transport.http())
         self.root_id = root_folder_id
 
     def list_files(self, folder_id: str) -> List[Dict]:
@@ -0,0 +1,109 @@
+import sys
+import os
+import io
+import json
+import random
+import zipfile
+
+# Add the mbox worker to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'workers', 'mbox')))
+
+from bundler import EvidenceBundler, read_member, bundle_name, INDEX_NAME
+
+
+class FakeUploader:
+    """
+    Keeps streamed uploads in memory; names in `fail` are refused.
+    """
+    def __init__(self, fail=()):
+        self.files = {}
+        self.fail = set(fail)
+
+    def upload_stream(self, filename, source, mime_type, parent_id, md5=None, size=None):
+        if filename in self.fail:
+            return None
+        data = source.read()
+        assert len(data) == size
+        file_id = f"{parent_id}/{filename}"
+        self.files[file_id] = data
+        return file_id
+
+    def fetch_range(self, file_id, offset, length):
+        return self.files[file_id][offset:offset + length]
+
+    def index(self, index_id):
+        return [json.loads(line) for line in self.files[index_id].splitlines()]
+
+
+def _message(i, size=3000):
+    # Incompressible, so the cap is reached
+    return f"Subject: {i}\n\n".encode() + random.Random(i).randbytes(size)
+
+
+def _add(bundler, i, on_uploaded=None):
+    eml = _message(i)
+    html = f"<html>order {i}</html>"
+    bundler.add(f"msg{i}", [("eml", io.BytesIO(eml), len(eml)), ("html", html, len(html))],
+                message_id=f"<{i}@example.com>", date="Tue, 04 Apr 2023 10:00:00 +0000",
+                on_uploaded=on_uploaded)
+
+
+def test_index_offsets_read_back_single_members():
+    uploader = FakeUploader()
+    bundler = EvidenceBundler(uploader, "folder", "All_mail", max_bytes=50_000)
+    for i in range(40):
+        _add(bundler, i)
+    index_id = bundler.close()
+
+    entries = uploader.index(index_id)
+    assert index_id == f"folder/{INDEX_NAME}"
+    assert [e['name'] for e in entries] == [f"msg{i}" for i in range(40)]
+    for entry in entries:
+        i = int(entry['name'][3:])
+        assert read_member(uploader.fetch_range, entry, "eml") == _message(i)
+        assert read_member(uploader.fetch_range, entry, "html") == f"<html>order {i}</html>".encode()
+        assert entry['messageId'] == f"<{i}@example.com>"
+
+    # Bundles are ordinary zips
+    with zipfile.ZipFile(io.BytesIO(uploader.files[entries[-1]['bundleId']])) as z:
+        assert z.testzip() is None
+        assert z.read(f"{entries[-1]['name']}.eml") == _message(39)
+
+
+def test_bundles_roll_over_at_the_size_cap():
+    uploader = FakeUploader()
+    bundler = EvidenceBundler(uploader, "folder", "All_mail", max_bytes=20_000)
+    for i in range(30):
+        _add(bundler, i)
+    bundler.close()
+
+    bundles = [data for file_id, data in uploader.files.items() if file_id.endswith(".zip")]
+    assert bundler.bundles == len(bundles) > 1
+    assert all(len(data) <= 20_000 for data in bundles)
+    assert bundler.messages == 30
+
+
+def test_failed_bundle_is_counted_and_left_out_of_the_index():
+    uploader = FakeUploader(fail={bundle_name("All_mail", 1)})
+    bundler = EvidenceBundler(uploader, "folder", "All_mail", max_bytes=20_000)
+    uploaded = []
+    for i in range(12):
+        _add(bundler, i, on_uploaded=lambda i=i: uploaded.append(i))
+    index_id = bundler.close()
+
+    entries = uploader.index(index_id)
+    first_bundle = 12 - len(entries)
+    assert first_bundle > 0
+    assert bundler.failed_files == 2 * first_bundle
+    assert sorted(uploaded) == [int(e['name'][3:]) for e in entries]
+
+
+def test_rerun_produces_identical_bundles():
+    first, second = FakeUploader(), FakeUploader()
+    for uploader in (first, second):
+        bundler = EvidenceBundler(uploader, "folder", "All_mail")
+        for i in range(5):
+            _add(bundler, i)
+        bundler.close()
+
+    assert first.files == second.files
@@ -0,0 +1,287 @@
+import pytest
+import sys
+import os
+import io
+import re
+import json
+from json import loads
+import hashlib
+import threading
+import requests
+
+# Add the mbox worker to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'workers', 'mbox')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'shared')))
+
+from drive_uploader import DriveUploader, CHUNK_GRANULARITY, iter_chunks
+from id_cache import DriveIdCache
+from utils import date_folder_segments, UNDATED_FOLDER
+
+_PARENT_RE = re.compile(r"'([^']+)' in parents")
+_NAME_RE = re.compile(r"name='([^']+)'")
+_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None, content=b''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._body = body or {}
+        self.text = json.dumps(self._body)
+        self.content = content
+        self.reason = ''
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class FakeTransport:
+    """
+    In-memory Drive behind DriveTransport.request(): listings, folder
+    creation, multipart create/update and resumable sessions.
+    `failures` maps a filename to the statuses its next uploads answer.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        self.sessions = {}
+        self.failures = {}
+        self.requests = []
+        self.ids = 0
+
+    def _new_id(self):
+        self.ids += 1
+        return f"file{self.ids}"
+
+    def add_file(self, name, parent, content, mime_type='text/plain'):
+        with self.lock:
+            file_id = self._new_id()
+            self.files[file_id] = {'name': name, 'parents': [parent], 'content': content, 'mimeType': mime_type}
+            return file_id
+
+    def _listing(self, params):
+        parent = _PARENT_RE.search(params['q']).group(1)
+        name = _NAME_RE.search(params['q'])
+        return FakeResponse(200, {'files': [
+            {'id': file_id, 'name': f['name'], 'md5Checksum': hashlib.md5(f['content']).hexdigest(),
+             'size': str(len(f['content']))}
+            for file_id, f in self.files.items()
+            if parent in f['parents'] and (not name or name.group(1) == f['name'])
+        ]})
+
+    def _failure(self, name):
+        statuses = self.failures.get(name)
+        return statuses.pop(0) if statuses else None
+
+    def _store(self, file_id, metadata, content):
+        if file_id is None:
+            file_id = self._new_id()
+            self.files[file_id] = {'name': metadata['name'], 'parents': metadata['parents'], 'content': content}
+        else:
+            self.files[file_id]['content'] = content
+        return FakeResponse(200, {'id': file_id})
+
+    def _chunk(self, session_url, data, headers):
+        session = self.sessions[session_url]
+        match = _RANGE_RE.match(headers['Content-Range'])
+        if match is None:
+            # 'bytes */total': status query
+            if session['done']:
+                return FakeResponse(200, {'id': session['done']})
+            stored = len(session['content'])
+            return FakeResponse(308, headers={'Range': f"bytes=0-{stored - 1}"} if stored else {})
+        start, total = int(match.group(1)), match.group(3)
+        assert start == len(session['content']), "chunk does not continue the committed bytes"
+        drop = session['drop_after'].pop(0) if session['drop_after'] else None
+        if drop is not None:
+            # The connection dies after part of the chunk was stored
+            session['content'] += data[:drop]
+            raise requests.ConnectionError("connection reset")
+        session['content'] += data
+        if total != '*' and len(session['content']) == int(total):
+            response = self._store(session['file_id'], session['metadata'], bytes(session['content']))
+            session['done'] = response.json()['id']
+            return response
+        return FakeResponse(308, headers={'Range': f"bytes=0-{len(session['content']) - 1}"})
+
+    def request(self, method, url, params=None, json=None, headers=None, data=None, files=None, **kwargs):
+        with self.lock:
+            self.requests.append((method, url))
+            if url in self.sessions:
+                return self._chunk(url, data, headers)
+            update = re.search(r"/files/([^/?]+)\?uploadType", url)
+            file_id = update.group(1) if update else None
+            if file_id and file_id not in self.files:
+                return FakeResponse(404, {'error': {'code': 404}})
+
+            if method == 'GET' and params and 'q' in params:
+                return self._listing(params)
+            if method == 'GET' and params and params.get('alt') == 'media':
+                content = self.files[url.rsplit('/', 1)[-1]]['content']
+                start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+                return FakeResponse(206, content=content[start:end + 1])
+            if 'uploadType=multipart' in url:
+                # `json` is the request body here; the module is imported as loads
+                metadata = loads(files['data'][1])
+                name = files['file'][0]
+                status = self._failure(name)
+                if status:
+                    return FakeResponse(status, {'error': {'code': status}})
+                content = files['file'][1]
+                return self._store(file_id, metadata, content.encode('utf-8') if isinstance(content, str) else content)
+            if 'uploadType=resumable' in url:
+                session_url = f"https://upload/session/{len(self.sessions) + 1}"
+                self.sessions[session_url] = {'metadata': json, 'file_id': file_id, 'content': bytearray(),
+                                              'done': None, 'drop_after': list(self.failures.pop('session', []))}
+                return FakeResponse(200, headers={'Location': session_url})
+            if method == 'POST':
+                # Folder creation
+                folder_id = self._new_id()
+                self.files[folder_id] = {'name': json['name'], 'parents': json['parents'], 'content': b''}
+                return FakeResponse(200, {'id': folder_id})
+        raise AssertionError(f"unexpected {method} {url}")
+
+
+@pytest.fixture
+def drive():
+    return FakeTransport()
+
+
+@pytest.fixture
+def uploader(drive):
+    uploader = DriveUploader("token", user_id="user-1", id_cache=DriveIdCache())
+    uploader.transport = drive
+    return uploader
+
+
+def _content(drive, name):
+    return next(f['content'] for f in drive.files.values() if f['name'] == name)
+
+
+def test_upload_files_requeues_only_transient_failures(uploader, drive):
+    drive.failures = {'b.json': [503], 'c.json': [400]}
+
+    ids = uploader.upload_files([
+        ('a.eml', b'A', 'message/rfc822', 'folder'),
+        ('b.json', '{"b": 1}', 'application/json', 'folder'),
+        ('c.json', '{"c": 1}', 'application/json', 'folder'),
+    ])
+
+    assert ids[0] is not None and ids[1] is not None and ids[2] is None
+    assert _content(drive, 'b.json') == b'{"b": 1}'
+    # Only b.json went out twice; c.json was not retried
+    uploads = [url for method, url in drive.requests if 'multipart' in url]
+    assert len(uploads) == 4
+
+
+def test_identical_files_are_skipped_and_changed_ones_replaced(uploader, drive):
+    same_id = drive.add_file('a.eml', 'folder', b'A')
+    changed_id = drive.add_file('b.json', 'folder', b'{"b": 1}')
+
+    ids = uploader.upload_files([
+        ('a.eml', b'A', 'message/rfc822', 'folder'),
+        ('b.json', '{"b": 2}', 'application/json', 'folder'),
+    ])
+
+    assert ids == [same_id, changed_id]
+    assert uploader.skipped_uploads == 1
+    assert drive.files[changed_id]['content'] == b'{"b": 2}'
+    assert len(drive.files) == 2
+    assert ('PATCH', f"https://www.googleapis.com/upload/drive/v3/files/{changed_id}?uploadType=multipart") in drive.requests
+
+
+def test_upload_file_replaces_by_name_on_rerun(uploader, drive):
+    first_id = uploader.upload_file('processing_log.json', '{"run": 1}', 'application/json', 'folder')
+    # A later run of the same job
+    assert uploader.upload_file('processing_log.json', '{"run": 2}', 'application/json', 'folder') == first_id
+    assert uploader.upload_file('processing_log.json', '{"run": 2}', 'application/json', 'folder') == first_id
+
+    assert len(drive.files) == 1
+    assert drive.files[first_id]['content'] == b'{"run": 2}'
+    assert uploader.skipped_uploads == 1
+
+def test_find_identical_compares_md5_and_size(uploader, drive):
+    file_id = drive.add_file('a.eml', 'folder', b'hello')
+    md5 = hashlib.md5(b'hello').hexdigest()
+
+    assert uploader.find_identical('a.eml', 'folder', md5, 5) == file_id
+    assert uploader.find_identical('a.eml', 'folder', md5, 6) is None
+    assert uploader.find_identical('a.eml', 'folder', hashlib.md5(b'other').hexdigest()) is None
+    assert uploader.find_identical('missing.eml', 'folder', md5) is None
+
+
+def test_iter_chunks_reslices_pieces():
+    chunks = list(iter_chunks(iter([b'ab', 'cde', b'f']), 4))
+    assert chunks == [(b'abcd', False), (b'ef', True)]
+    assert list(iter_chunks(io.BytesIO(b''), 4)) == [(b'', True)]
+
+
+def test_upload_stream_sends_resumable_chunks(uploader, drive):
+    content = os.urandom(CHUNK_GRANULARITY * 2 + 1000)
+
+    file_id = uploader.upload_stream('big.eml', io.BytesIO(content), 'message/rfc822', 'folder',
+                                     chunk_size=CHUNK_GRANULARITY)
+
+    assert drive.files[file_id]['content'] == content
+    assert len([url for method, url in drive.requests if method == 'PUT']) == 3
+
+
+def test_upload_stream_resumes_after_dropped_connection(uploader, drive):
+    content = os.urandom(CHUNK_GRANULARITY * 2)
+    # The second chunk's connection dies after 1000 bytes were committed
+    drive.failures = {'session': [None, 1000]}
+
+    file_id = uploader.upload_stream('big.eml', io.BytesIO(content), 'message/rfc822', 'folder',
+                                     chunk_size=CHUNK_GRANULARITY)
+
+    assert drive.files[file_id]['content'] == content
+    # chunk 1, chunk 2 (dropped), status query, rest of chunk 2
+    assert len([url for method, url in drive.requests if method == 'PUT']) == 4
+
+
+def test_upload_stream_skips_identical_content_without_reading(uploader, drive):
+    file_id = drive.add_file('big.eml', 'folder', b'Z' * 10)
+
+    class Unreadable:
+        def read(self, size=-1):
+            raise AssertionError("source was read")
+
+    assert uploader.upload_stream('big.eml', Unreadable(), 'message/rfc822', 'folder',
+                                  md5=hashlib.md5(b'Z' * 10).hexdigest(), size=10) == file_id
+    assert uploader.skipped_uploads == 1
+
+
+def test_upload_stream_replaces_changed_content_in_place(uploader, drive):
+    file_id = drive.add_file('big.eml', 'folder', b'old')
+
+    new_id = uploader.upload_stream('big.eml', io.BytesIO(b'new'), 'message/rfc822', 'folder',
+                                    md5=hashlib.md5(b'new').hexdigest(), size=3)
+
+    assert new_id == file_id
+    assert drive.files[file_id]['content'] == b'new'
+
+
+def test_download_range(uploader, drive):
+    file_id = drive.add_file('bundle.zip', 'folder', b'0123456789')
+    assert uploader.download_range(file_id, 3, 4) == b'3456'
+
+
+def test_ensure_path_caches_folders(uploader, drive):
+    folder_id = uploader.ensure_path(['Kintsu', 'Hopper', 'Gmail'])
+    calls = len(drive.requests)
+
+    assert uploader.ensure_path(['Kintsu', 'Hopper', 'Gmail']) == folder_id
+    assert len(drive.requests) == calls
+
+
+def test_date_folder_segments():
+    assert date_folder_segments('Tue, 04 Apr 2023 10:00:00 +0000', '%Y/%m') == ['2023', '04']
+    assert date_folder_segments('Tue, 04 Apr 2023 10:00:00 +0000', '') == []
+    assert date_folder_segments('not a date', '%Y/%m') == [UNDATED_FOLDER]
+    assert date_folder_segments(None, '%Y') == [UNDATED_FOLDER]
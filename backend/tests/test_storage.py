@@ -5,6 +5,8 @@ import os
 
 # Add backend to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'shared')))
 
 from storage import DriveStorageAdapter
 
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bundles roll over before they would grow past this many bytes
+BUNDLE_MAX_BYTES = int(os.getenv("GMAIL_BUNDLE_MAX_BYTES", str(50 * 1024 * 1024)))
+BUNDLE_MIME_TYPE = "application/zip"
+INDEX_NAME = "index.ndjson"
+NDJSON_MIME_TYPE = "application/x-ndjson"
+
+# zip timestamps cannot predate 1980; fixed stamps keep re-runs byte-identical
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+# Fixed part of a central directory record, written for every member on close
+_CENTRAL_RECORD_BYTES = 46
+_END_RECORD_BYTES = 22
+_COMPRESSION_NAMES = {zipfile.ZIP_STORED: "stored", zipfile.ZIP_DEFLATED: "deflate"}
+
+
+def bundle_name(prefix: str, number: int) -> str:
+    return f"{prefix}-{number:04d}.zip"
+
+
+def _zip_date_time(date_header: Optional[str]) -> Tuple[int, ...]:
+    try:
+        sent = parsedate_to_datetime(date_header) if date_header else None
+    except (TypeError, ValueError, IndexError):
+        sent = None
+    if sent is None or sent.year < 1980:
+        return _ZIP_EPOCH
+    return sent.timetuple()[:6]
+
+
+def _md5_and_size(fileobj) -> Tuple[str, int]:
+    # Hashed before upload so a re-run with identical content is skipped
+    fileobj.seek(0)
+    md5 = hashlib.md5()
+    size = 0
+    for piece in iter(lambda: fileobj.read(1024 * 1024), b""):
+        md5.update(piece)
+        size += len(piece)
+    fileobj.seek(0)
+    return md5.hexdigest(), size
+
+
+def read_member(fetch_range: Callable[[str, int, int], bytes], entry: Dict, extension: str = "eml") -> bytes:
+    """
+    One artifact of an indexed message, fetched with a single ranged read of
+    its bundle: fetch_range(bundle_id, offset, length) returns raw bytes
+    (e.g. DriveUploader.download_range). Nothing else of the bundle is read.
+    """
+    member = entry["members"][extension]
+    raw = fetch_range(entry["bundleId"], member["offset"], member["length"])
+    if member["compression"] == "deflate":
+        return zlib.decompress(raw, -zlib.MAX_WBITS)
+    return raw
+
+
+class EvidenceBundler:
+    """
+    Packs each message's artifacts into size-capped zip bundles and keeps an
+    NDJSON index with one line per message: its bundle (name and Drive ID)
+    and, per artifact, the byte offset and length of the member data inside
+    the bundle. A ranged GET of that span plus a raw inflate (read_member)
+    gives back a single .eml without downloading the bundle.
+
+    Bundles are built in local temp files and uploaded as they fill, so the
+    Drive cost of a job is a few resumable requests per bundle plus the
+    index, instead of three uploads per message.
+    """
+
+    def __init__(self, drive_uploader, folder_id: str, prefix: str, max_bytes: int = BUNDLE_MAX_BYTES):
+        self.drive_uploader = drive_uploader
+        self.folder_id = folder_id
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.bundles = 0
+        self.messages = 0
+        self.failed_files = 0
+        self._index = tempfile.TemporaryFile()
+        self._file = None
+        self._zip = None
+        self._entries: List[Dict] = []
+        self._members = 0
+        self._directory_bytes = 0
+        self._callbacks: List[Callable[[], None]] = []
+
+    def _open_bundle(self):
+        self.bundles += 1
+        self._file = tempfile.TemporaryFile()
+        self._zip = zipfile.ZipFile(self._file, "w")
+
+    def add(self, name: str, artifacts: List[Tuple[str, object, int]], message_id: str = None,
+            date: str = None, on_uploaded: Callable[[], None] = None):
+        """
+        Adds one message. artifacts are (extension, bytes or file-like, size)
+        triples; file-like sources are copied in pieces and closed.
+        on_uploaded runs once the bundle holding the message reached Drive.
+        """
+        incoming = sum((size or 0) + 2 * (_CENTRAL_RECORD_BYTES + len(name) + len(extension))
+                       for extension, _, size in artifacts)
+        projected = self._file.tell() + self._directory_bytes + _END_RECORD_BYTES + incoming if self._zip else 0
+        if self._members and projected > self.max_bytes:
+            self.flush()
+        if self._zip is None:
+            self._open_bundle()
+
+        date_time = _zip_date_time(date)
+        members = {}
+        for extension, source, _ in artifacts:
+            info = zipfile.ZipInfo(f"{name}.{extension}", date_time=date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            try:
+                with self._zip.open(info, "w") as dest:
+                    if isinstance(source, (bytes, str)):
+                        dest.write(source.encode("utf-8") if isinstance(source, str) else source)
+                    else:
+                        shutil.copyfileobj(source, dest, 1024 * 1024)
+            finally:
+                if hasattr(source, "close"):
+                    source.close()
+            # The member data ends where the file now stands; no data descriptor
+            # is written to a seekable file
+            members[extension] = {
+                "offset": self._file.tell() - info.compress_size,
+                "length": info.compress_size,
+                "size": info.file_size,
+                "crc32": info.CRC,
+                "compression": _COMPRESSION_NAMES[info.compress_type],
+            }
+            self._members += 1
+            self._directory_bytes += _CENTRAL_RECORD_BYTES + len(info.filename)
+
+        self._entries.append({
+            "name": name,
+            "messageId": message_id,
+            "date": date,
+            "members": members,
+        })
+        if on_uploaded:
+            self._callbacks.append(on_uploaded)
+
+    def flush(self) -> bool:
+        """
+        Closes the open bundle, uploads it and appends its messages to the
+        index. Returns False if the bundle could not be uploaded; its
+        messages are then counted in failed_files and left out of the index.
+        """
+        if self._zip is None:
+            return True
+        self._zip.close()
+        name = bundle_name(self.prefix, self.bundles)
+        entries, callbacks, members = self._entries, self._callbacks, self._members
+        self._entries, self._callbacks, self._members, self._directory_bytes = [], [], 0, 0
+        self._zip = None
+        try:
+            md5, size = _md5_and_size(self._file)
+            bundle_id = self.drive_uploader.upload_stream(
+                name, self._file, BUNDLE_MIME_TYPE, self.folder_id, md5=md5, size=size
+            )
+        finally:
+            self._file.close()
+            self._file = None
+
+        if not bundle_id:
+            logger.error(f"Failed to upload bundle {name} ({len(entries)} messages)")
+            self.failed_files += members
+            return False
+        for entry in entries:
+            line = {"bundle": name, "bundleId": bundle_id, **entry}
+            self._index.write(json.dumps(line, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.messages += len(entries)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cleanup after bundle {name} failed: {e}")
+        logger.info(f"Uploaded bundle {name}: {len(entries)} messages, {size} bytes")
+        return True
+
+    def close(self) -> Optional[str]:
+        """
+        Uploads the last bundle and then the index. Returns the index file ID.
+        """
+        try:
+            self.flush()
+            md5, size = _md5_and_size(self._index)
+            index_id = self.drive_uploader.upload_stream(
+                INDEX_NAME, self._index, NDJSON_MIME_TYPE, self.folder_id, md5=md5, size=size
+            )
+            if not index_id:
+                logger.error(f"Failed to upload {INDEX_NAME} for {self.prefix}")
+            return index_id
+        finally:
+            self._index.close()
@@ -2,25 +2,100 @@ import requests
 import logging
 import os
 import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from id_cache import DriveIdCache, shared_cache
+from drive_transport import DriveTransport, retry_kind
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart"
+RESUMABLE_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable"
+# Replaces the content of an existing file (uploadType: multipart or resumable)
+UPDATE_URL = "https://www.googleapis.com/upload/drive/v3/files/{file_id}?uploadType={upload_type}"
+MANIFEST_FIELDS = "nextPageToken, files(id, name, md5Checksum, size)"
+# Concurrent uploads per upload_files() call; also the keep-alive pool size
+UPLOAD_CONCURRENCY = int(os.getenv("DRIVE_UPLOAD_CONCURRENCY", "8"))
+# The transport already backs off and retries every request; these rounds
+# re-queue uploads (or resume chunks) that outlasted it
+UPLOAD_ATTEMPTS = 2
+
+# Drive requires every resumable chunk but the last to be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_CHUNK_SIZE = int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# Artifacts larger than this are streamed with upload_stream() instead of batched
+STREAM_THRESHOLD = DEFAULT_CHUNK_SIZE
+
+def _is_retryable(status, body):
+    # None: the request never got an answer (connection reset, timeout)
+    return status is None or retry_kind(status, body) is not None
+
+def _iter_pieces(source, size):
+    if hasattr(source, 'read'):
+        while True:
+            piece = source.read(size)
+            if not piece:
+                return
+            yield piece
+    else:
+        yield from source
+
+def iter_chunks(source, chunk_size):
+    """
+    Re-slices a file-like object or an iterator of str/bytes pieces into
+    (chunk, is_last) pairs of exactly chunk_size bytes (the last may be
+    shorter, or empty for empty content). One chunk is read ahead so the
+    last one is known before it is sent.
+    """
+    buffer = bytearray()
+    ready = None
+    for piece in _iter_pieces(source, chunk_size):
+        buffer += piece.encode('utf-8') if isinstance(piece, str) else piece
+        while len(buffer) >= chunk_size:
+            if ready is not None:
+                yield ready, False
+            ready = bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        if ready is not None:
+            yield ready, False
+        ready = bytes(buffer)
+    yield (ready if ready is not None else b''), True
+
 class DriveUploader:
-    def __init__(self, auth_token):
+    def __init__(self, auth_token, user_id=None, id_cache: DriveIdCache = None):
+        """
+        user_id scopes the folder-ID cache ('root' differs per account); the
+        token hash is used when it is unknown.
+        """
         self.auth_token = auth_token
         self.base_url = "https://www.googleapis.com/drive/v3/files"
         self.headers = {
             "Authorization": f"Bearer {auth_token}"
         }
+        self.id_cache = id_cache if id_cache is not None else shared_cache
+        self.cache_scope = user_id or hashlib.sha256(auth_token.encode('utf-8')).hexdigest()[:16]
+        # Pooled keep-alive session, rate limited by this user's token bucket
+        self.transport = DriveTransport(self.cache_scope, access_token=auth_token, pool_size=UPLOAD_CONCURRENCY)
+        # folder ID -> {name: {'id', 'md5Checksum', 'size'}} of the files in it
+        self._manifests = {}
+        self._manifest_lock = threading.Lock()
+        self.skipped_uploads = 0
 
     def find_folder(self, name, parent_id='root'):
+        cached_id = self.id_cache.get(parent_id, name, self.cache_scope)
+        if cached_id:
+            return cached_id
         try:
             query = f"name='{name}' and '{parent_id}' in parents and trashed=false and mimeType='application/vnd.google-apps.folder'"
             params = {'q': query, 'fields': 'files(id, name)'}
-            response = requests.get(self.base_url, headers=self.headers, params=params)
+            response = self.transport.request('GET', self.base_url, params=params)
             response.raise_for_status()
             files = response.json().get('files', [])
-            return files[0]['id'] if files else None
+            found_id = files[0]['id'] if files else None
+            self.id_cache.put(parent_id, name, found_id, self.cache_scope)
+            return found_id
         except Exception as e:
             logger.error(f"Error finding folder {name}: {e}")
             return None
@@ -32,42 +107,311 @@ class DriveUploader:
                 'mimeType': 'application/vnd.google-apps.folder',
                 'parents': [parent_id]
             }
-            response = requests.post(self.base_url, headers=self.headers, json=metadata)
+            response = self.transport.request('POST', self.base_url, json=metadata)
+            if response.status_code == 404:
+                self.id_cache.invalidate(parent_id)
             response.raise_for_status()
-            return response.json().get('id')
+            folder_id = response.json().get('id')
+            self.id_cache.put(parent_id, name, folder_id, self.cache_scope)
+            # A new folder is empty: no listing needed for its manifest
+            with self._manifest_lock:
+                self._manifests.setdefault(folder_id, {})
+            return folder_id
         except Exception as e:
             logger.error(f"Error creating folder {name}: {e}")
             return None
 
-    def upload_file(self, filename, content, mime_type, parent_id):
+    def folder_manifest(self, folder_id):
+        """
+        name -> {'id', 'md5Checksum', 'size'} of the files in a folder, listed
+        once (1000 per page) and kept current as this uploader writes to it.
+        """
+        with self._manifest_lock:
+            manifest = self._manifests.get(folder_id)
+        if manifest is not None:
+            return manifest
+
+        manifest = {}
+        page_token = None
+        while True:
+            params = {'q': f"'{folder_id}' in parents and trashed=false", 'fields': MANIFEST_FIELDS, 'pageSize': 1000}
+            if page_token:
+                params['pageToken'] = page_token
+            response = self.transport.request('GET', self.base_url, params=params)
+            if response.status_code == 404:
+                self.id_cache.invalidate(folder_id)
+            response.raise_for_status()
+            body = response.json()
+            for f in body.get('files', []):
+                manifest.setdefault(f['name'], f)
+            page_token = body.get('nextPageToken')
+            if not page_token:
+                break
+        with self._manifest_lock:
+            return self._manifests.setdefault(folder_id, manifest)
+
+    def _manifest_entry(self, filename, folder_id):
+        try:
+            return self.folder_manifest(folder_id).get(filename)
+        except Exception as e:
+            # Without a manifest every file is simply uploaded
+            logger.warning(f"Could not list folder {folder_id} for its manifest: {e}")
+            return None
+
+    def _record(self, folder_id, filename, file_id, md5, size):
+        with self._manifest_lock:
+            manifest = self._manifests.get(folder_id)
+            if manifest is None:
+                return
+            if file_id is None:
+                manifest.pop(filename, None)
+            else:
+                manifest[filename] = {'id': file_id, 'name': filename, 'md5Checksum': md5, 'size': str(size)}
+
+    def find_identical(self, filename, folder_id, md5, size=None):
+        """
+        ID of a file with this name and MD5 (hex) already in the folder, or None.
+        """
+        entry = self._manifest_entry(filename, folder_id)
+        if not entry or not md5 or entry.get('md5Checksum') != md5:
+            return None
+        if size is not None and int(entry.get('size', -1)) != size:
+            return None
+        return entry['id']
+
+    def note_skipped(self, filename):
+        with self._manifest_lock:
+            self.skipped_uploads += 1
+        logger.info(f"Skipping {filename}: identical content already in Drive")
+
+    def _upload(self, filename, content, mime_type, parent_id, file_id=None):
+        """
+        One multipart upload, replacing the content of `file_id` when given.
+        Returns (file ID or None, HTTP status or None, error text).
+        """
         try:
             # Simple upload for small files (JSON/HTML)
             metadata = {
                 'name': filename,
                 'parents': [parent_id]
             }
+            if file_id:
+                # Parents cannot be set on an update; the name is unchanged
+                metadata = {}
             
             files = {
                 'data': ('metadata', json.dumps(metadata), 'application/json'),
                 'file': (filename, content, mime_type)
             }
             
-            upload_url = "https://www.googleapis.com/upload/drive/v3/files?uploadType=multipart"
-            response = requests.post(upload_url, headers=self.headers, files=files)
+            if file_id:
+                url = UPDATE_URL.format(file_id=file_id, upload_type='multipart')
+                response = self.transport.request('PATCH', url, files=files)
+            else:
+                response = self.transport.request('POST', UPLOAD_URL, files=files)
             
             if response.status_code == 200:
-                return response.json().get('id')
-            else:
-                logger.error(f"Upload failed: {response.text}")
+                return response.json().get('id'), 200, None
+            if response.status_code == 404:
+                if file_id:
+                    # Deleted since the manifest was listed: create it again
+                    self._record(parent_id, filename, None, None, None)
+                    return self._upload(filename, content, mime_type, parent_id)
+                # Target folder is gone; the next ensure_path resolves it again
+                self.id_cache.invalidate(parent_id)
+            return None, response.status_code, response.text
+        except Exception as e:
+            return None, None, str(e)
+
+    def _upload_unless_identical(self, filename, content, mime_type, parent_id):
+        """
+        Skips content the folder already holds under this name, replaces it
+        when it differs, and creates the file otherwise.
+        """
+        content_bytes = content.encode('utf-8') if isinstance(content, str) else content
+        md5 = hashlib.md5(content_bytes).hexdigest()
+        entry = self._manifest_entry(filename, parent_id)
+        if entry and entry.get('md5Checksum') == md5:
+            self.note_skipped(filename)
+            return entry['id'], 200, None
+        outcome = self._upload(filename, content_bytes, mime_type, parent_id, entry['id'] if entry else None)
+        if outcome[0] is not None:
+            self._record(parent_id, filename, outcome[0], md5, len(content_bytes))
+        return outcome
+
+    def upload_file(self, filename, content, mime_type, parent_id):
+        """
+        Uploads str/bytes content in one request; file-like objects and
+        iterators are streamed with upload_stream(). Like upload_files(), a
+        re-run replaces a same-named file with other content and skips an
+        identical one instead of adding another copy.
+        """
+        if not isinstance(content, (str, bytes)):
+            return self.upload_stream(filename, content, mime_type, parent_id)
+        file_id, _, error = self._upload_unless_identical(filename, content, mime_type, parent_id)
+        if file_id is None:
+            logger.error(f"Error uploading {filename}: {error}")
+        return file_id
+
+    def upload_stream(self, filename, source, mime_type, parent_id, chunk_size=DEFAULT_CHUNK_SIZE,
+                      md5=None, size=None):
+        """
+        Streams a file-like object or an iterator of str/bytes pieces through a
+        Drive resumable upload session, holding at most two chunks in memory.
+        When a chunk still fails after the transport's retries, the session is
+        asked how many bytes it has committed and the upload continues from
+        there instead of restarting.
+
+        With a known MD5 (hex) the source is not read at all if the folder
+        already holds identical content under this name; a same-named file
+        with other content is replaced.
+        Returns the file ID, or None on failure.
+        """
+        if chunk_size <= 0 or chunk_size % CHUNK_GRANULARITY:
+            raise ValueError(f"chunk_size must be a positive multiple of {CHUNK_GRANULARITY} bytes")
+        entry = self._manifest_entry(filename, parent_id) if md5 else None
+        if entry and self.find_identical(filename, parent_id, md5, size):
+            self.note_skipped(filename)
+            return entry['id']
+        try:
+            session_url = self._start_session(filename, mime_type, parent_id, entry['id'] if entry else None)
+            if not session_url:
                 return None
+            offset = 0
+            response = None
+            for chunk, is_last in iter_chunks(source, chunk_size):
+                total = offset + len(chunk) if is_last else None
+                response = self._send_chunk(session_url, chunk, offset, total)
+                if response is None:
+                    logger.error(f"Upload of {filename} failed at byte {offset}")
+                    return None
+                offset += len(chunk)
+            file_id = response.json().get('id')
+            if md5:
+                self._record(parent_id, filename, file_id, md5, offset)
+            return file_id
         except Exception as e:
-            logger.error(f"Error uploading {filename}: {e}")
+            logger.error(f"Error streaming {filename}: {e}")
             return None
 
+    def _start_session(self, filename, mime_type, parent_id, file_id=None):
+        headers = {'X-Upload-Content-Type': mime_type}
+        if file_id:
+            url = UPDATE_URL.format(file_id=file_id, upload_type='resumable')
+            response = self.transport.request('PATCH', url, json={}, headers=headers)
+            if response.status_code != 404:
+                return self._session_url(filename, response)
+            # Deleted since the manifest was listed: create it again
+            self._record(parent_id, filename, None, None, None)
+        metadata = {
+            'name': filename,
+            'parents': [parent_id]
+        }
+        response = self.transport.request('POST', RESUMABLE_URL, json=metadata, headers=headers)
+        if response.status_code == 404:
+            self.id_cache.invalidate(parent_id)
+        return self._session_url(filename, response)
+
+    @staticmethod
+    def _session_url(filename, response):
+        if response.status_code != 200:
+            logger.error(f"Could not start upload session for {filename}: {response.text}")
+            return None
+        return response.headers.get('Location')
+
+    @staticmethod
+    def _committed(response):
+        # A 308 'Range: bytes=0-N' means N + 1 bytes are stored; no header, none
+        stored = response.headers.get('Range')
+        return int(stored.rsplit('-', 1)[1]) + 1 if stored else 0
+
+    def _send_chunk(self, session_url, chunk, offset, total):
+        """
+        PUTs one chunk (total is None until the last one). Returns the final
+        response (200/201) or a 308 once the whole chunk is committed; None
+        if it could not be stored.
+        """
+        end = offset + len(chunk)
+        size = str(total) if total is not None else '*'
+        committed = offset
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            data = chunk[committed - offset:]
+            content_range = f"bytes {committed}-{end - 1}/{size}" if data else f"bytes */{size}"
+            try:
+                response = self.transport.request('PUT', session_url, data=data, headers={'Content-Range': content_range})
+                status, error = response.status_code, response.text
+            except requests.RequestException as e:
+                response, status, error = None, None, str(e)
+
+            if status in (200, 201):
+                return response
+            if status != 308:
+                if attempt == UPLOAD_ATTEMPTS or not _is_retryable(status, error):
+                    logger.error(f"Chunk upload failed ({status}): {error}")
+                    return None
+                # Ask the session what it kept of the failed request
+                try:
+                    response = self.transport.request('PUT', session_url, headers={'Content-Range': f"bytes */{size}"})
+                except requests.RequestException:
+                    continue
+                if response.status_code in (200, 201):
+                    return response
+                if response.status_code != 308:
+                    continue
+
+            committed = max(offset, self._committed(response))
+            if committed >= end and total is None:
+                return response
+        return None
+
+    def download_range(self, file_id, offset, length):
+        """
+        `length` bytes of a file's content starting at `offset`, in one
+        ranged GET (e.g. one message out of an evidence bundle).
+        """
+        headers = {'Range': f"bytes={offset}-{offset + length - 1}"}
+        response = self.transport.request('GET', f"{self.base_url}/{file_id}", params={'alt': 'media'}, headers=headers)
+        response.raise_for_status()
+        return response.content
+
+    def upload_files(self, uploads):
+        """
+        Uploads many small files, given as (filename, content, mime_type,
+        parent_id) tuples, several at a time over the pooled session.
+        Returns their IDs in input order (None where the upload failed).
+
+        Files the folder already holds with identical content (same name and
+        MD5) are skipped; same-named files with other content are replaced.
+        Only the files that still failed with a transient error (rate limit,
+        5xx, dropped connection) after the transport's retries are re-queued.
+        """
+        results = [None] * len(uploads)
+        pending = list(range(len(uploads)))
+        # Each folder is listed once, up front, rather than by racing threads
+        for folder_id in {upload[3] for upload in uploads}:
+            self._manifest_entry(None, folder_id)
+        workers = max(1, min(UPLOAD_CONCURRENCY, len(uploads)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+                outcomes = list(pool.map(lambda i: self._upload_unless_identical(*uploads[i]), pending))
+                retry = []
+                for i, (file_id, status, error) in zip(pending, outcomes):
+                    if file_id is not None:
+                        results[i] = file_id
+                    elif attempt < UPLOAD_ATTEMPTS and _is_retryable(status, error):
+                        retry.append(i)
+                    else:
+                        logger.error(f"Error uploading {uploads[i][0]}: {error}")
+                if not retry:
+                    break
+                logger.warning(f"Re-queueing {len(retry)} of {len(pending)} uploads (attempt {attempt})")
+                pending = retry
+        return results
+
     def ensure_path(self, path_segments, root_id='root'):
         """
         Ensures a folder path exists (e.g. ['Kintsu', 'Hopper', 'Gmail']).
-        Returns the ID of the final folder.
+        Returns the ID of the final folder. Fully cached paths cost no requests.
         """
         current_id = root_id
         for segment in path_segments:
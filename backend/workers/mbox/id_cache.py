@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL_SECONDS = 15 * 60
+
+
+class DriveIdCache:
+    """
+    In-process TTL/LRU cache of Drive (parent ID, name) -> file ID lookups.
+
+    Entries are scoped (e.g. per user) because aliases like 'root' resolve
+    differently per account. Callers invalidate by file ID when Drive answers
+    404, which also drops everything cached beneath that ID.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (scope, parent_id, name) -> (file_id, expires_at)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, parent_id: str, name: str, scope: str = '') -> Optional[str]:
+        key = (scope, parent_id, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, parent_id: str, name: str, file_id: str, scope: str = ''):
+        if not file_id:
+            return
+        key = (scope, parent_id, name)
+        with self._lock:
+            self._entries[key] = (file_id, self._clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, file_id: str):
+        """
+        Forgets a file/folder ID and everything cached beneath it, at any
+        depth: each evicted child ID is in turn dropped as a parent.
+        """
+        with self._lock:
+            pending = [file_id]
+            gone = set()
+            while pending:
+                parent = pending.pop()
+                if parent in gone:
+                    continue
+                gone.add(parent)
+                stale = [key for key, (cached_id, _) in self._entries.items()
+                         if cached_id == parent or key[1] == parent]
+                for key in stale:
+                    child_id = self._entries.pop(key)[0]
+                    if key[1] == parent:
+                        pending.append(child_id)
+
+    def invalidate_name(self, parent_id: str, name: str, scope: str = ''):
+        with self._lock:
+            self._entries.pop((scope, parent_id, name), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self, scope: str = '') -> List[List[str]]:
+        """
+        Live entries of one scope as [parent_id, name, file_id] triples, small
+        enough to persist on a Firestore document.
+        """
+        now = self._clock()
+        with self._lock:
+            return [[parent_id, name, file_id]
+                    for (entry_scope, parent_id, name), (file_id, expires_at) in self._entries.items()
+                    if entry_scope == scope and expires_at > now]
+
+    def load(self, entries: Optional[List[List[str]]], scope: str = ''):
+        for parent_id, name, file_id in entries or []:
+            self.put(parent_id, name, file_id, scope)
+
+
+# Shared by every adapter in this process, so warm invocations skip lookups
+shared_cache = DriveIdCache()
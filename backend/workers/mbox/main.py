@@ -5,10 +5,12 @@ import mailbox
 import tempfile
 import io
 import time
+import base64
 from fastapi import FastAPI, Request
 from google.cloud import storage, firestore
 from job_service import JobService  # Shared logic
-from utils import sanitize_filename
+from utils import sanitize_filename, date_folder_segments
+from bundler import EvidenceBundler
 from logger import DriveLogger
 from google import genai
 from google.genai import types
@@ -24,6 +26,93 @@ db = firestore.Client()
 BUCKET_NAME = os.getenv("BUCKET_NAME", "kintsu-hopper-kintsu-gcp")
 job_service = JobService(BUCKET_NAME)
 
+# Messages whose artifacts are collected before one DriveUploader.upload_files() call
+UPLOAD_BATCH_MESSAGES = int(os.getenv("DRIVE_UPLOAD_BATCH_MESSAGES", "25"))
+
+# strftime layout of the sub-folders under Kintsu/Hopper/Gmail, from each
+# message's Date header ('%Y/%m' -> Gmail/2023/04/); empty keeps it flat
+GMAIL_FOLDER_LAYOUT = os.getenv("GMAIL_FOLDER_LAYOUT", "%Y/%m")
+
+# 'files': .eml/.html/.json per message in date folders (O(messages) Drive calls)
+# 'packed': size-capped zip bundles + one NDJSON index per mbox (O(bundles) Drive calls)
+OUTPUT_MODE_FILES = 'files'
+OUTPUT_MODE_PACKED = 'packed'
+DEFAULT_OUTPUT_MODE = os.getenv("GMAIL_OUTPUT_MODE", OUTPUT_MODE_FILES)
+
+# (extension, MIME type) of the per-message artifacts copied to Drive
+MESSAGE_ARTIFACTS = [
+    ("eml", "message/rfc822"),
+    ("html", "text/html"),
+    ("json", "application/json"),
+]
+
+def message_folder_id(drive_uploader, gmail_folder_id, message):
+    """
+    Drive folder for a message's artifacts under the Gmail folder, following
+    GMAIL_FOLDER_LAYOUT. Folders are created on first use and their IDs
+    cached, so a month already seen costs no Drive calls.
+    """
+    segments = date_folder_segments(message.get('Date'), GMAIL_FOLDER_LAYOUT)
+    try:
+        return drive_uploader.ensure_path(segments, root_id=gmail_folder_id)
+    except Exception as e:
+        logger.error(f"Could not resolve Gmail folder {'/'.join(segments)}, using the Gmail folder: {e}")
+        return gmail_folder_id
+
+def upload_artifacts(drive_uploader, pending):
+    """
+    Uploads the queued (filename, content, mime_type, folder_id, blob)
+    artifacts in one batch and deletes the GCS copy of each one that reached
+    Drive; failed ones are kept for debugging until the final cleanup.
+    Returns the number of artifacts that could not be uploaded.
+    """
+    if not pending:
+        return 0
+    failed = 0
+    file_ids = drive_uploader.upload_files([
+        (filename, content, mime_type, folder_id) for filename, content, mime_type, folder_id, _ in pending
+    ])
+    for (filename, _, _, _, artifact_blob), file_id in zip(pending, file_ids):
+        if file_id is None:
+            logger.error(f"Failed to upload {filename} to Drive")
+            failed += 1
+            continue
+        try:
+            artifact_blob.delete()
+        except NotFound:
+            pass
+    pending.clear()
+    return failed
+
+def bundle_artifacts(bundler, bucket_obj, extract_path, result_name, message):
+    """
+    Adds a message's artifacts to the open evidence bundle, streamed from
+    GCS. Their GCS copies are deleted once the bundle reached Drive.
+    """
+    artifacts = []
+    blobs = []
+    for extension, _ in MESSAGE_ARTIFACTS:
+        artifact_blob = bucket_obj.get_blob(f"{extract_path}/{result_name}.{extension}")
+        if artifact_blob is None:
+            continue
+        artifacts.append((extension, artifact_blob.open("rb"), artifact_blob.size))
+        blobs.append(artifact_blob)
+
+    def delete_blobs():
+        for artifact_blob in blobs:
+            try:
+                artifact_blob.delete()
+            except NotFound:
+                pass
+
+    date = message.get('Date')
+    bundler.add(
+        result_name, artifacts,
+        message_id=message.get('Message-ID', '').strip() or None,
+        date=str(date) if date is not None else None,
+        on_uploaded=delete_blobs
+    )
+
 class EmailProcessor:
     def __init__(self, bucket, base_path, logger):
         self.bucket = bucket
@@ -229,12 +318,14 @@ async def handle_event(request: Request):
     job_doc_snap = db.collection("jobs").document(job_id).get()
     
     # Race Condition Check 1: Job Status
+    output_mode = DEFAULT_OUTPUT_MODE
     if job_doc_snap.exists:
         job_data = job_doc_snap.to_dict()
         if job_data.get('status') == 'completed':
             logger.info(f"Job {job_id} already completed. Ignoring duplicate event.")
             return {"status": "ignored"}
         auth_token = job_data.get('authToken')
+        output_mode = job_data.get('outputMode', DEFAULT_OUTPUT_MODE)
     else:
         logger.warning(f"Job {job_id} not found in Firestore.")
         auth_token = None
@@ -244,10 +335,15 @@ async def handle_event(request: Request):
     
     if auth_token:
         try:
-            from drive_uploader import DriveUploader
-            drive_uploader = DriveUploader(auth_token)
+            from drive_uploader import DriveUploader, STREAM_THRESHOLD
+            drive_uploader = DriveUploader(auth_token, user_id=user_id)
+            # Folder IDs resolved by an earlier attempt of this job skip the lookups
+            drive_uploader.id_cache.load(job_data.get('driveIdCache'), drive_uploader.cache_scope)
             # Ensure Path: Kintsu -> Hopper -> Gmail
             target_folder_id = drive_uploader.ensure_path(['Kintsu', 'Hopper', 'Gmail'])
+            db.collection("jobs").document(job_id).update({
+                "driveIdCache": drive_uploader.id_cache.snapshot(drive_uploader.cache_scope)
+            })
             logger.info(f"Drive Upload configured. Target Folder: {target_folder_id}")
         except Exception as e:
             logger.error(f"Failed to configure Drive Uploader: {e}")
@@ -282,6 +378,15 @@ async def handle_event(request: Request):
         
         # Initialize Processor
         processor = EmailProcessor(bucket_obj, extract_path, proc_logger)
+
+        # Packed mode: Kintsu/Hopper/Gmail/<mbox name>/ holds the bundles and index.ndjson
+        bundler = None
+        if drive_uploader and target_folder_id and output_mode == OUTPUT_MODE_PACKED:
+            try:
+                bundle_folder_id = drive_uploader.ensure_path([mbox_name], root_id=target_folder_id)
+                bundler = EvidenceBundler(drive_uploader, bundle_folder_id, sanitize_filename(mbox_name))
+            except Exception as e:
+                logger.error(f"Could not set up evidence bundles, uploading files instead: {e}")
         
         # Parse Mbox
         mbox = mailbox.mbox(temp_file)
@@ -289,6 +394,9 @@ async def handle_event(request: Request):
         logger.info(f"Mbox contains {total_messages} messages")
         
         processed_count = 0
+        pending_uploads = []
+        queued_messages = 0
+        failed_uploads = 0
         
         for message in mbox:
             processed_count += 1
@@ -300,38 +408,57 @@ async def handle_event(request: Request):
             # Process Message
             result_name = processor.process_message(message)
             
-            # Post-Process: Upload to Drive if configured
-            if result_name and drive_uploader and target_folder_id:
+            # Post-Process: Pack artifacts into the open bundle
+            if result_name and bundler:
                 try:
-                    # Upload EML (Raw)
-                    eml_blob = bucket_obj.blob(f"{extract_path}/{result_name}.eml")
-                    if eml_blob.exists():
-                         eml_content = eml_blob.download_as_string()
-                         drive_uploader.upload_file(f"{result_name}.eml", eml_content, "message/rfc822", target_folder_id)
-                         eml_blob.delete() # Cleanup immediately
-
-                    # Upload HTML
-                    html_blob = bucket_obj.blob(f"{extract_path}/{result_name}.html")
-                    if html_blob.exists():
-                        html_content = html_blob.download_as_text()
-                        drive_uploader.upload_file(f"{result_name}.html", html_content, "text/html", target_folder_id)
-                        html_blob.delete() # Cleanup immediately
-                    
-                    # Upload JSON (Inventory)
-                    json_blob = bucket_obj.blob(f"{extract_path}/{result_name}.json")
-                    if json_blob.exists():
-                        json_content = json_blob.download_as_text()
-                        drive_uploader.upload_file(f"{result_name}.json", json_content, "application/json", target_folder_id)
-                        json_blob.delete() # Cleanup immediately
-                        
-                except Exception as up_err:
-                    logger.error(f"Failed to upload result {result_name} to Drive: {up_err}")
-                    # If upload fails, we keep the file for debugging (or fallback cleanup)
-                        
+                    bundle_artifacts(bundler, bucket_obj, extract_path, result_name, message)
+                except Exception as bundle_err:
+                    logger.error(f"Failed to bundle result {result_name}: {bundle_err}")
+
+            # Post-Process: Queue artifacts for the next Drive upload batch
+            elif result_name and drive_uploader and target_folder_id:
+                try:
+                    folder_id = message_folder_id(drive_uploader, target_folder_id, message)
+                    for extension, mime_type in MESSAGE_ARTIFACTS:
+                        artifact_blob = bucket_obj.get_blob(f"{extract_path}/{result_name}.{extension}")
+                        if artifact_blob is None:
+                            continue
+                        artifact_name = f"{result_name}.{extension}"
+                        # GCS already knows the MD5: a reprocess skips unchanged
+                        # artifacts without downloading them
+                        md5 = base64.b64decode(artifact_blob.md5_hash).hex() if artifact_blob.md5_hash else None
+                        if drive_uploader.find_identical(artifact_name, folder_id, md5, artifact_blob.size):
+                            drive_uploader.note_skipped(artifact_name)
+                            artifact_blob.delete()
+                            continue
+                        if (artifact_blob.size or 0) > STREAM_THRESHOLD:
+                            # Large EMLs go straight from GCS to Drive in resumable chunks
+                            with artifact_blob.open("rb") as stream:
+                                uploaded = drive_uploader.upload_stream(
+                                    artifact_name, stream, mime_type, folder_id, md5=md5, size=artifact_blob.size
+                                )
+                            if uploaded:
+                                artifact_blob.delete()
+                            else:
+                                failed_uploads += 1
+                            continue
+                        pending_uploads.append((
+                            artifact_name, artifact_blob.download_as_bytes(), mime_type, folder_id, artifact_blob
+                        ))
+                    queued_messages += 1
                 except Exception as up_err:
-                    logger.error(f"Failed to upload result {result_name} to Drive: {up_err}")
+                    logger.error(f"Failed to queue result {result_name} for Drive: {up_err}")
+
+                if queued_messages >= UPLOAD_BATCH_MESSAGES:
+                    failed_uploads += upload_artifacts(drive_uploader, pending_uploads)
+                    queued_messages = 0
+
+        if drive_uploader and target_folder_id:
+            failed_uploads += upload_artifacts(drive_uploader, pending_uploads)
+        if bundler:
+            index_id = bundler.close()
+            failed_uploads += bundler.failed_files + (0 if index_id else 1)
 
-        
         # Final Log Save
         proc_logger.save()
         
@@ -346,6 +473,24 @@ async def handle_event(request: Request):
                  logger.error(f"Failed to upload processing_log.json: {log_up_err}")
 
         job_service.update_progress(job_id, 90, "processing", f"Extraction complete. Processed {processed_count} emails.", stage="uploading")
+
+        completion_message = "Job complete. Mbox processed and uploaded to Drive."
+        if drive_uploader:
+            drive_stats = drive_uploader.transport.metrics.snapshot()
+            drive_stats["failedUploads"] = failed_uploads
+            drive_stats["skippedUploads"] = drive_uploader.skipped_uploads
+            if bundler:
+                drive_stats["bundles"] = bundler.bundles
+                drive_stats["bundledMessages"] = bundler.messages
+            logger.info(f"Drive transport stats: {drive_stats}")
+            db.collection("jobs").document(job_id).update({
+                "driveStats": drive_stats,
+                # Includes the date folders resolved during this run
+                "driveIdCache": drive_uploader.id_cache.snapshot(drive_uploader.cache_scope)
+            })
+            if failed_uploads:
+                # Surfaced on the job instead of being lost in the logs
+                completion_message = f"Job complete. {failed_uploads} file(s) could not be uploaded to Drive."
         
         # Cleanup GCS Source File (Zero Retention)
         try:
@@ -364,7 +509,7 @@ async def handle_event(request: Request):
         except Exception as cleanup_err:
             logger.error(f"Failed to cleanup GCS artifacts: {cleanup_err}")
 
-        job_service.update_progress(job_id, 100, "completed", "Job complete. Mbox processed and uploaded to Drive.", stage="complete")
+        job_service.update_progress(job_id, 100, "completed", completion_message, stage="complete")
 
     except Exception as e:
         logger.error(f"Job failed: {e}", exc_info=True)
@@ -1,4 +1,8 @@
 import re
+from email.utils import parsedate_to_datetime
+
+# Sub-folder for messages without a usable Date header
+UNDATED_FOLDER = "Undated"
 
 def sanitize_filename(message_id):
     """
@@ -16,3 +20,20 @@ def sanitize_filename(message_id):
     s = re.sub(r'[^a-zA-Z0-9\-\_]', '_', s)
     
     return s
+
+def date_folder_segments(date_header, layout):
+    """
+    Sub-folder path of a message, from its Date header formatted with a
+    strftime layout such as '%Y/%m' (-> ['2023', '04']).
+    An empty layout keeps the flat layout; a missing or unparseable date
+    goes to UNDATED_FOLDER.
+    """
+    if not layout:
+        return []
+    try:
+        sent = parsedate_to_datetime(date_header) if date_header else None
+    except (TypeError, ValueError, IndexError):
+        sent = None
+    if sent is None:
+        return [UNDATED_FOLDER]
+    return [segment for segment in sent.strftime(layout).split('/') if segment]
@@ -1,61 +1,94 @@
 import io
 import openpyxl
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
 from storage_adapter import DriveStorageAdapter
+from inventory_store import InventoryStore, LEGACY_SEGMENT_NAME
+
+INVENTORY_HEADER = ["Date", "Item Name", "Category", "Merchant", "Total Amount", "Currency", "Confidence", "Source File"]
+XLSX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+AMOUNT_COLUMN = INVENTORY_HEADER.index("Total Amount")
+# The store also keeps a stable per-row key (shard generation + item index)
+KEY_COLUMN = "Row Key"
+STORE_HEADER = INVENTORY_HEADER + [KEY_COLUMN]
+
+# Minimum age of the rendered XLSX before render_if_stale() regenerates it
+DEFAULT_RENDER_DEBOUNCE_SECONDS = 300
+# appProperties key on the XLSX: watermark of the store snapshot it shows
+RENDER_WATERMARK_PROPERTY = "storeWatermark"
+
+def _parse_drive_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
 
 class InventoryAggregator:
-    def __init__(self, drive_adapter: DriveStorageAdapter):
+    def __init__(self, drive_adapter: DriveStorageAdapter, flush_every: int = 0,
+                 store: Optional[InventoryStore] = None):
+        """
+        Rows are appended to the canonical InventoryStore (one CSV segment per
+        append) and Kintsu_Inventory.xlsx is rendered from it on demand.
+
+        flush_every: when > 0, add_item() buffers rows and flushes them as one
+        segment every `flush_every` rows. Call flush() (or use the aggregator
+        as a context manager) at job end.
+        """
         self.drive = drive_adapter
         self.filename = "Kintsu_Inventory.xlsx"
+        self.store = store or InventoryStore(drive_adapter, STORE_HEADER, key_column=KEY_COLUMN)
+        self.flush_every = flush_every
+        self._pending: Dict[str, List[list]] = {}
+        self._file_ids: Dict[str, str] = {}
+        # Folders whose legacy import is known to be done
+        self._imported: Set[str] = set()
+
+    def _new_workbook(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Inventory"
+        # Header
+        ws.append(INVENTORY_HEADER)
+        return wb, ws
 
     def ensure_inventory_file(self, folder_id: str) -> str:
         """
         Ensures the inventory file exists. Returns its ID.
         """
+        if folder_id in self._file_ids:
+            return self._file_ids[folder_id]
+
         file = self.drive.find_file_by_name(self.filename, folder_id)
         if file:
+            self._file_ids[folder_id] = file['id']
             return file['id']
-        
+
         # Create new
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Inventory"
-        # Header
-        ws.append(["Date", "Item Name", "Category", "Merchant", "Total Amount", "Currency", "Confidence", "Source File"])
-        
+        wb, _ = self._new_workbook()
+
         buffer = io.BytesIO()
         wb.save(buffer)
         buffer.seek(0)
-        
+
         new_file = self.drive.create_file(
             name=self.filename,
             parent_id=folder_id,
             content=buffer.getvalue(),
-            mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime_type=XLSX_MIME_TYPE
         )
+        self._file_ids[folder_id] = new_file['id']
         return new_file['id']
 
-    def append_item(self, folder_id: str, item_data: dict, source_filename: str):
-        file_id = self.ensure_inventory_file(folder_id)
-        
-        # Download
-        content_bytes = self.drive.download_file(file_id)
-        
-        # Load Workbook
-        try:
-            wb = openpyxl.load_workbook(io.BytesIO(content_bytes))
-            ws = wb.active
-        except Exception as e:
-            print(f"Error loading Excel file: {e}. Creating new one.")
-            # Fallback if file is corrupted
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Inventory"
-            ws.append(["Date", "Item Name", "Category", "Merchant", "Total Amount", "Currency", "Confidence", "Source File"])
-
-        # Prepare row
+    @staticmethod
+    def row_key(generation, item_index: int = 0) -> str:
+        """
+        Stable key for item `item_index` of the shard blob `generation`.
+        """
+        return f"{generation}:{item_index}"
+
+    @staticmethod
+    def build_row(item_data: dict, source_filename: str, key: Optional[str] = None) -> list:
         # item_data is the JSON from Gemini
-        row = [
+        return [
             item_data.get('date'),
             item_data.get('item_name'),
             item_data.get('category'),
@@ -63,20 +96,166 @@ class InventoryAggregator:
             item_data.get('total_amount'),
             item_data.get('currency'),
             item_data.get('confidence'),
-            source_filename
+            source_filename,
+            key
         ]
-        
-        ws.append(row)
-        
-        # Save
+
+    def append_items(self, folder_id: str, batch: List[tuple]) -> int:
+        """
+        Appends (item_data, source_filename[, key]) tuples as a single store
+        segment. Keyed rows are upserts, so re-appending the same shard (event
+        redelivery, retries, reprocessing) never duplicates it.
+        Returns the number of rows written.
+        """
+        return self._append_rows(folder_id, [self.build_row(*entry) for entry in batch])
+
+    def _append_rows(self, folder_id: str, rows: List[list]) -> int:
+        if not rows:
+            return 0
+
+        self._ensure_store(folder_id)
+        self.store.append_rows(folder_id, rows)
+        print(f"Appended {len(rows)} item(s) to inventory store")
+        return len(rows)
+
+    def _ensure_store(self, folder_id: str):
+        """
+        Creates the store if needed and imports any pre-store XLSX before
+        anything is written or rendered. Import errors propagate: rendering
+        over an XLSX whose rows were never imported would delete them.
+        """
+        self.store.ensure_folder(folder_id)
+        if folder_id in self._imported:
+            return
+        if not self.store.legacy_imported(folder_id):
+            self._import_legacy_workbook(folder_id)
+            self.store.mark_legacy_imported(folder_id)
+        self._imported.add(folder_id)
+
+    def _import_legacy_workbook(self, folder_id: str):
+        """
+        Seeds the store with the rows of an XLSX written before the store
+        existed, so the first render does not drop them. Running it twice is
+        harmless: readers count same-name legacy segments once.
+        """
+        file = self.drive.find_file_by_name(self.filename, folder_id)
+        if not file:
+            return
+        if self._rendered_watermark(self.drive.get_file_metadata(file['id'])) is not None:
+            # Rendered from this store by a concurrent writer; nothing to import
+            return
+        wb = openpyxl.load_workbook(io.BytesIO(self.drive.download_file(file['id'])), read_only=True)
+        width = len(INVENTORY_HEADER)
+        rows = [list(row)[:width] + [None] * (width - len(row)) + [None]
+                for row in wb.active.iter_rows(min_row=2, values_only=True)]
+        self.store.append_rows(folder_id, rows, name=LEGACY_SEGMENT_NAME)
+        print(f"Imported {len(rows)} existing rows from {self.filename}")
+
+    @staticmethod
+    def _typed_row(row: list) -> list:
+        # CSV segments hold text; amounts go back into the sheet as numbers
+        row = list(row)
+        if len(row) > AMOUNT_COLUMN and row[AMOUNT_COLUMN] is not None:
+            try:
+                row[AMOUNT_COLUMN] = float(row[AMOUNT_COLUMN])
+            except ValueError:
+                pass
+        return row
+
+    @staticmethod
+    def _rendered_watermark(metadata: Dict) -> Optional[datetime]:
+        return _parse_drive_time((metadata.get('appProperties') or {}).get(RENDER_WATERMARK_PROPERTY))
+
+    def render_xlsx(self, folder_id: str) -> str:
+        """
+        Regenerates the XLSX from the store, streaming rows through openpyxl's
+        write-only mode so memory stays flat for large inventories. The XLSX
+        records the watermark of the snapshot it shows.
+        Returns the XLSX file ID.
+        """
+        self._ensure_store(folder_id)
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("Inventory")
+        ws.append(INVENTORY_HEADER)
+        count = 0
+        watermark, rows = self.store.snapshot(folder_id)
+        for row in rows:
+            ws.append(self._typed_row(row[:len(INVENTORY_HEADER)]))
+            count += 1
+
         buffer = io.BytesIO()
         wb.save(buffer)
         buffer.seek(0)
-        
-        # Update
-        self.drive.update_file(
-            file_id=file_id,
-            content=buffer.getvalue(),
-            mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        print(f"Appended item to {self.filename}")
+
+        file_id = self.ensure_inventory_file(folder_id)
+        # Streamed from the buffer itself rather than a second copy of the bytes
+        properties = {RENDER_WATERMARK_PROPERTY: watermark.isoformat()} if watermark else None
+        self.drive.update_file(file_id=file_id, content=buffer, mime_type=XLSX_MIME_TYPE, app_properties=properties)
+        print(f"Rendered {count} rows to {self.filename}")
+        return file_id
+
+    def render_if_stale(self, folder_id: str, debounce_seconds: int = DEFAULT_RENDER_DEBOUNCE_SECONDS) -> Optional[str]:
+        """
+        Renders the XLSX when the store has rows newer than the snapshot it
+        shows and the last render is at least `debounce_seconds` old.
+        Returns the XLSX ID if rendered.
+        """
+        self._ensure_store(folder_id)
+        latest = self.store.last_modified(folder_id)
+        if latest is None:
+            return None
+
+        file = self.drive.find_file_by_name(self.filename, folder_id)
+        if file:
+            metadata = self.drive.get_file_metadata(file['id'])
+            # Compared with what the render read, not when its upload landed:
+            # rows appended while it ran are newer than its watermark
+            watermark = self._rendered_watermark(metadata)
+            if watermark is not None and watermark >= latest:
+                return None
+            rendered_at = _parse_drive_time(metadata.get('modifiedTime'))
+            if rendered_at is not None and datetime.now(timezone.utc) - rendered_at < timedelta(seconds=debounce_seconds):
+                return None
+        return self.render_xlsx(folder_id)
+
+    def render_pending(self, folder_id: str) -> Optional[str]:
+        """
+        Trailing render: regenerates the XLSX if the store has rows newer than
+        the last render, ignoring the debounce window. Run it periodically so
+        the tail of a burst that render_if_stale() skipped still shows up.
+        Returns the XLSX ID if rendered.
+        """
+        return self.render_if_stale(folder_id, debounce_seconds=0)
+
+    def append_item(self, folder_id: str, item_data: dict, source_filename: str, key: Optional[str] = None):
+        self.append_items(folder_id, [(item_data, source_filename, key)])
+
+    def add_item(self, folder_id: str, item_data: dict, source_filename: str, key: Optional[str] = None):
+        """
+        Buffers a row; writes immediately when buffering is disabled.
+        """
+        if self.flush_every <= 0:
+            return self.append_item(folder_id, item_data, source_filename, key)
+
+        pending = self._pending.setdefault(folder_id, [])
+        pending.append(self.build_row(item_data, source_filename, key))
+        if len(pending) >= self.flush_every:
+            self.flush(folder_id)
+
+    def flush(self, folder_id: Optional[str] = None) -> int:
+        """
+        Writes buffered rows (for one folder, or all) and returns how many.
+        """
+        folder_ids = [folder_id] if folder_id is not None else list(self._pending)
+        written = 0
+        for fid in folder_ids:
+            rows = self._pending.pop(fid, [])
+            written += self._append_rows(fid, rows)
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
@@ -0,0 +1,179 @@
+"""
+Benchmark: serial vs thread-pool Drive uploads and listings through one
+shared DriveStorageAdapter, against a local fake Drive server that adds a
+fixed latency to every request (no network, no credentials).
+
+Usage: python benchmarks/bench_drive_concurrency.py [files] [workers] [latency_ms]
+"""
+import itertools
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared')))
+
+from drive_transport import DriveTransport, TokenBucket
+from id_cache import DriveIdCache
+from storage_adapter import DriveStorageAdapter, build_drive_service
+
+_PARENT_RE = re.compile(r"'([^']+)' in parents")
+_NAME_RE = re.compile(r"name = '([^']+)'")
+_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class FakeDrive:
+    """
+    Just enough of Drive v3 for the adapter: list, resumable create, media get.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.files = {}
+        self.sessions = {}
+        self.ids = itertools.count(1)
+
+
+def make_handler(drive: FakeDrive):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            # Headers and body are separate writes; don't let Nagle delay them
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            time.sleep(drive.latency)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path.endswith("/files"):
+                q = query.get("q", [""])[0]
+                parent = _PARENT_RE.search(q)
+                name = _NAME_RE.search(q)
+                with drive.lock:
+                    files = [
+                        {"id": file_id, "name": f["name"], "mimeType": f["mimeType"], "size": str(len(f["content"]))}
+                        for file_id, f in drive.files.items()
+                        if (not parent or parent.group(1) in f["parents"]) and (not name or name.group(1) == f["name"])
+                    ]
+                return self._send(200, json.dumps({"files": files}).encode())
+            file_id = url.path.rsplit("/", 1)[-1]
+            with drive.lock:
+                f = drive.files.get(file_id)
+            if f is None:
+                return self._send(404, b'{"error": {"code": 404}}')
+            if query.get("alt") == ["media"]:
+                return self._send(200, f["content"])
+            return self._send(200, json.dumps({"id": file_id, "name": f["name"]}).encode())
+
+        def do_POST(self):
+            time.sleep(drive.latency)
+            metadata = json.loads(self._body() or b"{}")
+            with drive.lock:
+                session_id = str(next(drive.ids))
+                drive.sessions[session_id] = {"metadata": metadata, "content": bytearray()}
+            host = f"http://{self.headers['Host']}"
+            self._send(200, headers={"Location": f"{host}/upload/session/{session_id}"})
+
+        def do_PUT(self):
+            time.sleep(drive.latency)
+            session_id = self.path.rsplit("/", 1)[-1]
+            data = self._body()
+            match = _RANGE_RE.match(self.headers.get("Content-Range", ""))
+            with drive.lock:
+                session = drive.sessions[session_id]
+                session["content"] += data
+                total = match.group(3) if match else str(len(data))
+                if total == "*" or len(session["content"]) < int(total):
+                    return self._send(308, headers={"Range": f"bytes=0-{len(session['content']) - 1}"})
+                file_id = f"file{next(drive.ids)}"
+                metadata = session["metadata"]
+                drive.files[file_id] = {
+                    "name": metadata.get("name"), "parents": metadata.get("parents", []),
+                    "mimeType": metadata.get("mimeType"), "content": bytes(session["content"]),
+                }
+                del drive.sessions[session_id]
+            self._send(200, json.dumps({"id": file_id}).encode())
+
+    return Handler
+
+
+def run(adapter, folder_id, n_files, workers, payload):
+    def upload(i):
+        return adapter.create_file(f"item-{i}.kintsu.json", folder_id, payload)["id"]
+
+    def listing(_):
+        return len(adapter.list_files(folder_id))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        ids = list(pool.map(upload, range(n_files)))
+        upload_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts = list(pool.map(listing, range(n_files // 10 or 1)))
+        list_s = time.perf_counter() - start
+
+    assert len(set(ids)) == n_files, "uploads lost or duplicated"
+    assert set(counts) == {n_files}, "listings disagree"
+    return upload_s, list_s
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 20.0) / 1000
+
+    drive = FakeDrive(latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(drive))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    # Unthrottled bucket: this measures the client, not the quota
+    transport = DriveTransport("bench", access_token="bench", bucket=TokenBucket(1e9), pool_size=workers)
+    adapter = DriveStorageAdapter(id_cache=DriveIdCache(), transport=transport,
+                                  service=build_drive_service(transport, root_url=root_url))
+    payload = json.dumps({"item_name": "Cordless Drill Kit", "total_amount": 129.99}).encode() * 50
+
+    try:
+        serial = run(adapter, "serial", n_files, 1, payload)
+        pooled = run(adapter, "pooled", n_files, workers, payload)
+    finally:
+        server.shutdown()
+        transport.close()
+
+    print(f"files={n_files} workers={workers} latency={latency * 1000:.0f}ms payload={len(payload)}B")
+    print(f"uploads   serial: {serial[0]:7.2f} s ({n_files / serial[0]:7.1f}/s)   "
+          f"{workers} threads: {pooled[0]:7.2f} s ({n_files / pooled[0]:7.1f}/s)  {serial[0] / pooled[0]:.1f}x")
+    print(f"listings  serial: {serial[1]:7.2f} s   {workers} threads: {pooled[1]:7.2f} s  {serial[1] / pooled[1]:.1f}x")
+    print(f"transport: {transport.metrics.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,391 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from storage_adapter import DriveStorageAdapter
+
+STORE_FOLDER_NAME = "Kintsu_Inventory_Store"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+SEGMENT_MIME_TYPE = "text/csv"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+
+# Sorts before every real segment; holds rows imported from a pre-store XLSX
+LEGACY_SEGMENT_NAME = f"{SEGMENT_PREFIX}19700101T000000000000-legacy.csv"
+# appProperties key on the store folder, set once that import is done
+LEGACY_IMPORTED_PROPERTY = "legacyImported"
+
+# Compacted rows of every folded segment; its first line lists the file IDs
+# of the segments the last compaction merged (until they are deleted)
+BASE_FILE_NAME = "inventory.base.csv"
+FOLDED_PREFIX = "# folded="
+# appProperties key on the base: Drive creation time of its newest segment
+NEWEST_SEGMENT_PROPERTY = "newestSegment"
+LOCK_FILE_NAME = "compaction.lock"
+
+COMPACT_MIN_SEGMENTS = 50
+# Segments younger than this may still be in flight from a concurrent writer
+COMPACT_GRACE_SECONDS = 60
+LEASE_SECONDS = 300
+
+
+def segment_name(now: Optional[datetime] = None) -> str:
+    """
+    Unique segment name whose lexical order is its creation order.
+    """
+    now = now or datetime.now(timezone.utc)
+    return f"{SEGMENT_PREFIX}{now.strftime(SEGMENT_TIME_FORMAT)}-{uuid.uuid4().hex[:8]}.csv"
+
+
+def segment_time(name: str) -> Optional[datetime]:
+    try:
+        stamp = name[len(SEGMENT_PREFIX):].split('-', 1)[0]
+        return datetime.strptime(stamp, SEGMENT_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def created_time(segment: Dict) -> Optional[datetime]:
+    """
+    When Drive stored the segment. The name's timestamp is only the writer's
+    clock when it started, which can be well before a slow upload landed.
+    """
+    value = segment.get('createdTime')
+    if value:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return segment_time(segment['name'])
+
+
+class InventoryStore:
+    """
+    Canonical inventory: append-only CSV segments in a Drive folder next to
+    the user-facing XLSX. An append is a single small file create; existing
+    data is never downloaded or rewritten, so any number of concurrent
+    writers can append without losing rows.
+
+    With a key column, rows are upserts: the latest row for a key replaces
+    earlier ones (keeping the first one's position) whenever the store is
+    read or compacted, so re-appending a row is a no-op for readers.
+
+    compact() folds old segments into a single base file and deletes exactly
+    the segment files it merged; the base names them, so readers skip any
+    that a crashed compaction left behind. Only one compactor runs at a
+    time: it must win a lease whose update is checked against the lock
+    file's Drive version (optimistic concurrency); losers back off and
+    leave their segments for the next run.
+    """
+
+    def __init__(self, drive_adapter: DriveStorageAdapter, header: List[str], key_column: Optional[str] = None):
+        self.drive = drive_adapter
+        self.header = list(header)
+        self.key_index = self.header.index(key_column) if key_column else None
+        self._folder_ids: Dict[str, List[str]] = {}
+
+    # --- Folders ---
+
+    def ensure_folder(self, parent_id: str) -> Tuple[str, bool]:
+        """
+        Returns (store folder ID, created) for the store under parent_id.
+        """
+        if parent_id in self._folder_ids:
+            return self._folder_ids[parent_id][0], False
+
+        created = False
+        if not self.drive.find_files_by_name(STORE_FOLDER_NAME, parent_id):
+            self.drive.create_file(STORE_FOLDER_NAME, parent_id, "", FOLDER_MIME_TYPE)
+            created = True
+
+        # Two first writers can each create a folder; everyone writes to the
+        # lowest ID and reads from all of them
+        folders = sorted(f['id'] for f in self.drive.find_files_by_name(STORE_FOLDER_NAME, parent_id))
+        self._folder_ids[parent_id] = folders
+        return folders[0], created
+
+    def _folders(self, parent_id: str) -> List[str]:
+        self.ensure_folder(parent_id)
+        return self._folder_ids[parent_id]
+
+    def legacy_imported(self, parent_id: str) -> bool:
+        """
+        Whether a pre-store XLSX under parent_id has been imported (or there
+        was none). Recorded apart from folder creation, so an import that
+        failed midway is retried rather than forgotten.
+        """
+        folder_id, _ = self.ensure_folder(parent_id)
+        properties = self.drive.get_file_metadata(folder_id).get('appProperties') or {}
+        return properties.get(LEGACY_IMPORTED_PROPERTY) == "true"
+
+    def mark_legacy_imported(self, parent_id: str):
+        folder_id, _ = self.ensure_folder(parent_id)
+        self.drive.set_app_properties(folder_id, {LEGACY_IMPORTED_PROPERTY: "true"})
+
+    def _find_one(self, parent_id: str, name: str) -> Optional[str]:
+        files = self.drive.find_files_by_name(name, self.ensure_folder(parent_id)[0])
+        return min(f['id'] for f in files) if files else None
+
+    # --- Segments ---
+
+    def encode_rows(self, rows: List[list], folded: Optional[List[str]] = None) -> bytes:
+        buffer = io.StringIO()
+        if folded is not None:
+            buffer.write(f"{FOLDED_PREFIX}{','.join(folded)}\n")
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def decode_rows(self, content: bytes) -> Tuple[Set[str], List[list]]:
+        """
+        Returns (folded segment IDs, rows) for a segment or base file. Columns are
+        matched by header name, so files written with an older header still
+        line up (missing columns read as None).
+        """
+        text = content.decode('utf-8')
+        folded = set()
+        if text.startswith(FOLDED_PREFIX):
+            first_line, _, text = text.partition('\n')
+            folded = {file_id for file_id in first_line[len(FOLDED_PREFIX):].split(',') if file_id}
+        rows = list(csv.reader(io.StringIO(text)))
+        if not rows:
+            return folded, []
+
+        file_header = rows[0]
+        positions = [file_header.index(column) if column in file_header else None for column in self.header]
+        # Empty CSV cells come back as None, like empty spreadsheet cells
+        return folded, [
+            [row[p] if p is not None and p < len(row) and row[p] != '' else None for p in positions]
+            for row in rows[1:]
+        ]
+
+    def upsert(self, rows: Iterable[list]) -> Iterator[list]:
+        """
+        Collapses rows sharing a key: the latest values win, at the position
+        of the key's first row. Unkeyed rows pass through unchanged.
+        """
+        if self.key_index is None:
+            yield from rows
+            return
+
+        merged: List[list] = []
+        positions: Dict[str, int] = {}
+        for row in rows:
+            key = row[self.key_index]
+            if key is None:
+                merged.append(row)
+            elif key in positions:
+                merged[positions[key]] = row
+            else:
+                positions[key] = len(merged)
+                merged.append(row)
+        yield from merged
+
+    def append_rows(self, parent_id: str, rows: List[list], name: Optional[str] = None) -> Optional[str]:
+        """
+        Writes rows as one new segment. Returns the segment's file ID.
+        """
+        if not rows:
+            return None
+        folder_id, _ = self.ensure_folder(parent_id)
+        segment = self.drive.create_file(name or segment_name(), folder_id, self.encode_rows(rows), SEGMENT_MIME_TYPE)
+        return segment.get('id')
+
+    def list_segments(self, parent_id: str, folded: Iterable[str] = ()) -> List[Dict]:
+        """
+        Segment files in name (creation) order, leaving out the IDs in
+        `folded`. Duplicate names (e.g. a legacy import run twice) count
+        once; the IDs of the ignored copies are kept under 'duplicates'.
+        """
+        folded = set(folded)
+        segments = {}
+        for folder_id in self._folders(parent_id):
+            for f in self.drive.list_files(folder_id):
+                if not f['name'].startswith(SEGMENT_PREFIX) or f['path'] in folded:
+                    continue
+                if f['name'] in segments:
+                    segments[f['name']].setdefault('duplicates', []).append(f['path'])
+                else:
+                    segments[f['name']] = dict(f)
+        return [segments[name] for name in sorted(segments)]
+
+    def read_segment(self, segment: Dict) -> List[list]:
+        return self.decode_rows(self.drive.download_file(segment['path']))[1]
+
+    def read_base(self, parent_id: str) -> Tuple[Optional[str], Set[str], List[list]]:
+        """
+        Returns (base file ID, folded segment IDs, rows); (None, set(), [])
+        before the first compaction.
+        """
+        base_id = self._find_one(parent_id, BASE_FILE_NAME)
+        if base_id is None:
+            return None, set(), []
+        folded, rows = self.decode_rows(self.drive.download_file(base_id))
+        return base_id, folded, rows
+
+    def _base_newest(self, base_id: Optional[str]) -> Optional[datetime]:
+        # Kept in the base's metadata, so its content is never downloaded for this
+        if base_id is None:
+            return None
+        newest = (self.drive.get_file_metadata(base_id).get('appProperties') or {}).get(NEWEST_SEGMENT_PROPERTY)
+        return datetime.fromisoformat(newest) if newest else None
+
+    @staticmethod
+    def _newest(segments: List[Dict], base_newest: Optional[datetime]) -> Optional[datetime]:
+        times = [created_time(segment) for segment in segments] + [base_newest]
+        times = [t for t in times if t is not None]
+        return max(times) if times else None
+
+    def iter_rows(self, parent_id: str) -> Iterator[list]:
+        return self.snapshot(parent_id)[1]
+
+    def snapshot(self, parent_id: str) -> Tuple[Optional[datetime], Iterator[list]]:
+        """
+        Lists the store once and returns (watermark, rows): the creation time
+        of the newest segment the rows include (None for an empty store) and
+        the upserted rows themselves. A segment created after the listing is
+        newer than the watermark even if it lands while the rows are read.
+        """
+        base_id, folded, base_rows = self.read_base(parent_id)
+        segments = self.list_segments(parent_id, folded)
+        watermark = self._newest(segments, self._base_newest(base_id))
+
+        def raw_rows():
+            yield from base_rows
+            for segment in segments:
+                yield from self.read_segment(segment)
+
+        return watermark, self.upsert(raw_rows())
+
+    def last_modified(self, parent_id: str) -> Optional[datetime]:
+        """
+        Creation time of the newest segment (compacted or not), or None for
+        an empty store. Comparable with snapshot()'s watermark.
+        """
+        return self._newest(self.list_segments(parent_id),
+                            self._base_newest(self._find_one(parent_id, BASE_FILE_NAME)))
+
+    # --- Compaction ---
+
+    def _lock_file_id(self, parent_id: str) -> str:
+        lock_id = self._find_one(parent_id, LOCK_FILE_NAME)
+        if lock_id is None:
+            expired = json.dumps({"owner": None, "expires": datetime.fromtimestamp(0, timezone.utc).isoformat()})
+            self.drive.create_file(LOCK_FILE_NAME, self.ensure_folder(parent_id)[0], expired)
+            # A concurrent creator may have made one too; both settle on the lowest ID
+            lock_id = self._find_one(parent_id, LOCK_FILE_NAME)
+        return lock_id
+
+    def _write_lease(self, lock_id: str, owner: str, expires: datetime) -> Dict:
+        return self.drive.update_file(lock_id, json.dumps({"owner": owner, "expires": expires.isoformat()}))
+
+    def holds_lease(self, lock_id: str, owner: str) -> bool:
+        """
+        Whether the lock file still names `owner` (a per-attempt nonce).
+        """
+        return json.loads(self.drive.download_file(lock_id)).get('owner') == owner
+
+    def acquire_lease(self, parent_id: str, owner: str) -> Optional[str]:
+        """
+        Takes the compaction lease. The update only counts if it landed (the
+        lock file's version increased; Drive only promises it grows, not by
+        how much) and the lease reads back with our owner nonce: of racing
+        writers, the last one wins. Returns the lock file ID, or None.
+        """
+        lock_id = self._lock_file_id(parent_id)
+        version = int(self.drive.get_file_metadata(lock_id).get('version', 0))
+        lease = json.loads(self.drive.download_file(lock_id))
+        now = datetime.now(timezone.utc)
+        if lease.get('owner') not in (None, owner) and datetime.fromisoformat(lease['expires']) > now:
+            return None
+
+        updated = self._write_lease(lock_id, owner, now + timedelta(seconds=LEASE_SECONDS))
+        if int(updated.get('version', -1)) <= version:
+            return None
+        if not self.holds_lease(lock_id, owner):
+            return None
+        return lock_id
+
+    def release_lease(self, lock_id: str, owner: str):
+        # Never clobber a lease someone else took over
+        if self.holds_lease(lock_id, owner):
+            self._write_lease(lock_id, owner, datetime.now(timezone.utc))
+
+    def compact(self, parent_id: str, min_segments: int = COMPACT_MIN_SEGMENTS,
+                grace_seconds: int = COMPACT_GRACE_SECONDS) -> int:
+        """
+        Folds settled segments into the base file and deletes them. Returns
+        the number of segments compacted (0 if skipped or the lease was lost).
+        Deciding to skip costs one listing; the base is only downloaded
+        under the lease.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+        # Leftovers of a crashed compaction count here too; they are rare and
+        # only make the check below optimistic
+        if len(self._settled(self.list_segments(parent_id), cutoff)) < min_segments:
+            return 0
+
+        owner = uuid.uuid4().hex
+        lock_id = self.acquire_lease(parent_id, owner)
+        if lock_id is None:
+            print("Inventory compaction already running elsewhere; skipping.")
+            return 0
+
+        try:
+            # Re-read under the lease: another compactor may have just finished
+            base_id, folded, rows = self.read_base(parent_id)
+            # Segments the last compaction merged but did not get to delete
+            self._delete_segments(folded)
+            settled = self._settled(self.list_segments(parent_id, folded), cutoff)
+            if not settled:
+                return 0
+            for segment in settled:
+                rows.extend(self.read_segment(segment))
+            # The base holds one row per key
+            rows = list(self.upsert(rows))
+
+            # Ignored same-name copies go with the segment they duplicate
+            merged = [file_id for segment in settled for file_id in [segment['path']] + segment.get('duplicates', [])]
+            content = self.encode_rows(rows, folded=merged)
+            # A writer that overwrote our lease after we read it back wins;
+            # re-check right before the only write that matters
+            if not self.holds_lease(lock_id, owner):
+                print("Inventory compaction lease lost; leaving segments for the next run.")
+                return 0
+            newest = {NEWEST_SEGMENT_PROPERTY: max(created_time(segment) for segment in settled).isoformat()}
+            if base_id is None:
+                self.drive.create_file(BASE_FILE_NAME, self.ensure_folder(parent_id)[0], content, SEGMENT_MIME_TYPE,
+                                       app_properties=newest)
+            else:
+                self.drive.update_file(base_id, content, SEGMENT_MIME_TYPE, app_properties=newest)
+
+            # Readers skip the folded IDs, so a crash here only leaves garbage
+            # for the next compaction to delete
+            self._delete_segments(merged)
+            print(f"Compacted {len(settled)} inventory segments ({len(rows)} rows)")
+            return len(settled)
+        finally:
+            self.release_lease(lock_id, owner)
+
+    def _delete_segments(self, file_ids: Iterable[str]):
+        for file_id in file_ids:
+            try:
+                self.drive.delete_file(file_id)
+            except Exception as e:
+                # Already gone (e.g. deleted by an earlier attempt); the base
+                # keeps skipping it either way
+                print(f"Could not delete inventory segment {file_id}: {e}")
+
+    def _settled(self, segments: List[Dict], cutoff: datetime) -> List[Dict]:
+        """
+        The leading segments (in name order) that Drive created before the
+        cutoff. A segment still being uploaded, or one whose upload landed
+        late, stops the prefix, so rows keep their order across compactions.
+        """
+        settled = []
+        for segment in segments:
+            created = created_time(segment)
+            if created is not None and created > cutoff:
+                break
+            settled.append(segment)
+        return settled
@@ -1,6 +1,7 @@
 import functions_framework
 from google.cloud import storage, firestore
 from google import genai
+from googleapiclient.errors import HttpError
 import os
 import json
 import zipfile
@@ -21,6 +22,10 @@ except ImportError as e:
 storage_client = storage.Client()
 db = firestore.Client()
 
+# Shard events re-render the XLSX at most once per window; render_inventory
+# (run by Cloud Scheduler) picks up whatever the last window skipped
+INVENTORY_RENDER_DEBOUNCE_SECONDS = int(os.getenv("INVENTORY_RENDER_DEBOUNCE_SECONDS", "300"))
+
 # Configure Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 client = None
@@ -147,6 +152,38 @@ def extract_data_with_gemini(blob, mime_type):
             except Exception as e:
                 print(f"Failed to delete Gemini file: {e}")
 
+def find_or_create_kintsu_folder(drive_adapter):
+    """
+    ID of the 'Kintsu' folder in the service account's Drive root.
+    """
+    kintsu_folder = drive_adapter.find_file_by_name("Kintsu", "root")
+    if not kintsu_folder:
+        print("Creating Kintsu folder in Drive...")
+        kintsu_folder = drive_adapter.create_file("Kintsu", "root", "", "application/vnd.google-apps.folder")
+    return kintsu_folder['id']
+
+@functions_framework.http
+def render_inventory(request):
+    """
+    Trailing inventory render, triggered by Cloud Scheduler via HTTP.
+    Shard events debounce their renders, so the last rows of a burst would
+    otherwise wait for an unrelated shard; this renders them once the
+    store is newer than the XLSX.
+    """
+    try:
+        drive_adapter = DriveStorageAdapter()
+
+        def render(kintsu_folder_id):
+            aggregator = InventoryAggregator(drive_adapter)
+            aggregator.store.compact(kintsu_folder_id)
+            return aggregator.render_pending(kintsu_folder_id)
+
+        rendered = drive_adapter.in_folder(lambda: find_or_create_kintsu_folder(drive_adapter), render)
+    except Exception as e:
+        print(f"Trailing inventory render failed: {e}")
+        return {"status": "error", "message": str(e)}, 500
+    return {"status": "success", "rendered": rendered is not None}
+
 @functions_framework.cloud_event
 def process_new_shard(cloud_event):
     """
@@ -209,32 +246,49 @@ def process_new_shard(cloud_event):
             # BYOS Implementation
             try:
                 drive_adapter = DriveStorageAdapter()
-                
-                # Find or Create 'Kintsu' folder in Drive Root
-                kintsu_folder = drive_adapter.find_file_by_name("Kintsu", "root")
-                if not kintsu_folder:
-                    print("Creating Kintsu folder in Drive...")
-                    kintsu_folder = drive_adapter.create_file("Kintsu", "root", "", "application/vnd.google-apps.folder")
-                
-                kintsu_folder_id = kintsu_folder['id']
 
-                # 1. Write Sidecar (.kintsu.json)
-                sidecar_name = f"{os.path.basename(file_name)}.kintsu.json"
-                sidecar_content = json.dumps(extracted_data, indent=2)
-                
-                # Check if exists to update or create? For now assume create (overwrite usually requires update in Drive)
-                # Helper to check?
-                existing_sidecar = drive_adapter.find_file_by_name(sidecar_name, kintsu_folder_id)
-                if existing_sidecar:
-                    new_file = drive_adapter.update_file(existing_sidecar['id'], sidecar_content)
-                else:
-                    new_file = drive_adapter.create_file(sidecar_name, kintsu_folder_id, sidecar_content)
-                
-                print(f"Sidecar created/updated: {new_file.get('id')}")
+                def write_to_kintsu(kintsu_folder_id):
+                    # 1. Write Sidecar (.kintsu.json)
+                    sidecar_name = f"{os.path.basename(file_name)}.kintsu.json"
+                    sidecar_content = json.dumps(extracted_data, indent=2)
+
+                    existing_sidecar = drive_adapter.find_file_by_name(sidecar_name, kintsu_folder_id)
+                    new_file = None
+                    if existing_sidecar:
+                        try:
+                            new_file = drive_adapter.update_file(existing_sidecar['id'], sidecar_content)
+                        except HttpError as e:
+                            # Cached ID of a sidecar deleted since; the adapter already evicted it
+                            if e.resp.status != 404:
+                                raise
+                    if new_file is None:
+                        new_file = drive_adapter.create_file(sidecar_name, kintsu_folder_id, sidecar_content)
 
-                # 2. Append to Master Inventory
-                aggregator = InventoryAggregator(drive_adapter)
-                aggregator.append_item(kintsu_folder_id, extracted_data, os.path.basename(file_name))
+                    print(f"Sidecar created/updated: {new_file.get('id')}")
+
+                    # 2. Append to Master Inventory
+                    aggregator = InventoryAggregator(drive_adapter)
+                    # Keyed by blob generation: redelivered events upsert instead of duplicating
+                    aggregator.append_item(
+                        kintsu_folder_id, extracted_data, os.path.basename(file_name),
+                        key=InventoryAggregator.row_key(blob.generation)
+                    )
+                    return kintsu_folder_id, aggregator, new_file
+
+                # Find or Create 'Kintsu' folder in Drive Root; a cached ID of a
+                # deleted folder is resolved again instead of failing the shard
+                kintsu_folder_id, aggregator, new_file = drive_adapter.in_folder(
+                    lambda: find_or_create_kintsu_folder(drive_adapter), write_to_kintsu
+                )
+
+                # Old segments are folded into the base (one compactor at a time), then
+                # the XLSX export is re-rendered at most once per debounce window;
+                # render_inventory catches up on whatever the window skipped
+                try:
+                    aggregator.store.compact(kintsu_folder_id)
+                    aggregator.render_if_stale(kintsu_folder_id, INVENTORY_RENDER_DEBOUNCE_SECONDS)
+                except Exception as e:
+                    print(f"Inventory render failed (rows are safe in the store): {e}")
 
                 # 3. Update Firestore (Status Only)
                 db.collection("shards").document(shard_id).update({
@@ -242,7 +296,7 @@ def process_new_shard(cloud_event):
                     "driveFileId": new_file.get('id'),
                     "refinedAt": firestore.SERVER_TIMESTAMP
                 })
-                print(f"Shard {shard_id} refined (BYOS Mode).")
+                print(f"Shard {shard_id} refined (BYOS Mode). Drive calls so far: {drive_adapter.transport.metrics.snapshot()}")
 
                 # 4. Cleanup Source Blob
                 try:
@@ -1,9 +1,102 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, TypeVar
 import io
+import json
+import tempfile
+import threading
 import google.auth
-from googleapiclient.discovery import build
+from google.auth.transport.requests import AuthorizedSession
+import requests
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
+from id_cache import DriveIdCache, shared_cache
+from drive_transport import DriveTransport
+
+T = TypeVar('T')
+
+# Token bucket key of the function's own (service account) Drive identity
+SERVICE_ACCOUNT_KEY = "service-account"
+
+_drive_service = None
+_drive_transport = None
+_drive_service_lock = threading.Lock()
+
+# Drive requires every resumable chunk but the last to be a multiple of 256 KiB
+CHUNK_GRANULARITY = 256 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Times an upload resumes from the committed offset once the transport has
+# given up on a chunk request
+UPLOAD_RETRIES = 5
+
+def get_drive_transport() -> DriveTransport:
+    """
+    Process-wide Drive transport for the service credentials: a pooled
+    session that refreshes tokens through google-auth, rate limited by the
+    service account's own token bucket.
+    """
+    global _drive_transport
+    if _drive_transport is None:
+        with _drive_service_lock:
+            if _drive_transport is None:
+                creds, _ = google.auth.default()
+                _drive_transport = DriveTransport(SERVICE_ACCOUNT_KEY, session_factory=lambda: AuthorizedSession(creds))
+    return _drive_transport
+
+def get_drive_service():
+    """
+    Process-wide Drive client, built on first use and reused by every adapter
+    (and every warm invocation). All its requests go through the shared
+    transport; the API surface comes from the discovery document bundled
+    with google-api-python-client, so nothing is fetched over the network.
+    """
+    global _drive_service
+    if _drive_service is None:
+        transport = get_drive_transport()
+        with _drive_service_lock:
+            if _drive_service is None:
+                _drive_service = build_drive_service(transport)
+    return _drive_service
+
+def build_drive_service(transport: DriveTransport, root_url: Optional[str] = None):
+    """
+    Drive client over `transport`. The transport keeps one session per
+    thread, so the client can be shared by worker threads (an httplib2-based
+    client cannot). root_url points the API and upload endpoints elsewhere,
+    e.g. at a local fake Drive.
+    """
+    document = json.loads(get_static_doc('drive', 'v3'))
+    if root_url:
+        document['rootUrl'] = root_url
+        document['baseUrl'] = root_url + document['servicePath']
+    return build_from_document(document, http=transport.http())
+
+def media_stream(content, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """
+    Seekable byte stream over upload content: str, bytes, a file-like object
+    (uploaded from its start) or an iterator of str/bytes pieces.
+
+    Resuming after a failure rewinds to the committed offset, so one-shot
+    streams and iterators are spooled through a temporary file that stays
+    in memory only up to one chunk.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if isinstance(content, (bytes, bytearray)):
+        return io.BytesIO(content)
+    if hasattr(content, 'read'):
+        if getattr(content, 'seekable', lambda: False)():
+            return content
+        pieces = iter(lambda: content.read(chunk_size), content.read(0))
+    else:
+        pieces = content
+
+    spool = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+    for piece in pieces:
+        spool.write(piece.encode('utf-8') if isinstance(piece, str) else piece)
+    spool.seek(0)
+    return spool
 
 class StorageAdapter(ABC):
     @abstractmethod
@@ -17,14 +110,65 @@ class StorageAdapter(ABC):
         pass
 
 class DriveStorageAdapter(StorageAdapter):
-    def __init__(self, root_folder_id: Optional[str] = None):
+    def __init__(self, root_folder_id: Optional[str] = None, id_cache: Optional[DriveIdCache] = None,
+                 transport: Optional[DriveTransport] = None, service=None):
         """
-        Initialize Drive Service.
+        Initialize Drive Service. One adapter can be shared by threads.
         root_folder_id: Optional ID to act as the 'root' for relative paths.
+        id_cache: name -> ID lookup cache (defaults to the process-wide one).
+        transport/service: defaults to the process-wide service-account client.
         """
-        creds, _ = google.auth.default()
-        self.service = build('drive', 'v3', credentials=creds)
+        self.transport = transport or get_drive_transport()
+        self.service = service or (build_drive_service(transport) if transport else get_drive_service())
         self.root_id = root_folder_id
+        self.id_cache = id_cache if id_cache is not None else shared_cache
+
+    def _execute(self, request, *file_ids: str):
+        """
+        Executes a Drive request. A 404 means a cached ID went stale, so the
+        IDs involved are evicted before the error propagates.
+        """
+        try:
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                for file_id in file_ids:
+                    self.id_cache.invalidate(file_id)
+            raise
+
+    def _upload(self, request, *file_ids: str) -> Dict:
+        """
+        Runs a resumable upload chunk by chunk. The transport retries each
+        chunk request; if it still fails, the next call first asks the
+        session how many bytes it committed, so a failed chunk never
+        restarts the whole upload.
+        """
+        response = None
+        resumes = 0
+        try:
+            while response is None:
+                try:
+                    _, response = request.next_chunk()
+                except (requests.ConnectionError, requests.Timeout):
+                    resumes += 1
+                    if resumes > UPLOAD_RETRIES:
+                        raise
+        except HttpError as e:
+            if e.resp.status == 404:
+                for file_id in file_ids:
+                    self.id_cache.invalidate(file_id)
+            raise
+        return response
+
+    def _media(self, content, mime_type: str, chunk_size: int) -> MediaIoBaseUpload:
+        if chunk_size % CHUNK_GRANULARITY:
+            raise ValueError(f"chunk_size must be a multiple of {CHUNK_GRANULARITY} bytes")
+        return MediaIoBaseUpload(
+            media_stream(content, chunk_size),
+            mimetype=mime_type,
+            chunksize=chunk_size,
+            resumable=True
+        )
 
     def list_files(self, folder_id: str) -> List[Dict]:
         """
@@ -37,19 +181,20 @@ class DriveStorageAdapter(StorageAdapter):
         query = f"'{folder_id}' in parents and trashed = false"
 
         while True:
-            response = self.service.files().list(
+            response = self._execute(self.service.files().list(
                 q=query,
                 spaces='drive',
-                fields='nextPageToken, files(id, name, mimeType, size)',
+                fields='nextPageToken, files(id, name, mimeType, size, createdTime)',
                 pageToken=page_token
-            ).execute()
+            ), folder_id)
             
             for file in response.get('files', []):
                 results.append({
                     "name": file.get('name'),
                     "path": file.get('id'), # Using ID as path for Drive
                     "size": int(file.get('size', 0)),
-                    "mimeType": file.get('mimeType')
+                    "mimeType": file.get('mimeType'),
+                    "createdTime": file.get('createdTime')
                 })
                 
             page_token = response.get('nextPageToken', None)
@@ -60,74 +205,74 @@ class DriveStorageAdapter(StorageAdapter):
 
     def get_file_metadata(self, file_id: str) -> Dict:
         try:
-            file = self.service.files().get(
+            file = self._execute(self.service.files().get(
                 fileId=file_id,
-                fields='id, name, mimeType, size, modifiedTime, parents'
-            ).execute()
+                fields='id, name, mimeType, size, modifiedTime, parents, version, appProperties'
+            ), file_id)
             return file
         except Exception as e:
             print(f"Error getting metadata for {file_id}: {e}")
             return {}
 
-    def create_file(self, name: str, parent_id: str, content: any, mime_type: str = 'application/json') -> Dict:
+    def create_file(self, name: str, parent_id: str, content: any, mime_type: str = 'application/json',
+                    chunk_size: int = UPLOAD_CHUNK_SIZE, app_properties: Optional[Dict[str, str]] = None) -> Dict:
         """
-        Create a file or folder in a specific folder. Content can be str or bytes.
+        Create a file or folder in a specific folder. Content can be str, bytes,
+        a file-like object or an iterator of chunks; it is streamed in
+        `chunk_size` pieces through a resumable upload session.
         If mime_type is 'application/vnd.google-apps.folder', content is ignored.
+        app_properties: small private key/value pairs kept in the file's metadata.
         """
         file_metadata = {
             'name': name,
             'parents': [parent_id],
             'mimeType': mime_type
         }
+        if app_properties:
+            file_metadata['appProperties'] = app_properties
         
         if mime_type == 'application/vnd.google-apps.folder':
-            file = self.service.files().create(
+            file = self._execute(self.service.files().create(
                 body=file_metadata,
                 fields='id'
-            ).execute()
+            ), parent_id)
         else:
-            if isinstance(content, str):
-                content_bytes = content.encode('utf-8')
-            else:
-                content_bytes = content
-
-            media = MediaIoBaseUpload(
-                io.BytesIO(content_bytes),
-                mimetype=mime_type,
-                resumable=True
-            )
-            
-            file = self.service.files().create(
+            file = self._upload(self.service.files().create(
                 body=file_metadata,
-                media_body=media,
+                media_body=self._media(content, mime_type, chunk_size),
                 fields='id'
-            ).execute()
-        
+            ), parent_id)
+
+        self.id_cache.put(parent_id, name, file.get('id'))
         return file
 
-    def update_file(self, file_id: str, content: any, mime_type: str = 'application/json') -> Dict:
+    def update_file(self, file_id: str, content: any, mime_type: str = 'application/json',
+                    chunk_size: int = UPLOAD_CHUNK_SIZE, app_properties: Optional[Dict[str, str]] = None) -> Dict:
         """
-        Update an existing file's content. Content can be str or bytes.
+        Update an existing file's content (and app_properties, if given).
+        Accepts the same content types as create_file().
         """
-        if isinstance(content, str):
-            content_bytes = content.encode('utf-8')
-        else:
-            content_bytes = content
-
-        media = MediaIoBaseUpload(
-            io.BytesIO(content_bytes),
-            mimetype=mime_type,
-            resumable=True
-        )
-
-        file = self.service.files().update(
+        metadata = {'body': {'appProperties': app_properties}} if app_properties else {}
+        file = self._upload(self.service.files().update(
             fileId=file_id,
-            media_body=media,
-            fields='id'
-        ).execute()
+            **metadata,
+            media_body=self._media(content, mime_type, chunk_size),
+            fields='id, version'
+        ), file_id)
         
         return file
 
+    def set_app_properties(self, file_id: str, app_properties: Dict[str, str]) -> Dict:
+        """
+        Merges app_properties into a file's (or folder's) metadata without
+        touching its content.
+        """
+        return self._execute(self.service.files().update(
+            fileId=file_id,
+            body={'appProperties': app_properties},
+            fields='id, appProperties'
+        ), file_id)
+
     def download_file(self, file_id: str) -> bytes:
         """
         Download a file's content as bytes.
@@ -136,17 +281,62 @@ class DriveStorageAdapter(StorageAdapter):
         fh = io.BytesIO()
         downloader = MediaIoBaseDownload(fh, request)
         done = False
-        while done is False:
-            status, done = downloader.next_chunk()
+        try:
+            while done is False:
+                status, done = downloader.next_chunk()
+        except HttpError as e:
+            if e.resp.status == 404:
+                self.id_cache.invalidate(file_id)
+            raise
         return fh.getvalue()
     
+    def delete_file(self, file_id: str):
+        """
+        Permanently deletes a file.
+        """
+        try:
+            self._execute(self.service.files().delete(fileId=file_id), file_id)
+        finally:
+            self.id_cache.invalidate(file_id)
+
+    def in_folder(self, resolve: Callable[[], str], action: Callable[[str], T]) -> T:
+        """
+        Runs action(folder_id) on the folder ID resolve() returns. A 404 on
+        the way usually means a cached folder ID was deleted since: it is
+        evicted (with everything cached beneath it) and resolved again, once,
+        before the error stands. `action` must be safe to run twice.
+        """
+        folder_id = resolve()
+        try:
+            return action(folder_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print(f"Folder {folder_id} is gone; resolving it again")
+            self.id_cache.invalidate(folder_id)
+        return action(resolve())
+
+    def find_files_by_name(self, name: str, parent_id: str) -> List[Dict]:
+        """
+        All files with this name in a parent folder (Drive allows duplicates).
+        """
+        query = f"name = '{name}' and '{parent_id}' in parents and trashed = false"
+        results = self.service.files().list(q=query, fields='files(id, name)').execute()
+        return results.get('files', [])
+
     def find_file_by_name(self, name: str, parent_id: str) -> Optional[Dict]:
         """
-        Finds a file by name in a specific parent folder.
+        Finds a file by name in a specific parent folder. Hits are cached, so
+        repeated folder resolution costs no round-trips on warm instances.
         """
+        cached_id = self.id_cache.get(parent_id, name)
+        if cached_id:
+            return {'id': cached_id, 'name': name}
+
         query = f"name = '{name}' and '{parent_id}' in parents and trashed = false"
         results = self.service.files().list(q=query, fields='files(id, name)').execute()
         files = results.get('files', [])
         if files:
+            self.id_cache.put(parent_id, name, files[0]['id'])
             return files[0]
         return None
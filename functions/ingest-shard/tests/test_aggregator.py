@@ -3,11 +3,17 @@ from unittest.mock import MagicMock, patch
 import sys
 import os
 import io
+import json
 import openpyxl
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared')))
 
-from aggregator import InventoryAggregator
+from datetime import datetime, timedelta, timezone
+
+from aggregator import InventoryAggregator, INVENTORY_HEADER
+from inventory_store import STORE_FOLDER_NAME
 
 @pytest.fixture
 def mock_drive_adapter():
@@ -32,30 +38,386 @@ def test_ensure_inventory_file_creates_new(mock_drive_adapter):
     assert res == 'new_id'
     mock_drive_adapter.create_file.assert_called_once()
 
-def test_append_item(mock_drive_adapter):
-    agg = InventoryAggregator(mock_drive_adapter)
-    
-    # Mock existing file
-    mock_drive_adapter.find_file_by_name.return_value = {'id': 'file_id'}
-    
-    # Mock download content (empty excel)
+class FakeDrive:
+    """
+    In-memory stand-in for DriveStorageAdapter (files keyed by ID).
+    """
+    def __init__(self):
+        self.files = {}
+        self.calls = []
+
+    def find_files_by_name(self, name, parent_id):
+        return [{'id': file_id, 'name': name} for file_id, f in self.files.items()
+                if f['name'] == name and f['parent'] == parent_id]
+
+    def find_file_by_name(self, name, parent_id):
+        self.calls.append('find')
+        files = self.find_files_by_name(name, parent_id)
+        return files[0] if files else None
+
+    def create_file(self, name, parent_id, content, mime_type='application/json', app_properties=None):
+        self.calls.append('create')
+        file_id = f"id_{len(self.calls):04d}"
+        if hasattr(content, 'read'):
+            content = content.read()
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.files[file_id] = {'name': name, 'parent': parent_id, 'content': content, 'modifiedTime': None, 'version': 1,
+                               'createdTime': datetime.now(timezone.utc).isoformat(), 'appProperties': app_properties}
+        return {'id': file_id}
+
+    def update_file(self, file_id, content, mime_type='application/json', app_properties=None):
+        self.calls.append('update')
+        if hasattr(content, 'read'):
+            content = content.read()
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.files[file_id]['content'] = content
+        self.files[file_id]['version'] += 1
+        if app_properties:
+            self.files[file_id]['appProperties'] = app_properties
+        return {'id': file_id, 'version': self.files[file_id]['version']}
+
+    def set_app_properties(self, file_id, app_properties):
+        self.calls.append('properties')
+        self.files[file_id]['appProperties'] = dict(self.files[file_id]['appProperties'] or {}, **app_properties)
+        return {'id': file_id}
+
+    def delete_file(self, file_id):
+        self.calls.append('delete')
+        del self.files[file_id]
+
+    def download_file(self, file_id):
+        self.calls.append('download')
+        return self.files[file_id]['content']
+
+    def list_files(self, folder_id):
+        return [{'name': f['name'], 'path': file_id, 'size': 0, 'mimeType': None, 'createdTime': f['createdTime']}
+                for file_id, f in self.files.items() if f['parent'] == folder_id]
+
+    def get_file_metadata(self, file_id):
+        f = self.files[file_id]
+        return {'id': file_id, 'modifiedTime': f['modifiedTime'], 'version': f['version'], 'appProperties': f['appProperties']}
+
+    def xlsx_rows(self, name="Kintsu_Inventory.xlsx"):
+        content = next(f['content'] for f in self.files.values() if f['name'] == name)
+        ws = openpyxl.load_workbook(io.BytesIO(content)).active
+        return [list(r) for r in ws.iter_rows(values_only=True)]
+
+def _workbook_bytes(rows):
     wb = openpyxl.Workbook()
     ws = wb.active
-    ws.append(["Header"])
+    for row in rows:
+        ws.append(row)
     buffer = io.BytesIO()
     wb.save(buffer)
-    mock_drive_adapter.download_file.return_value = buffer.getvalue()
-    
+    return buffer.getvalue()
+
+def test_append_item():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+
     item_data = {
         "date": "2023-01-01",
         "item_name": "Test Item",
         "total_amount": 100
     }
-    
+
     agg.append_item("folder_id", item_data, "source.jpg")
-    
-    # Verify update called
-    mock_drive_adapter.update_file.assert_called_once()
-    # verify content?
-    call_args = mock_drive_adapter.update_file.call_args
-    assert call_args[1]['file_id'] == 'file_id'
+
+    # One new segment; nothing is downloaded or rewritten
+    assert 'download' not in drive.calls and 'update' not in drive.calls
+    assert len(agg.store.list_segments("folder_id")) == 1
+    assert list(agg.store.iter_rows("folder_id")) == [
+        ["2023-01-01", "Test Item", None, None, "100", None, None, "source.jpg", None]
+    ]
+
+def test_append_items_single_segment():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+
+    written = agg.append_items("folder_id", [({"item_name": f"Item {i}"}, f"r{i}.jpg") for i in range(3)])
+
+    assert written == 3
+    assert len(agg.store.list_segments("folder_id")) == 1
+    assert [r[1] for r in agg.store.iter_rows("folder_id")] == ["Item 0", "Item 1", "Item 2"]
+
+def test_buffered_add_item_flushes_every_n_rows():
+    drive = FakeDrive()
+
+    with InventoryAggregator(drive, flush_every=2) as agg:
+        for i in range(5):
+            agg.add_item("folder_id", {"item_name": f"Item {i}"}, "r.jpg")
+        assert len(agg.store.list_segments("folder_id")) == 2
+
+    # Remaining row flushed at job end
+    assert len(agg.store.list_segments("folder_id")) == 3
+    assert [r[1] for r in agg.store.iter_rows("folder_id")] == [f"Item {i}" for i in range(5)]
+
+def test_render_xlsx_from_store_keeps_legacy_rows():
+    drive = FakeDrive()
+    drive.create_file("Kintsu_Inventory.xlsx", "folder_id",
+                      _workbook_bytes([INVENTORY_HEADER, ["2022-05-01", "Old Sofa", None, None, 800, "USD", None, "old.pdf"]]))
+    agg = InventoryAggregator(drive)
+
+    agg.append_item("folder_id", {"item_name": "Drill", "total_amount": "99.5"}, "r.jpg")
+    agg.render_xlsx("folder_id")
+
+    rows = drive.xlsx_rows()
+    assert rows[0] == INVENTORY_HEADER
+    assert [r[1] for r in rows[1:]] == ["Old Sofa", "Drill"]
+    assert rows[2][4] == 99.5
+
+def test_failed_legacy_import_is_retried_before_any_render():
+    drive = FakeDrive()
+    xlsx = drive.create_file("Kintsu_Inventory.xlsx", "folder_id",
+                             _workbook_bytes([INVENTORY_HEADER, ["2022-05-01", "Old Sofa", None, None, 800, "USD", None, "old.pdf"]]))
+    download = drive.download_file
+    drive.download_file = MagicMock(side_effect=ConnectionError("Drive unavailable"))
+    agg = InventoryAggregator(drive)
+
+    # The store folder now exists, but the import did not happen
+    with pytest.raises(ConnectionError):
+        agg.append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    with pytest.raises(ConnectionError):
+        agg.render_xlsx("folder_id")
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Old Sofa"]
+
+    # Recovered: a fresh instance (next shard event) imports first
+    drive.download_file = download
+    agg = InventoryAggregator(drive)
+    agg.append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    agg.render_xlsx("folder_id")
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Old Sofa", "Drill"]
+
+    # Recorded on the store folder; later instances do not look again
+    drive.calls.clear()
+    InventoryAggregator(drive).append_item("folder_id", {"item_name": "Desk"}, "r.jpg")
+    assert 'download' not in drive.calls and 'find' not in drive.calls
+
+def test_render_if_stale_debounces():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    assert agg.render_if_stale("folder_id") is None
+
+    agg.append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    xlsx_id = agg.render_if_stale("folder_id")
+    assert xlsx_id is not None
+
+    # Rendered just now: newer rows wait for the debounce window
+    drive.files[xlsx_id]['modifiedTime'] = datetime.now(timezone.utc).isoformat()
+    agg.append_item("folder_id", {"item_name": "Desk"}, "r.jpg")
+    assert agg.render_if_stale("folder_id", debounce_seconds=300) is None
+
+    drive.files[xlsx_id]['modifiedTime'] = (datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
+    assert agg.render_if_stale("folder_id", debounce_seconds=300) == xlsx_id
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Drill", "Desk"]
+
+def test_trailing_render_picks_up_the_end_of_a_burst():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    agg.append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    xlsx_id = agg.render_if_stale("folder_id")
+    drive.files[xlsx_id]['modifiedTime'] = datetime.now(timezone.utc).isoformat()
+
+    # Last shard of the burst lands inside the debounce window
+    agg.append_item("folder_id", {"item_name": "Desk"}, "r.jpg")
+    assert agg.render_if_stale("folder_id", debounce_seconds=300) is None
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Drill"]
+
+    assert agg.render_pending("folder_id") == xlsx_id
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Drill", "Desk"]
+
+    # Nothing newer than the render: the next scheduled run is a no-op
+    drive.files[xlsx_id]['modifiedTime'] = datetime.now(timezone.utc).isoformat()
+    assert agg.render_pending("folder_id") is None
+
+def test_rows_appended_during_a_render_are_picked_up_by_the_next_one():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    agg.append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    update = drive.update_file
+    landed = []
+
+    def update_after_a_concurrent_append(file_id, content, *args, **kwargs):
+        # Another shard's segment lands after the store was read, before the XLSX upload
+        if drive.files[file_id]['name'] == agg.filename and not landed:
+            InventoryAggregator(drive).append_item("folder_id", {"item_name": "Desk"}, "r.jpg")
+            landed.append(file_id)
+        result = update(file_id, content, *args, **kwargs)
+        drive.files[file_id]['modifiedTime'] = datetime.now(timezone.utc).isoformat()
+        return result
+
+    drive.update_file = update_after_a_concurrent_append
+    xlsx_id = agg.render_xlsx("folder_id")
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Drill"]
+
+    # The XLSX was modified after Desk's segment, yet does not show it
+    assert agg.render_pending("folder_id") == xlsx_id
+    assert [r[1] for r in drive.xlsx_rows()[1:]] == ["Drill", "Desk"]
+    assert agg.render_pending("folder_id") is None
+
+def test_rendered_xlsx_is_never_imported_as_legacy():
+    drive = FakeDrive()
+    InventoryAggregator(drive).append_item("folder_id", {"item_name": "Drill"}, "r.jpg")
+    InventoryAggregator(drive).render_xlsx("folder_id")
+    # A concurrent first writer that has not seen the import marker yet
+    store_folder = next(file_id for file_id, f in drive.files.items() if f['name'] == STORE_FOLDER_NAME)
+    drive.files[store_folder]['appProperties'] = {}
+
+    agg = InventoryAggregator(drive)
+    agg.append_item("folder_id", {"item_name": "Desk"}, "r.jpg")
+    assert [r[1] for r in agg.store.iter_rows("folder_id")] == ["Drill", "Desk"]
+
+def _fill_store(agg, count):
+    for i in range(count):
+        agg.append_item("folder_id", {"item_name": f"Item {i}"}, "r.jpg")
+
+def test_compaction_folds_segments_into_base():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 5)
+
+    assert agg.store.compact("folder_id", min_segments=10, grace_seconds=0) == 0
+    assert agg.store.compact("folder_id", min_segments=3, grace_seconds=0) == 5
+
+    assert agg.store.list_segments("folder_id") == []
+    _fill_store(agg, 1)
+    assert [r[1] for r in agg.store.iter_rows("folder_id")] == [f"Item {i}" for i in range(5)] + ["Item 0"]
+
+def test_compaction_skips_recent_segments():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=3600) == 0
+    assert len(agg.store.list_segments("folder_id")) == 3
+
+def test_compaction_backs_off_when_lease_is_contended():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+    other = InventoryAggregator(drive)
+
+    # Another instance writes its lease right after ours: the last writer wins
+    lock_id = agg.store._lock_file_id("folder_id")
+    original_write = agg.store._write_lease
+    def racing_write(file_id, owner, expires):
+        updated = original_write(file_id, owner, expires)
+        other.store._write_lease(lock_id, "other", datetime.now(timezone.utc) + timedelta(minutes=5))
+        return updated
+    agg.store._write_lease = racing_write
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 0
+    assert len(agg.store.list_segments("folder_id")) == 3
+
+    # While the other lease is live nobody else compacts, and backing off
+    # leaves it in place
+    agg.store._write_lease = original_write
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 0
+    assert json.loads(drive.files[lock_id]['content'])['owner'] == "other"
+
+def test_lease_survives_version_jumps():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+
+    # Drive versions only grow; they may skip numbers
+    original_update = drive.update_file
+    def jumping_update(file_id, content, *args, **kwargs):
+        drive.files[file_id]['version'] += 4
+        return original_update(file_id, content, *args, **kwargs)
+    drive.update_file = jumping_update
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 3
+
+def test_compaction_stops_when_lease_is_taken_over_midway():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+    other = InventoryAggregator(drive)
+
+    original_read = agg.store.read_segment
+    def slow_read(segment):
+        lock_id = agg.store._lock_file_id("folder_id")
+        other.store._write_lease(lock_id, "other", datetime.now(timezone.utc) + timedelta(minutes=5))
+        return original_read(segment)
+    agg.store.read_segment = slow_read
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 0
+    assert len(agg.store.list_segments("folder_id")) == 3
+    assert agg.store.read_base("folder_id")[0] is None
+
+def test_rows_survive_duplicate_store_folders_and_partial_compaction():
+    drive = FakeDrive()
+    first, second = InventoryAggregator(drive), InventoryAggregator(drive)
+
+    # Two first writers each create a store folder before seeing the other's
+    first_folder, _ = first.store.ensure_folder("folder_id")
+    drive.create_file(STORE_FOLDER_NAME, "folder_id", "", "application/vnd.google-apps.folder")
+    drive.create_file("segment-20240101T000000000000-aaaa.csv", max(f['id'] for f in drive.find_files_by_name(STORE_FOLDER_NAME, "folder_id")),
+                      first.store.encode_rows([[None, "From second", None, None, None, None, None, "b.jpg"]]))
+    _fill_store(first, 1)
+
+    assert sorted(r[1] for r in second.store.iter_rows("folder_id")) == ["From second", "Item 0"]
+
+    # A compactor that dies after writing the base leaves the segments it merged
+    with patch.object(drive, 'delete_file', side_effect=RuntimeError("crashed")):
+        assert second.store.compact("folder_id", min_segments=1, grace_seconds=0) == 2
+    assert len(drive.list_files(first_folder)) > 2
+    assert sorted(r[1] for r in second.store.iter_rows("folder_id")) == ["From second", "Item 0"]
+
+    # The next compaction deletes exactly those leftovers
+    assert second.store.compact("folder_id", min_segments=1, grace_seconds=0) == 0
+    assert second.store.list_segments("folder_id") == []
+    assert sorted(r[1] for r in second.store.iter_rows("folder_id")) == ["From second", "Item 0"]
+
+def test_late_landing_segment_is_not_folded_away():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 3
+
+    # Named by its writer long before, but only stored by Drive now (e.g.
+    # after transport backoff); its name sorts before everything compacted
+    folder_id, _ = agg.store.ensure_folder("folder_id")
+    drive.create_file("segment-20000101T000000000000-late.csv", folder_id,
+                      agg.store.encode_rows([[None, "Late", None, None, None, None, None, "late.jpg", None]]))
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=3600) == 0
+    assert "Late" in [r[1] for r in agg.store.iter_rows("folder_id")]
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 1
+    assert sorted(r[1] for r in agg.store.iter_rows("folder_id")) == ["Item 0", "Item 1", "Item 2", "Late"]
+
+def test_idle_compaction_and_staleness_checks_download_nothing():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    _fill_store(agg, 3)
+    agg.store.compact("folder_id", min_segments=1, grace_seconds=0)
+    drive.calls.clear()
+
+    assert agg.store.compact("folder_id", min_segments=1, grace_seconds=0) == 0
+    assert agg.store.last_modified("folder_id") is not None
+    assert 'download' not in drive.calls
+
+def test_reappending_a_shard_upserts_its_row():
+    drive = FakeDrive()
+    agg = InventoryAggregator(drive)
+    key = InventoryAggregator.row_key(1700000000000001)
+
+    agg.append_item("folder_id", {"item_name": "Drill", "total_amount": 90}, "a.jpg", key=key)
+    agg.append_item("folder_id", {"item_name": "Desk"}, "b.jpg", key=InventoryAggregator.row_key(1700000000000002))
+    # Redelivered event with a corrected extraction
+    agg.append_item("folder_id", {"item_name": "Drill", "total_amount": 99}, "a.jpg", key=key)
+    agg.append_item("folder_id", {"item_name": "Unkeyed"}, "c.jpg")
+
+    rows = list(agg.store.iter_rows("folder_id"))
+    assert [(r[1], r[4]) for r in rows] == [("Drill", "99"), ("Desk", None), ("Unkeyed", None)]
+
+    # Compaction keeps one row per key, and the XLSX omits the key column
+    agg.store.compact("folder_id", min_segments=1, grace_seconds=0)
+    agg.append_item("folder_id", {"item_name": "Drill", "total_amount": 100}, "a.jpg", key=key)
+    agg.render_xlsx("folder_id")
+    xlsx = drive.xlsx_rows()
+    assert xlsx[0] == INVENTORY_HEADER
+    assert [(r[1], r[4]) for r in xlsx[1:]] == [("Drill", 100.0), ("Desk", None), ("Unkeyed", None)]
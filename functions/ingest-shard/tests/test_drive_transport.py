@@ -0,0 +1,122 @@
+import pytest
+from unittest.mock import MagicMock
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared')))
+
+import drive_transport
+from drive_transport import DriveTransport, TokenBucket, retry_kind, user_bucket, DEFAULT_TIMEOUT
+
+RATE_LIMITED = b'{"error": {"errors": [{"reason": "userRateLimitExceeded"}], "code": 403}}'
+
+def _response(status, content=b'{}', headers=None):
+    response = MagicMock(status_code=status, content=content, reason='', headers=headers or {})
+    return response
+
+@pytest.fixture
+def transport():
+    session = MagicMock()
+    sleeps = []
+    transport = DriveTransport("user-1", session_factory=lambda: session, bucket=TokenBucket(1000.0),
+                               max_attempts=3, sleep=sleeps.append)
+    transport.sleeps = sleeps
+    return transport
+
+def test_retry_kind():
+    assert retry_kind(429, None) == 'throttled'
+    assert retry_kind(403, RATE_LIMITED) == 'throttled'
+    assert retry_kind(503, None) == 'error'
+    assert retry_kind(403, b'{"error": {"errors": [{"reason": "insufficientPermissions"}]}}') is None
+    assert retry_kind(404, None) is None
+
+def test_throttled_calls_are_retried_with_backoff(transport):
+    responses = [_response(403, RATE_LIMITED), _response(429, headers={'Retry-After': '7'}), _response(200)]
+    transport.session.request.side_effect = responses
+
+    assert transport.request("POST", "https://drive/files").status_code == 200
+    # Retried answers are released before the backoff; the final one is the caller's
+    assert [r.close.call_count for r in responses] == [1, 1, 0]
+    assert transport.session.request.call_count == 3
+    assert transport.sleeps[1] == 7.0
+    stats = transport.metrics.snapshot()
+    assert stats['throttled'] == 2 and stats['failed'] == 0 and stats['requests'] == 3
+
+def test_non_retryable_status_is_returned_at_once(transport):
+    transport.session.request.return_value = _response(404)
+
+    assert transport.request("GET", "https://drive/files/x").status_code == 404
+    assert transport.session.request.call_count == 1
+    assert transport.metrics.snapshot()['failed'] == 0
+
+def test_exhausted_retries_count_as_failed(transport):
+    transport.session.request.return_value = _response(503)
+
+    assert transport.request("GET", "https://drive/files").status_code == 503
+    stats = transport.metrics.snapshot()
+    assert stats['retried'] == 2 and stats['failed'] == 1
+
+def test_stream_bodies_are_resent_on_retry(transport):
+    import io
+    transport.session.request.side_effect = [_response(500), _response(200)]
+
+    transport.request("PUT", "https://upload/session", data=io.BytesIO(b'chunk'))
+    bodies = [call.kwargs['data'] for call in transport.session.request.call_args_list]
+    assert bodies == [b'chunk', b'chunk']
+
+def test_every_call_has_a_timeout(transport):
+    transport.session.request.return_value = _response(200)
+
+    transport.request("GET", "https://drive/files")
+    transport.request("GET", "https://drive/files", timeout=5)
+    timeouts = [call.kwargs['timeout'] for call in transport.session.request.call_args_list]
+    assert timeouts == [DEFAULT_TIMEOUT, 5]
+
+def test_idle_user_buckets_are_evicted(monkeypatch):
+    monkeypatch.setattr(drive_transport, '_buckets', {})
+    first = user_bucket("user-1")
+    assert user_bucket("user-1") is first
+
+    monkeypatch.setattr(first, 'idle_seconds', lambda: drive_transport.BUCKET_IDLE_SECONDS + 1)
+    user_bucket("user-2")
+    assert set(drive_transport._buckets) == {"user-2"}
+    assert user_bucket("user-1") is not first
+
+def test_token_bucket_paces_bursts():
+    now = [0.0]
+    sleeps = []
+    bucket = TokenBucket(rate=2.0, capacity=2, clock=lambda: now[0], sleep=sleeps.append)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.5)
+    now[0] = 10.0
+    assert bucket.acquire() == 0.0
+    assert sleeps == [pytest.approx(0.5)]
+
+def test_http_facade_speaks_httplib2(transport):
+    transport.session.request.return_value = _response(308, b'', headers={'Range': 'bytes=0-9', 'Content-Encoding': 'gzip'})
+
+    resp, content = transport.http().request("https://upload/session", "PUT", body=b'x', headers={})
+    assert resp.status == 308
+    assert resp['range'] == 'bytes=0-9'
+    assert 'content-encoding' not in resp
+    assert content == b''
+
+def test_each_thread_gets_its_own_session():
+    import threading
+    transport = DriveTransport("user-2", session_factory=MagicMock, bucket=TokenBucket(1000.0))
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(transport.session)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(session) for session in sessions}) == 3
+    assert transport.session is transport.session
+    transport.close()
+    for session in sessions:
+        session.close.assert_called_once()
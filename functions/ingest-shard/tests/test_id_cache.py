@@ -0,0 +1,66 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from id_cache import DriveIdCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_entries_expire_and_evict_lru():
+    clock = FakeClock()
+    cache = DriveIdCache(max_entries=2, ttl_seconds=10, clock=clock)
+
+    cache.put("root", "Kintsu", "k1")
+    cache.put("k1", "Hopper", "h1")
+    assert cache.get("root", "Kintsu") == "k1"
+    cache.put("h1", "Gmail", "g1")
+
+    # "Hopper" was least recently used
+    assert cache.get("k1", "Hopper") is None
+    clock.now = 11
+    assert cache.get("root", "Kintsu") is None
+
+def test_invalidate_drops_id_and_children():
+    cache = DriveIdCache()
+    cache.put("root", "Kintsu", "k1")
+    cache.put("k1", "Hopper", "h1")
+    cache.put("root", "Other", "o1")
+
+    cache.invalidate("k1")
+
+    assert cache.get("root", "Kintsu") is None
+    assert cache.get("k1", "Hopper") is None
+    assert cache.get("root", "Other") == "o1"
+
+def test_invalidate_drops_descendants_at_any_depth():
+    cache = DriveIdCache()
+    cache.put("root", "Kintsu", "k1")
+    cache.put("k1", "Hopper", "h1")
+    cache.put("h1", "Amazon", "a1")
+    cache.put("a1", "orders.json", "f1")
+    cache.put("k1", "Logs", "l1")
+    cache.put("root", "Other", "o1")
+    cache.put("o1", "Notes", "n1")
+
+    cache.invalidate("k1")
+
+    assert len(cache) == 2
+    assert cache.get("root", "Other") == "o1"
+    assert cache.get("o1", "Notes") == "n1"
+
+def test_scopes_and_snapshot_round_trip():
+    cache = DriveIdCache()
+    cache.put("root", "Kintsu", "alice_k", scope="alice")
+    cache.put("root", "Kintsu", "bob_k", scope="bob")
+
+    restored = DriveIdCache()
+    restored.load(cache.snapshot("alice"), scope="alice")
+
+    assert restored.get("root", "Kintsu", scope="alice") == "alice_k"
+    assert restored.get("root", "Kintsu", scope="bob") is None
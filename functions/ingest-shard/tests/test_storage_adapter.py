@@ -4,12 +4,17 @@ import sys
 import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared')))
 
 from storage_adapter import DriveStorageAdapter
+from id_cache import DriveIdCache
+from googleapiclient.errors import HttpError
 
 @pytest.fixture
 def mock_drive_service():
-    with patch('storage_adapter.build') as mock_build:
+    with patch('storage_adapter._drive_service', None), patch('storage_adapter._drive_transport', None), \
+            patch('storage_adapter.build_from_document') as mock_build:
         with patch('storage_adapter.google.auth.default') as mock_auth:
             mock_auth.return_value = (MagicMock(), "project-id")
             service = MagicMock()
@@ -33,3 +38,102 @@ def test_create_file_folder(mock_drive_service):
     # Verify NO media_body was passed
     call_kwargs = mock_files.create.call_args[1]
     assert 'media_body' not in call_kwargs
+
+def test_set_app_properties_updates_metadata_only(mock_drive_service):
+    adapter = DriveStorageAdapter()
+    mock_files = mock_drive_service.files.return_value
+
+    adapter.set_app_properties("folder_id", {"legacyImported": "true"})
+
+    call_kwargs = mock_files.update.call_args[1]
+    assert call_kwargs['body'] == {'appProperties': {'legacyImported': 'true'}}
+    assert 'media_body' not in call_kwargs
+
+def test_find_file_by_name_is_cached_until_404(mock_drive_service):
+    adapter = DriveStorageAdapter(id_cache=DriveIdCache())
+    mock_files = mock_drive_service.files.return_value
+    mock_files.list.return_value.execute.return_value = {'files': [{'id': 'kintsu_id', 'name': 'Kintsu'}]}
+
+    assert adapter.find_file_by_name("Kintsu", "root")['id'] == 'kintsu_id'
+    assert adapter.find_file_by_name("Kintsu", "root")['id'] == 'kintsu_id'
+    assert mock_files.list.call_count == 1
+
+    # The folder was deleted: the 404 evicts it and the next lookup goes to Drive
+    mock_files.get.return_value.execute.side_effect = HttpError(MagicMock(status=404), b'not found')
+    assert adapter.get_file_metadata('kintsu_id') == {}
+    adapter.find_file_by_name("Kintsu", "root")
+    assert mock_files.list.call_count == 2
+
+def test_in_folder_resolves_a_deleted_cached_folder_again(mock_drive_service):
+    adapter = DriveStorageAdapter(id_cache=DriveIdCache())
+    mock_files = mock_drive_service.files.return_value
+    mock_files.list.return_value.execute.side_effect = [
+        {'files': [{'id': 'old_kintsu', 'name': 'Kintsu'}]}, {'files': []}
+    ]
+    mock_files.create.return_value.execute.return_value = {'id': 'new_kintsu'}
+    adapter.id_cache.put('old_kintsu', 'Store', 'old_store')
+
+    def resolve():
+        folder = adapter.find_file_by_name("Kintsu", "root")
+        return (folder or adapter.create_file("Kintsu", "root", "", "application/vnd.google-apps.folder"))['id']
+
+    parents = []
+    def write(folder_id):
+        parents.append(folder_id)
+        if folder_id == 'old_kintsu':
+            raise HttpError(MagicMock(status=404), b'not found')
+        return folder_id
+
+    assert adapter.in_folder(resolve, write) == 'new_kintsu'
+    assert parents == ['old_kintsu', 'new_kintsu']
+    assert adapter.id_cache.get('old_kintsu', 'Store') is None
+
+def test_in_folder_gives_up_after_one_retry(mock_drive_service):
+    adapter = DriveStorageAdapter(id_cache=DriveIdCache())
+    action = MagicMock(side_effect=HttpError(MagicMock(status=404), b'not found'))
+
+    with pytest.raises(HttpError):
+        adapter.in_folder(lambda: 'folder', action)
+    assert action.call_count == 2
+
+def test_drive_service_is_built_once_per_process(mock_drive_service):
+    first = DriveStorageAdapter()
+    second = DriveStorageAdapter()
+
+    assert first.service is second.service
+    import storage_adapter
+    storage_adapter.google.auth.default.assert_called_once()
+    storage_adapter.build_from_document.assert_called_once()
+
+def test_update_file_streams_iterator_in_resumable_chunks(mock_drive_service):
+    import storage_adapter
+    adapter = DriveStorageAdapter()
+    request = mock_drive_service.files.return_value.update.return_value
+    request.next_chunk.side_effect = [(MagicMock(), None), (None, {'id': 'file_id', 'version': '2'})]
+    chunk_size = storage_adapter.CHUNK_GRANULARITY
+
+    res = adapter.update_file('file_id', iter([b'a' * chunk_size, 'b' * 10]), 'text/csv', chunk_size=chunk_size)
+
+    assert res == {'id': 'file_id', 'version': '2'}
+    request.execute.assert_not_called()
+    assert request.next_chunk.call_count == 2
+    media = mock_drive_service.files.return_value.update.call_args[1]['media_body']
+    assert media.chunksize() == chunk_size
+    assert media.size() == chunk_size + 10
+    assert media.getbytes(chunk_size, 10) == b'b' * 10
+
+def test_create_file_uploads_seekable_stream_without_copying(mock_drive_service):
+    import io
+    adapter = DriveStorageAdapter(id_cache=DriveIdCache())
+    request = mock_drive_service.files.return_value.create.return_value
+    request.next_chunk.return_value = (None, {'id': 'new_id'})
+    stream = io.BytesIO(b'payload')
+
+    assert adapter.create_file("big.xlsx", "folder", stream, 'application/octet-stream')['id'] == 'new_id'
+    media = mock_drive_service.files.return_value.create.call_args[1]['media_body']
+    assert media.stream() is stream
+
+def test_upload_rejects_unaligned_chunk_size(mock_drive_service):
+    adapter = DriveStorageAdapter()
+    with pytest.raises(ValueError):
+        adapter.update_file('file_id', b'data', chunk_size=1000)
@@ -0,0 +1,131 @@
+"""
+Benchmark: row-by-row (df.iterrows) vs vectorized AmazonProcessor extraction.
+
+Usage: python benchmarks/bench_process.py [rows]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from processor import AmazonProcessor, ReturnsIndex, ASSET_KEYWORDS, DEFAULT_IGNORE_KEYWORDS, DEFAULT_MIN_PRICE
+
+DESCRIPTIONS = [
+    "Cordless Drill Kit", "Coffee Beans 2 lb", "Standing Desk", "Vitamin D 120 count",
+    "Rechargeable Batteries 8 pack", "4K Monitor", "Kindle Edition: A Novel", "Office Chair",
+    "Paper Towel 12 rolls", "Espresso Machine Appliance", None,
+]
+PRICES = ["$19.99", "$1,249.00", "8.50", "abc", "", "$15.00", "299", None, "1e2"]
+STATUSES = ["Shipped", "Closed", "Cancelled", "Returned", "Delivered", None]
+
+
+def legacy_is_likely_asset(description, price):
+    """Reference copy of the original keyword loops."""
+    desc_lower = description.lower()
+    for asset_word in ASSET_KEYWORDS:
+        if asset_word in desc_lower:
+            return True
+    if price < DEFAULT_MIN_PRICE:
+        return False
+    for keyword in DEFAULT_IGNORE_KEYWORDS:
+        if keyword in desc_lower:
+            return False
+    return True
+
+
+def legacy_extract(processor, df, resolved, returned_order_ids, debug_mode):
+    """Reference copy of the original iterrows loop."""
+    shards, excluded = [], []
+    col_id, col_date = resolved['id'], resolved['date']
+    col_desc, col_price, col_status = resolved['desc'], resolved['price'], resolved['status']
+    for index, row in df.iterrows():
+        desc = str(row[col_desc])
+        price_str = str(row[col_price]).replace('$', '').replace(',', '').strip()
+        date_str = str(row[col_date]) if col_date else None
+        status = str(row[col_status]) if col_status else 'Unknown'
+        order_id = str(row[col_id]) if col_id else None
+
+        if 'returned' in status.lower() or 'cancelled' in status.lower():
+            if debug_mode:
+                excluded.append({"item_name": desc, "reason": "status_returned_or_cancelled",
+                                 "order_id": order_id, "original_row": index})
+            continue
+        if order_id and order_id in returned_order_ids:
+            if debug_mode:
+                excluded.append({"item_name": desc, "reason": "found_in_returns_file",
+                                 "order_id": order_id, "original_row": index})
+            continue
+        try:
+            price = float(price_str)
+        except ValueError:
+            price = 0.0
+        if not legacy_is_likely_asset(desc, price):
+            if debug_mode:
+                excluded.append({"item_name": desc, "reason": "asset_triage_filtered",
+                                 "order_id": order_id, "price": price, "original_row": index})
+            continue
+        shards.append({
+            "item_name": desc, "total_amount": price, "currency": "USD", "date": date_str,
+            "merchant": "Amazon", "confidence": "High", "category": "Uncategorized",
+            "order_id": order_id,
+            "source_meta": {"original_row": index, "status": status, "filter_method": "heuristic_v1"}
+        })
+    return shards, excluded
+
+
+def make_order_history(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Order ID": [f"111-{i:07d}" for i in rng.integers(0, n_rows // 2 + 1, n_rows)],
+        "Order Date": pd.date_range("2015-01-01", periods=n_rows, freq="h").astype(str),
+        "Title": rng.choice(np.array(DESCRIPTIONS, dtype=object), n_rows),
+        "Unit Price": rng.choice(np.array(PRICES, dtype=object), n_rows),
+        "Order Status": rng.choice(np.array(STATUSES, dtype=object), n_rows),
+    })
+
+
+def same_records(a, b):
+    """Equality that treats NaN prices as equal."""
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if x.keys() != y.keys():
+            return False
+        for k in x:
+            vx, vy = x[k], y[k]
+            if isinstance(vx, float) and isinstance(vy, float) and np.isnan(vx) and np.isnan(vy):
+                continue
+            if vx != vy:
+                return False
+    return True
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    processor = AmazonProcessor()
+    df = make_order_history(n_rows)
+    resolved = processor.resolve_columns(df.columns.tolist())
+    returned = set(df["Order ID"].sample(frac=0.05, random_state=1))
+
+    start = time.perf_counter()
+    legacy = legacy_extract(processor, df, resolved, returned, True)
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = processor._extract_items(df, resolved, ReturnsIndex(returned), True)
+    vectorized_s = time.perf_counter() - start
+
+    assert same_records(legacy[0], vectorized[0]), "shards differ"
+    assert same_records(legacy[1], vectorized[1]), "exclusions differ"
+
+    print(f"rows={n_rows} shards={len(vectorized[0])} excluded={len(vectorized[1])}")
+    print(f"iterrows:   {legacy_s * 1000:9.1f} ms")
+    print(f"vectorized: {vectorized_s * 1000:9.1f} ms  ({legacy_s / vectorized_s:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
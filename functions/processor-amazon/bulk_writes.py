@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from google.api_core import exceptions as gcp_exceptions
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 500  # Firestore limit per WriteBatch / commit
+MAX_WRITE_ATTEMPTS = 5
+MAX_PARALLEL_BATCHES = 8
+BACKOFF_BASE_SECONDS = 0.5
+
+# gRPC status codes worth retrying (throttling and transient server errors)
+RETRYABLE_CODES = {
+    4,   # DEADLINE_EXCEEDED
+    8,   # RESOURCE_EXHAUSTED
+    10,  # ABORTED
+    13,  # INTERNAL
+    14,  # UNAVAILABLE
+}
+
+RETRYABLE_EXCEPTIONS = (
+    gcp_exceptions.DeadlineExceeded,
+    gcp_exceptions.ResourceExhausted,
+    gcp_exceptions.Aborted,
+    gcp_exceptions.InternalServerError,
+    gcp_exceptions.ServiceUnavailable,
+)
+
+
+class FirestoreBulkWriter:
+    """
+    Bulk write path for Amazon shard and debug-exclusion documents.
+
+    Uses Firestore's BulkWriter when the client provides it (500/50/5
+    ramp-up, parallel batches, per-write retries on throttling). Otherwise
+    writes are buffered into 500-operation WriteBatches committed in
+    parallel with exponential backoff.
+    """
+
+    def __init__(self, db, use_bulk_writer: bool = True,
+                 max_attempts: int = MAX_WRITE_ATTEMPTS,
+                 max_parallel_batches: int = MAX_PARALLEL_BATCHES):
+        self.db = db
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._closed = False
+        self.stats = {"queued": 0, "written": 0, "failed": 0, "retried": 0, "throttled": 0}
+
+        self._bulk_writer = None
+        if use_bulk_writer and hasattr(db, 'bulk_writer'):
+            self._bulk_writer = db.bulk_writer()
+            self._bulk_writer.on_write_result(self._on_write_result)
+            self._bulk_writer.on_write_error(self._on_write_error)
+        else:
+            self._pending: List[Tuple[Any, Dict[str, Any]]] = []
+            self._executor = ThreadPoolExecutor(max_workers=max_parallel_batches)
+            self._futures = []
+
+    # --- BulkWriter callbacks (invoked from its worker threads) ---
+
+    def _on_write_result(self, reference, result, bulk_writer):
+        with self._lock:
+            self.stats["written"] += 1
+
+    def _on_write_error(self, failure, bulk_writer) -> bool:
+        retry = failure.code in RETRYABLE_CODES and failure.attempts < self.max_attempts
+        with self._lock:
+            if failure.code == 8:
+                self.stats["throttled"] += 1
+            if retry:
+                self.stats["retried"] += 1
+            else:
+                self.stats["failed"] += 1
+                logger.error(f"Firestore write failed after {failure.attempts} attempts: {failure.message}")
+        return retry
+
+    # --- Batch fallback ---
+
+    def _commit_with_retry(self, operations: List[Tuple[Any, Dict[str, Any]]]):
+        for attempt in range(1, self.max_attempts + 1):
+            batch = self.db.batch()
+            for doc_ref, data in operations:
+                batch.set(doc_ref, data)
+            try:
+                batch.commit()
+                with self._lock:
+                    self.stats["written"] += len(operations)
+                return
+            except RETRYABLE_EXCEPTIONS as e:
+                with self._lock:
+                    if isinstance(e, gcp_exceptions.ResourceExhausted):
+                        self.stats["throttled"] += 1
+                    if attempt == self.max_attempts:
+                        self.stats["failed"] += len(operations)
+                        logger.error(f"Firestore batch of {len(operations)} failed after {attempt} attempts: {e}")
+                        return
+                    self.stats["retried"] += 1
+                time.sleep(BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+            except Exception as e:
+                with self._lock:
+                    self.stats["failed"] += len(operations)
+                logger.error(f"Firestore batch of {len(operations)} failed: {e}")
+                return
+
+    def _submit_pending(self):
+        if self._pending:
+            operations, self._pending = self._pending, []
+            self._futures.append(self._executor.submit(self._commit_with_retry, operations))
+
+    # --- Public API ---
+
+    def set(self, collection: str, doc_id: str, data: Dict[str, Any]):
+        doc_ref = self.db.collection(collection).document(doc_id)
+        self.stats["queued"] += 1
+        if self._bulk_writer is not None:
+            self._bulk_writer.set(doc_ref, data)
+            return
+        self._pending.append((doc_ref, data))
+        if len(self._pending) >= MAX_BATCH_SIZE:
+            self._submit_pending()
+
+    def close(self) -> Dict[str, Any]:
+        """
+        Flushes every queued write and returns throughput stats.
+        """
+        if self._closed:
+            return self.stats
+        self._closed = True
+
+        if self._bulk_writer is not None:
+            self._bulk_writer.close()
+        else:
+            self._submit_pending()
+            for future in self._futures:
+                future.result()
+            self._executor.shutdown()
+
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        self.stats["seconds"] = round(elapsed, 3)
+        self.stats["writes_per_second"] = round(self.stats["written"] / elapsed, 1)
+        logger.info(f"Firestore bulk write: {self.stats}")
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,70 @@
+import json
+from typing import Any, Dict, List, Tuple
+
+NDJSON_MIME_TYPE = 'application/x-ndjson'
+
+
+def consolidated_sidecar_name(source_name: str) -> str:
+    return f"{source_name}.kintsu.ndjson"
+
+
+def index_file_name(source_name: str) -> str:
+    return f"{source_name}.kintsu.index.json"
+
+
+def encode_ndjson(items: List[Dict[str, Any]]) -> Tuple[bytes, List[int]]:
+    """
+    Serializes items as NDJSON (one compact JSON object per line).
+
+    Returns the payload and the byte offset of every line, plus a final
+    entry for the total size, so item i spans offsets[i]:offsets[i+1].
+    """
+    lines = [json.dumps(item, separators=(',', ':'), default=str).encode('utf-8') + b'\n' for item in items]
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return b''.join(lines), offsets
+
+
+def item_range(offsets: List[int], i: int) -> Tuple[int, int]:
+    """
+    (offset, length) of item i, excluding the trailing newline.
+    """
+    return offsets[i], offsets[i + 1] - offsets[i] - 1
+
+
+def build_item_index(source_name: str, sidecar_id: str, offsets: List[int]) -> Dict[str, Any]:
+    """
+    Compact index for a consolidated sidecar, enough to range-read any item.
+    """
+    return {
+        "source": source_name,
+        "sidecar": consolidated_sidecar_name(source_name),
+        "sidecarId": sidecar_id,
+        "format": "ndjson",
+        "count": len(offsets) - 1,
+        "offsets": offsets
+    }
+
+
+class NdjsonBuffer:
+    """
+    Incremental encode_ndjson: batches are serialized as they arrive, so only
+    the encoded bytes are held until the sidecar is uploaded.
+    """
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self.offsets: List[int] = [0]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def extend(self, items: List[Dict[str, Any]]):
+        payload, offsets = encode_ndjson(items)
+        base = self.offsets[-1]
+        self._parts.append(payload)
+        self.offsets.extend(base + offset for offset in offsets[1:])
+
+    def getvalue(self) -> bytes:
+        return b''.join(self._parts)
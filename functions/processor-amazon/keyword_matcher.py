@@ -0,0 +1,78 @@
+import re
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+MATCH_ASSET = 'asset'
+MATCH_IGNORE = 'ignore'
+
+MAX_CACHED_MATCHERS = 64
+
+_NEVER_MATCH = '(?!)'
+
+
+def _alternation(keywords: Iterable[str]) -> str:
+    # Longest first keeps the alternation deterministic; escaping keeps the
+    # plain-substring semantics of the original `keyword in text` checks.
+    words = sorted({k.lower() for k in keywords if k}, key=lambda k: (-len(k), k))
+    return '|'.join(re.escape(w) for w in words) or _NEVER_MATCH
+
+
+class KeywordMatcher:
+    """
+    Asset / ignore keyword lists compiled into a single regex.
+
+    One scan of the (lowercased) text reports which keyword class matched.
+    Asset keywords win over ignore keywords wherever they appear, matching
+    the original is_likely_asset precedence.
+    """
+
+    def __init__(self, asset_keywords: Iterable[str], ignore_keywords: Iterable[str], version: str = 'default'):
+        self.version = version
+        self.asset_keywords = tuple(asset_keywords)
+        self.ignore_keywords = tuple(ignore_keywords)
+        # Zero-width lookahead so overlapping keywords are all seen in one pass
+        self._pattern = re.compile(
+            f"(?=(?:({_alternation(self.asset_keywords)})|({_alternation(self.ignore_keywords)})))"
+        )
+
+    def classify(self, text: str) -> Optional[str]:
+        """
+        Returns MATCH_ASSET, MATCH_IGNORE or None for a single string.
+        """
+        found_ignore = False
+        for match in self._pattern.finditer(str(text).lower()):
+            if match.group(1) is not None:
+                return MATCH_ASSET
+            found_ignore = True
+        return MATCH_IGNORE if found_ignore else None
+
+    def classify_series(self, texts: pd.Series) -> pd.Series:
+        """
+        Classifies a whole Series. Each distinct value is scanned once.
+        """
+        codes, uniques = pd.factorize(texts, use_na_sentinel=False)
+        classes = np.array([self.classify(u) for u in uniques], dtype=object)
+        return pd.Series(classes[codes], index=texts.index, dtype=object)
+
+
+_MATCHER_CACHE: "OrderedDict[str, KeywordMatcher]" = OrderedDict()
+
+
+def get_matcher(version: str, asset_keywords: Iterable[str], ignore_keywords: Iterable[str]) -> KeywordMatcher:
+    """
+    Returns the compiled matcher for a rule-set version, compiling it on
+    first use. Callers must bump the version whenever the keyword lists
+    (e.g. per-user overrides) change.
+    """
+    matcher = _MATCHER_CACHE.get(version)
+    if matcher is None:
+        matcher = KeywordMatcher(asset_keywords, ignore_keywords, version=version)
+        _MATCHER_CACHE[version] = matcher
+        while len(_MATCHER_CACHE) > MAX_CACHED_MATCHERS:
+            _MATCHER_CACHE.popitem(last=False)
+    else:
+        _MATCHER_CACHE.move_to_end(version)
+    return matcher
@@ -7,11 +7,23 @@ import requests
 import json
 import logging
 import io
+import itertools
+import hashlib
+import functools
 from google.cloud import firestore
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.http import MediaIoBaseUpload
-from processor import AmazonProcessor
+from processor import AmazonProcessor, DedupIndex
+from range_reader import HttpRangeReader
+from bulk_writes import FirestoreBulkWriter
+from manifest import ArchiveManifest
+from parallel import ArchiveSource, iter_files
+from drive_transport import DriveTransport, DEFAULT_TIMEOUT
+from consolidated import (
+    NDJSON_MIME_TYPE, NdjsonBuffer, item_range, build_item_index,
+    consolidated_sidecar_name, index_file_name
+)
 
 # Configure Logging
 logging.basicConfig(level=logging.INFO)
@@ -19,9 +31,46 @@ logger = logging.getLogger(__name__)
 
 db = firestore.Client()
 
-def get_drive_service(access_token):
-    creds = Credentials(access_token)
-    return build('drive', 'v3', credentials=creds)
+# 'consolidated': one NDJSON sidecar + index per source CSV (O(files) Drive calls)
+# 'per_item': one JSON sidecar per extracted item (legacy, O(items) Drive calls)
+OUTPUT_MODE_CONSOLIDATED = 'consolidated'
+OUTPUT_MODE_PER_ITEM = 'per_item'
+DEFAULT_OUTPUT_MODE = os.getenv("AMAZON_OUTPUT_MODE", OUTPUT_MODE_CONSOLIDATED)
+
+# Per-user index of imported order lines, kept in the user's Kintsu folder.
+# Off unless requested ('dedup': true) or enabled with AMAZON_DEDUP=true, so
+# existing re-imports keep writing every line as before.
+DEDUP_INDEX_NAME = "amazon_order_lines.kintsu.idx"
+DEFAULT_DEDUP = os.getenv("AMAZON_DEDUP", "false").lower() == "true"
+
+DRIVE_ABOUT_URL = "https://www.googleapis.com/drive/v3/about"
+
+# Bundled Drive discovery document, parsed once per process
+_DRIVE_DISCOVERY_DOC = json.loads(get_static_doc('drive', 'v3'))
+
+@functools.lru_cache(maxsize=256)
+def drive_user_key(access_token):
+    """
+    Token bucket key of the token's Drive account: its permission ID, which
+    stays the same across token refreshes (a hash of the token would give
+    the user a fresh bucket every hour). Falls back to that hash if Drive
+    cannot be asked.
+    """
+    try:
+        response = requests.get(DRIVE_ABOUT_URL, params={'fields': 'user(permissionId)'},
+                                headers={"Authorization": f"Bearer {access_token}"}, timeout=DEFAULT_TIMEOUT)
+        response.raise_for_status()
+        return response.json()['user']['permissionId']
+    except (requests.RequestException, KeyError, ValueError) as e:
+        logger.warning(f"Could not resolve the Drive user ({e}); keying its bucket by token")
+        return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+def get_drive_service(transport):
+    """
+    Drive client whose requests go through the user's rate-limited,
+    retrying transport.
+    """
+    return build_from_document(_DRIVE_DISCOVERY_DOC, http=transport.http())
 
 def find_or_create_folder(service, name, parent_id='root'):
     query = f"name = '{name}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
@@ -38,32 +87,120 @@ def find_or_create_folder(service, name, parent_id='root'):
     file = service.files().create(body=file_metadata, fields='id').execute()
     return file.get('id')
 
-def write_sidecar(service, parent_id, name, content):
+def find_drive_entry(service, parent_id, name):
+    """
+    Returns {'id', 'md5Checksum', 'size'} of a file by name in a Drive folder, or None.
+    """
+    query = f"name = '{name}' and '{parent_id}' in parents and trashed = false"
+    results = service.files().list(q=query, fields='files(id, name, md5Checksum, size)').execute()
+    files = results.get('files', [])
+    return files[0] if files else None
+
+def find_drive_file(service, parent_id, name):
+    """
+    Returns the ID of a file by name in a Drive folder, or None.
+    """
+    entry = find_drive_entry(service, parent_id, name)
+    return entry['id'] if entry else None
+
+def write_drive_file(service, parent_id, name, content_bytes, mime_type):
+    """
+    Creates or overwrites a file by name in a Drive folder. Returns its ID.
+    Identical content already in Drive (same MD5) is not uploaded again.
+    """
+    existing = find_drive_entry(service, parent_id, name)
+    if existing and existing.get('md5Checksum') == hashlib.md5(content_bytes).hexdigest():
+        logger.info(f"Skipping {name}: identical content already in Drive")
+        return existing['id']
+
     file_metadata = {
         'name': name,
         'parents': [parent_id],
-        'mimeType': 'application/json'
+        'mimeType': mime_type
     }
-    media = MediaIoBaseUpload(io.BytesIO(json.dumps(content, indent=2).encode('utf-8')), mimetype='application/json')
-    
-    # Check if exists
-    query = f"name = '{name}' and '{parent_id}' in parents and trashed = false"
-    results = service.files().list(q=query, fields='files(id, name)').execute()
-    files = results.get('files', [])
+    media = MediaIoBaseUpload(io.BytesIO(content_bytes), mimetype=mime_type)
     
-    if files:
-        file = service.files().update(fileId=files[0]['id'], media_body=media, fields='id').execute()
+    if existing:
+        file = service.files().update(fileId=existing['id'], media_body=media, fields='id').execute()
     else:
         file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
     return file.get('id')
 
-def save_shard(shard_data: dict, shard_id: str):
-    db.collection("shards").document(shard_id).set(shard_data)
-    logger.info(f"Saved shard: {shard_id}")
+def write_sidecar(service, parent_id, name, content):
+    content_bytes = json.dumps(content, indent=2).encode('utf-8')
+    return write_drive_file(service, parent_id, name, content_bytes, 'application/json')
+
+def write_consolidated_sidecar(service, parent_id, source_name, buffer):
+    """
+    Writes all items extracted from one source CSV (already NDJSON-encoded in
+    `buffer`) as a single sidecar, plus a compact offset index.
+    Returns the sidecar ID.
+    """
+    sidecar_id = write_drive_file(
+        service, parent_id, consolidated_sidecar_name(source_name), buffer.getvalue(), NDJSON_MIME_TYPE
+    )
+    index = build_item_index(source_name, sidecar_id, buffer.offsets)
+    write_drive_file(
+        service, parent_id, index_file_name(source_name),
+        json.dumps(index, separators=(',', ':')).encode('utf-8'), 'application/json'
+    )
+    return sidecar_id
+
+def build_shard_doc(shard_id, source_name, item_number, parent_zip):
+    return {
+        "id": shard_id,
+        "fileName": f"{source_name} (Item {item_number})",
+        "sourceType": "Amazon",
+        "parentZip": parent_zip,
+        "status": "refined",
+        "createdAt": firestore.SERVER_TIMESTAMP
+    }
+
+def load_dedup_index(service, parent_id):
+    """
+    Loads the user's index of already imported order lines (empty if none yet).
+    """
+    index_id = find_drive_file(service, parent_id, DEDUP_INDEX_NAME)
+    if not index_id:
+        return DedupIndex()
+    dedup = DedupIndex.from_bytes(service.files().get_media(fileId=index_id).execute())
+    logger.info(f"Loaded dedup index with {len(dedup)} order lines")
+    return dedup
+
+def save_dedup_index(service, parent_id, dedup):
+    write_drive_file(service, parent_id, DEDUP_INDEX_NAME, dedup.to_bytes(), 'application/octet-stream')
+    logger.info(f"Saved dedup index with {len(dedup)} order lines")
+
+def download_file(url, headers, dest_path, session=requests):
+    response = session.get(url, headers=headers, stream=True)
+    if response.status_code != 200:
+        raise Exception(f"Download failed: {response.text}")
+    with open(dest_path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=8192):
+            f.write(chunk)
+
+def open_remote_zip(url, headers, session=None):
+    """
+    Opens a Drive-hosted zip via HTTP Range requests so that only the central
+    directory and the selected members are transferred.
+    Returns None if the server does not support ranges.
+    """
+    try:
+        remote_file = HttpRangeReader(url, headers=headers, session=session)
+    except OSError as e:
+        logger.warning(f"Range reads unavailable, falling back to full download: {e}")
+        return None
+    logger.info(f"Opened remote archive ({remote_file.size} bytes) via range requests")
+    return zipfile.ZipFile(remote_file, 'r')
 
 @functions_framework.http
 def process_amazon(request):
-    """HTTP Cloud Function to process Amazon data files (BYOS Mode)."""
+    """
+    HTTP Cloud Function to process Amazon data files (BYOS Mode).
+
+    Order-line deduplication across imports is opt-in: pass 'dedup': true
+    (or deploy with AMAZON_DEDUP=true) to skip lines already imported.
+    """
     try:
         req_json = request.get_json(silent=True)
         if not req_json:
@@ -74,99 +211,148 @@ def process_amazon(request):
         access_token = req_json.get('access_token')
         source_type = req_json.get('source_type', 'Amazon')
         debug_mode = req_json.get('debug_mode', False)
+        output_mode = req_json.get('output_mode', DEFAULT_OUTPUT_MODE)
+        dedup_enabled = req_json.get('dedup', DEFAULT_DEDUP)
 
         if not all([file_id, file_name, access_token]):
              return {"error": "Missing required fields"}, 400
 
-        logger.info(f"Starting Amazon processing for: {file_name} (Debug: {debug_mode})")
-        drive_service = get_drive_service(access_token)
-        
-        # Ensure Kintsu folder exists
-        kintsu_id = find_or_create_folder(drive_service, "Kintsu")
-
+        logger.info(f"Starting Amazon processing for: {file_name} (Debug: {debug_mode}, Output: {output_mode})")
+        user_key = drive_user_key(access_token)
+        transport = DriveTransport(user_key, access_token=access_token)
         work_dir = tempfile.mkdtemp()
+        zip_ref = None
+        writer = None
         try:
-            # Download
+            drive_service = get_drive_service(transport)
+
+            # Ensure Kintsu folder exists
+            kintsu_id = find_or_create_folder(drive_service, "Kintsu")
+
             headers = {"Authorization": f"Bearer {access_token}"}
             drive_url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
-            response = requests.get(drive_url, headers=headers, stream=True)
-            if response.status_code != 200:
-                logger.error(f"Download failed: {response.text}")
-                return {"error": "Download failed"}, 500
-
-            local_filename = os.path.join(work_dir, file_name)
-            with open(local_filename, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-
-            # Unzip / List Files
-            files_to_process = [] 
+
+            # Download / Index Archive
+            opener = None
             if file_name.lower().endswith('.zip'):
-                logger.info("Unzipping archive...")
-                extract_dir = os.path.join(work_dir, "extracted")
-                os.makedirs(extract_dir, exist_ok=True)
-                with zipfile.ZipFile(local_filename, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                for root, dirs, files in os.walk(extract_dir):
-                    for file in files:
-                        if file.startswith('.') or '__MACOSX' in root: continue
-                        files_to_process.append((os.path.join(root, file), file))
+                zip_ref = open_remote_zip(drive_url, headers, session=transport)
+                if zip_ref is None:
+                    local_filename = os.path.join(work_dir, file_name)
+                    download_file(drive_url, headers, local_filename, session=transport)
+                    zip_ref = zipfile.ZipFile(local_filename, 'r')
+                    source = ArchiveSource(zip_path=local_filename)
+                else:
+                    source = ArchiveSource(url=drive_url, headers=headers, user_key=user_key)
+
+                # Only known members are decompressed, streamed straight into pandas
+                manifest = ArchiveManifest(zip_ref)
+                files_to_process = [
+                    (name, os.path.basename(name))
+                    for name in manifest.names('order_history', 'digital_items')
+                ]
+                sibling_files = manifest.names()
+                opener = manifest.open
             else:
-                files_to_process.append((local_filename, file_name))
+                local_filename = os.path.join(work_dir, file_name)
+                download_file(drive_url, headers, local_filename, session=transport)
+                files_to_process = [(local_filename, file_name)]
+                sibling_files = [local_filename]
+                source = ArchiveSource()
 
             # Process
             processor = AmazonProcessor()
-            sibling_files = [f[0] for f in files_to_process]
-            
+            # Repeat imports only write order lines this user has not imported before
+            dedup = load_dedup_index(drive_service, kintsu_id) if dedup_enabled else None
+            # Headers and returns are read exactly once for the whole archive
+            context = processor.build_context(sibling_files, opener, dedup=dedup)
+            files_to_process = [
+                (file_path, current_file_name)
+                for file_path, current_file_name in files_to_process
+                if processor.can_process(file_path, source_type, opener=opener)
+            ]
+
             processed_count = 0
+            excluded_count = 0
+            # Shards and debug exclusions go through one rate-limited bulk path
+            writer = FirestoreBulkWriter(db)
+
+            # CSVs are parsed in parallel and streamed back in input order, so
+            # output is written while later files (or chunks) are still parsing
+            batches = iter_files(processor, context, source, files_to_process, debug=debug_mode)
+            for file_index, file_batches in itertools.groupby(batches, key=lambda batch: batch[0]):
+                current_file_name = files_to_process[file_index][1]
+                # Numbered across the whole archive so ids never collide between files
+                shard_base = processed_count
+                buffer = NdjsonBuffer()
 
-            for file_path, current_file_name in files_to_process:
-                if processor.can_process(file_path, source_type):
-                    shards, excluded = processor.process(
-                        file_path, 
-                        current_file_name, 
-                        sibling_files=sibling_files, 
-                        debug=debug_mode
-                    )
-                    
-                    for i, shard_data in enumerate(shards):
-                        shard_id = f"amazon_{file_id}_{i}"
-                        
-                        # BYOS: Write sidecar to Drive
-                        sidecar_name = f"{current_file_name}_item_{i+1}.kintsu.json"
-                        drive_sidecar_id = write_sidecar(drive_service, kintsu_id, sidecar_name, shard_data)
-
-                        final_shard = {
-                            "id": shard_id,
-                            "fileName": f"{current_file_name} (Item {i+1})",
-                            "sourceType": "Amazon",
-                            "parentZip": file_name,
-                            "status": "refined",
-                            "driveFileId": drive_sidecar_id,
-                            "createdAt": firestore.SERVER_TIMESTAMP
-                        }
-                        save_shard(final_shard, shard_id)
-                    
-                    processed_count += len(shards)
+                for _, shards, excluded in file_batches:
+                    shards, excluded = processor.drop_repeated(shards, excluded, context.dedup, debug_mode)
+
+                    if output_mode == OUTPUT_MODE_CONSOLIDATED:
+                        # Only the encoded bytes are kept until the file is done
+                        buffer.extend(shards)
+                    else:
+                        for shard_data in shards:
+                            i = processed_count - shard_base
+                            shard_id = f"amazon_{file_id}_{processed_count}"
+                            final_shard = build_shard_doc(shard_id, current_file_name, i + 1, file_name)
+                            # BYOS: Write sidecar to Drive
+                            sidecar_name = f"{current_file_name}_item_{i+1}.kintsu.json"
+                            final_shard["driveFileId"] = write_sidecar(drive_service, kintsu_id, sidecar_name, shard_data)
+                            writer.set("shards", shard_id, final_shard)
+                            processed_count += 1
 
                     if debug_mode and excluded:
-                        batch = db.batch()
                         for i, item in enumerate(excluded):
-                            debug_id = f"debug_excl_{file_id}_{i}"
-                            doc_ref = db.collection("debug_excluded_items").document(debug_id)
-                            batch.set(doc_ref, {
+                            debug_id = f"debug_excl_{file_id}_{excluded_count + i}"
+                            writer.set("debug_excluded_items", debug_id, {
                                 "fileName": current_file_name,
                                 "parentZip": file_name,
                                 "reason": item.get('reason'),
                                 "item": item,
                                 "createdAt": firestore.SERVER_TIMESTAMP
                             })
-                        batch.commit()
+                        excluded_count += len(excluded)
+
+                if output_mode == OUTPUT_MODE_CONSOLIDATED and len(buffer):
+                    # BYOS: One sidecar for the whole source file
+                    consolidated_id = write_consolidated_sidecar(drive_service, kintsu_id, current_file_name, buffer)
+                    for i in range(len(buffer)):
+                        shard_id = f"amazon_{file_id}_{shard_base + i}"
+                        final_shard = build_shard_doc(shard_id, current_file_name, i + 1, file_name)
+                        offset, length = item_range(buffer.offsets, i)
+                        final_shard.update({
+                            "driveFileId": consolidated_id,
+                            "driveItemIndex": i,
+                            "driveItemOffset": offset,
+                            "driveItemLength": length
+                        })
+                        writer.set("shards", shard_id, final_shard)
+                    processed_count += len(buffer)
+
+            write_stats = writer.close()
+
+            # Only remember lines once their shards are safely stored
+            if dedup is not None and processed_count and not write_stats.get("failed"):
+                save_dedup_index(drive_service, kintsu_id, dedup)
 
-            return {"status": "success", "processed_items": processed_count}
+            drive_stats = transport.metrics.snapshot()
+            logger.info(f"Drive transport stats: {drive_stats}")
+            return {"status": "success", "processed_items": processed_count, "write_stats": write_stats,
+                    "drive_stats": drive_stats}
 
         finally:
+            if writer is not None:
+                writer.close()
+            if zip_ref is not None:
+                remote_file = zip_ref.fp
+                zip_ref.close()
+                if isinstance(remote_file, HttpRangeReader):
+                    logger.info(f"Fetched {remote_file.bytes_fetched} of {remote_file.size} bytes "
+                                f"in {remote_file.request_count} range requests")
             shutil.rmtree(work_dir)
+            # Release the per-thread sessions and their pooled connections
+            transport.close()
             
     except Exception as e:
         logger.error(f"Function Error: {e}", exc_info=True)
@@ -0,0 +1,57 @@
+import logging
+import os
+import zipfile
+from typing import Dict, List, Optional
+
+from processor import AmazonProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveManifest:
+    """
+    Index of the relevant members of an Amazon export zip.
+
+    Built from ZipFile.infolist() alone, so nothing is decompressed until a
+    member is opened. Members are grouped by the processor's known file
+    kinds (order_history, returns, digital_items); everything else is ignored.
+    """
+
+    def __init__(self, zip_ref: zipfile.ZipFile, processor: Optional[AmazonProcessor] = None):
+        self.zip_ref = zip_ref
+        self.processor = processor or AmazonProcessor()
+        self.members: Dict[str, List[zipfile.ZipInfo]] = {}
+        self.total_size = 0
+        self.selected_size = 0
+
+        for info in zip_ref.infolist():
+            self.total_size += info.file_size
+            if info.is_dir() or self._is_hidden(info.filename):
+                continue
+            kind = self.processor.classify_file(info.filename)
+            if kind:
+                self.members.setdefault(kind, []).append(info)
+                self.selected_size += info.file_size
+
+        for infos in self.members.values():
+            infos.sort(key=lambda i: i.filename)
+
+        logger.info(f"Archive manifest: {sum(len(v) for v in self.members.values())} relevant members, "
+                    f"{self.selected_size} of {self.total_size} uncompressed bytes")
+
+    @staticmethod
+    def _is_hidden(name: str) -> bool:
+        return '__MACOSX' in name or os.path.basename(name).startswith('.')
+
+    def names(self, *kinds: str) -> List[str]:
+        """
+        Member names for the given kinds (all kinds if none given).
+        """
+        kinds = kinds or tuple(self.members.keys())
+        return [info.filename for kind in kinds for info in self.members.get(kind, [])]
+
+    def open(self, name: str):
+        """
+        Opens a member as a streaming, decompressing file object.
+        """
+        return self.zip_ref.open(name, 'r')
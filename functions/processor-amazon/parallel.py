@@ -0,0 +1,173 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from processor import AmazonProcessor, AmazonArchiveContext
+from range_reader import HttpRangeReader
+from drive_transport import DriveTransport, TokenBucket, user_bucket, DEFAULT_QUOTA_PER_MINUTE
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveSource:
+    """
+    Picklable description of where the CSVs live, so each worker process
+    can open its own handle: plain files on disk, a local zip, or a
+    Drive-hosted zip read through HTTP range requests (over a rate-limited
+    DriveTransport when the user's bucket key is given).
+
+    Token buckets are per process, so a source whose quota is split
+    `rate_share` ways paces each process that opens it at 1/rate_share of
+    the user's quota.
+    """
+
+    def __init__(self, zip_path: Optional[str] = None, url: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None, user_key: Optional[str] = None,
+                 rate_share: int = 1):
+        self.zip_path = zip_path
+        self.url = url
+        self.headers = headers
+        self.user_key = user_key
+        self.rate_share = rate_share
+
+    def for_workers(self, shares: int) -> 'ArchiveSource':
+        """
+        Copy of this source for worker processes that split the user's quota
+        `shares` ways.
+        """
+        return ArchiveSource(self.zip_path, self.url, self.headers, self.user_key, rate_share=shares)
+
+    def transport(self) -> DriveTransport:
+        if self.rate_share > 1:
+            bucket = TokenBucket(DEFAULT_QUOTA_PER_MINUTE / 60.0 / self.rate_share)
+        else:
+            bucket = user_bucket(self.user_key)
+        return DriveTransport(self.user_key, bucket=bucket)
+
+    @contextmanager
+    def open(self):
+        """
+        Yields an opener for member names (None for plain files on disk).
+        """
+        if self.zip_path is None and self.url is None:
+            yield None
+            return
+        session = None
+        if self.zip_path:
+            fileobj = self.zip_path
+        else:
+            session = self.transport() if self.user_key else None
+            fileobj = HttpRangeReader(self.url, headers=self.headers, session=session)
+        try:
+            with zipfile.ZipFile(fileobj, 'r') as zip_ref:
+                yield lambda name: zip_ref.open(name, 'r')
+        finally:
+            if session is not None:
+                session.close()
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- Worker process state (set once per worker by the pool initializer) ---
+
+_worker = {}
+
+
+def _init_worker(processor: AmazonProcessor, context: AmazonArchiveContext, source: ArchiveSource):
+    source_cm = source.open()
+    context.opener = source_cm.__enter__()
+    # Workers live until the pool shuts down; release the archive (and its
+    # Drive sessions) when the process exits
+    atexit.register(source_cm.__exit__, None, None, None)
+    _worker.update(processor=processor, context=context, source_cm=source_cm)
+
+
+@contextmanager
+def _parent_share(source: ArchiveSource, shares: int):
+    """
+    Paces the parent's own Drive calls (the user's process-wide bucket, which
+    its output writes go through) at its 1/shares of the quota while the
+    workers hold the rest.
+    """
+    if not source.user_key:
+        yield
+        return
+    bucket = user_bucket(source.user_key)
+    rate = bucket.rate
+    bucket.rate = rate / shares
+    try:
+        yield
+    finally:
+        bucket.rate = rate
+
+
+def _process_in_worker(file_path: str, file_name: str, debug: bool) -> Tuple[list, list]:
+    return _worker['processor'].process(file_path, file_name, debug=debug, context=_worker['context'])
+
+
+def iter_files(processor: AmazonProcessor, context: AmazonArchiveContext, source: ArchiveSource,
+               files: List[Tuple[str, str]], debug: bool = False,
+               max_workers: Optional[int] = None) -> Iterator[Tuple[int, list, list]]:
+    """
+    Streams (file_index, shards, excluded) batches in input order.
+
+    With one worker the files are parsed inline and streamed chunk by chunk
+    through processor.iter_process. Otherwise a process pool sized to the
+    available CPUs parses them concurrently (the read-only context is shipped
+    to each worker once) and each file arrives as a single batch as soon as
+    it and every earlier file are done.
+    """
+    workers = min(len(files), max_workers or available_cpus())
+    if workers <= 1:
+        for index, (path, name) in enumerate(files):
+            for shards, excluded in processor.iter_process(path, name, debug=debug, context=context):
+                yield index, shards, excluded
+        return
+
+    logger.info(f"Processing {len(files)} files across {workers} worker processes")
+    opener, context.opener = context.opener, None  # archive handles do not pickle
+    # The parent keeps writing to Drive while the workers read from it, so
+    # the user's quota is split between all workers + 1 processes
+    shares = workers + 1
+    try:
+        # spawn, not fork: the parent holds gRPC / HTTP client threads
+        with _parent_share(source, shares), ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(processor, context, source.for_workers(shares))
+        ) as pool:
+            results = pool.map(
+                _process_in_worker,
+                [path for path, _ in files],
+                [name for _, name in files],
+                [debug] * len(files)
+            )
+            for index, (shards, excluded) in enumerate(results):
+                yield index, shards, excluded
+    finally:
+        context.opener = opener
+
+
+def process_files(processor: AmazonProcessor, context: AmazonArchiveContext, source: ArchiveSource,
+                  files: List[Tuple[str, str]], debug: bool = False,
+                  max_workers: Optional[int] = None) -> List[Tuple[list, list]]:
+    """
+    Collects iter_files into one (shards, excluded) result per file, in
+    input order, whatever order the workers finish in.
+    """
+    results = [([], []) for _ in files]
+    for index, shards, excluded in iter_files(processor, context, source, files, debug, max_workers):
+        results[index][0].extend(shards)
+        results[index][1].extend(excluded)
+    return results
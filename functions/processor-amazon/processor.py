@@ -1,9 +1,21 @@
+import numpy as np
 import pandas as pd
+import csv
+import io
+import re
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
+from keyword_matcher import KeywordMatcher, get_matcher, MATCH_ASSET, MATCH_IGNORE
 
 logger = logging.getLogger(__name__)
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
 # --- Defaults ---
 DEFAULT_MIN_PRICE = 15.00
 
@@ -27,39 +39,492 @@ ASSET_KEYWORDS = [
     'rechargeable', 'tool', 'device', 'appliance', 'kit'
 ]
 
+DEFAULT_RULESET_VERSION = 'default'
+
+# Order histories are read in fixed-size pieces so peak memory stays flat
+CSV_CHUNK_ROWS = 50000
+CSV_BLOCK_BYTES = 8 * 1024 * 1024
+
+# Known Amazon export members (matched against archive member names)
+AMAZON_FILE_PATTERNS = {
+    'order_history': re.compile(r'Retail\.OrderHistory', re.IGNORECASE),
+    'returns': re.compile(r'Retail\.OrdersReturned', re.IGNORECASE),
+    'digital_items': re.compile(r'Digital[ ._-]?(Items|Orders|Ordering)', re.IGNORECASE),
+}
+
+# Column candidates, in priority order (substring match on lowercased headers)
+COLUMN_CANDIDATES = {
+    'id': ['order id', 'order_id'],
+    'date': ['order date', 'date'],
+    'desc': ['item description', 'description', 'title', 'product name'],
+    'price': ['unit price', 'price', 'amount'],
+    'status': ['status', 'order status'],
+}
+
+# Header classifications
+CSV_KIND_ORDERS = 'orders'
+CSV_KIND_RETURNS = 'returns'
+CSV_KIND_UNKNOWN = 'unknown'
+
+# Exclusion reasons (also the debug record 'reason' values)
+REASON_STATUS = 'status_returned_or_cancelled'
+REASON_RETURNS_FILE = 'found_in_returns_file'
+REASON_TRIAGE = 'asset_triage_filtered'
+REASON_DUPLICATE = 'duplicate_order_line'
+
+_NAN_LITERALS = ('nan', '+nan', '-nan')
+
+
+def _safe_float(value: str) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _as_str(series: pd.Series) -> pd.Series:
+    """
+    Vectorized equivalent of calling str() on every cell (missing -> 'nan').
+    """
+    return series.astype(str).where(series.notna(), 'nan')
+
+
+def _per_unique(series: pd.Series, func) -> pd.Series:
+    """
+    Applies a vectorized Series -> Series function to the distinct values only
+    and broadcasts the result back. Order-history columns (status, price,
+    title) repeat heavily, so this cuts the string work dramatically.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    result = func(pd.Series(np.asarray(uniques, dtype=object), dtype=object))
+    return pd.Series(result.to_numpy()[codes], index=series.index)
+
+
+def _parse_prices(series: pd.Series) -> pd.Series:
+    """
+    Vectorized equivalent of float(str(v).replace('$', '').replace(',', '').strip()),
+    falling back to 0.0 for unparseable values.
+    """
+    cleaned = _as_str(series).str.replace('$', '', regex=False).str.replace(',', '', regex=False).str.strip()
+    prices = pd.to_numeric(cleaned, errors='coerce').astype('float64')
+
+    # to_numeric is stricter than float() for a few spellings; defer those to float()
+    unresolved = prices.isna() & ~cleaned.str.lower().isin(_NAN_LITERALS)
+    if unresolved.any():
+        prices[unresolved] = cleaned[unresolved].map(_safe_float)
+    return prices
+
+
+def build_matcher(rules_version: str = DEFAULT_RULESET_VERSION,
+                  extra_asset_keywords: List[str] = None,
+                  extra_ignore_keywords: List[str] = None) -> KeywordMatcher:
+    """
+    Compiled matcher for the default keyword lists plus optional per-user
+    overrides. Compiled once per rules_version and cached.
+    """
+    return get_matcher(
+        rules_version,
+        ASSET_KEYWORDS + list(extra_asset_keywords or []),
+        DEFAULT_IGNORE_KEYWORDS + list(extra_ignore_keywords or [])
+    )
+
+
+
+def _normalize_header(name: str) -> str:
+    return str(name).lower().replace(' ', '').replace('_', '')
+
+
+def _hash_strings(values) -> np.ndarray:
+    """
+    Stable 64-bit hashes for an iterable of strings.
+    """
+    return pd.util.hash_array(np.asarray(list(values), dtype=object))
+
+
+class ReturnsIndex:
+    """
+    Compact set of returned order IDs, kept as a sorted array of 64-bit
+    hashes instead of Python strings. Built once per archive.
+    """
+
+    def __init__(self, order_ids=()):
+        self._hashes = np.unique(_hash_strings(order_ids))
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, order_id: str) -> bool:
+        if not len(self._hashes):
+            return False
+        h = _hash_strings([order_id])[0]
+        i = np.searchsorted(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+
+    def isin(self, order_ids: pd.Series) -> pd.Series:
+        """
+        Vectorized membership for a Series of order ID strings.
+        """
+        if not len(self._hashes):
+            return pd.Series(False, index=order_ids.index)
+        hashes = _hash_strings(order_ids.tolist())
+        return pd.Series(np.isin(hashes, self._hashes), index=order_ids.index)
+
+
+def order_line_keys(order_ids: pd.Series, descs: pd.Series, prices: pd.Series, dates: pd.Series) -> np.ndarray:
+    """
+    64-bit keys identifying an order line by (order id, item description,
+    unit price, date). Stable across processes and runs.
+    """
+    frame = pd.DataFrame({
+        'id': order_ids.astype(str).str.strip().to_numpy(),
+        'desc': descs.astype(str).str.strip().to_numpy(),
+        'price': prices.astype('float64').round(2).to_numpy(),
+        'date': dates.astype(str).str.strip().to_numpy(),
+    })
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+
+
+class DedupIndex:
+    """
+    Order lines already imported, kept as a sorted array of 64-bit line keys.
+    Serialises to 8 bytes per line so it can be persisted per user and
+    loaded before the next import.
+    """
+
+    def __init__(self, keys=()):
+        self._hashes = np.unique(np.asarray(keys, dtype=np.uint64))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'DedupIndex':
+        return cls(np.frombuffer(data, dtype='<u8'))
+
+    def to_bytes(self) -> bytes:
+        return self._hashes.astype('<u8').tobytes()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def fork(self) -> 'DedupIndex':
+        """
+        Independent copy for one process() call. Cheap: add() replaces the
+        array rather than mutating it, so the base array can be shared.
+        """
+        forked = DedupIndex()
+        forked._hashes = self._hashes
+        return forked
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        if not len(self._hashes):
+            return np.zeros(len(keys), dtype=bool)
+        pos = np.searchsorted(self._hashes, keys).clip(max=len(self._hashes) - 1)
+        return self._hashes[pos] == keys
+
+    def add(self, keys: np.ndarray):
+        self._hashes = np.union1d(self._hashes, np.asarray(keys, dtype=np.uint64))
+
+    def mark_duplicates(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Flags keys that are already indexed or repeat an earlier key in the
+        same array, then indexes the rest.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        duplicate = self.contains(keys) | pd.Series(keys).duplicated().to_numpy()
+        self.add(keys[~duplicate])
+        return duplicate
+
+
+class AmazonArchiveContext:
+    """
+    Read-only state shared by every process() call for one archive: the
+    returned-order index, header classifications and column mappings, plus
+    the optional index of previously imported order lines.
+    Built once per process_amazon invocation via AmazonProcessor.build_context.
+    """
+
+    def __init__(self, returns: Optional[ReturnsIndex] = None, opener=None,
+                 dedup: Optional[DedupIndex] = None):
+        self.returns = returns or ReturnsIndex()
+        self.opener = opener
+        # None disables order-line deduplication
+        self.dedup = dedup
+        # file_path -> (columns, kind)
+        self.headers: Dict[str, tuple] = {}
+        # file_path -> resolved column mapping (order files only)
+        self.columns: Dict[str, Dict[str, Optional[str]]] = {}
+        self.returns_files: List[str] = []
+
+
 class AmazonProcessor:
-    def can_process(self, file_path: str, source_type: str) -> bool:
+    def __init__(self, matcher: Optional[KeywordMatcher] = None, chunk_rows: int = CSV_CHUNK_ROWS):
+        # Per-archive header cache: file_path -> (columns, kind)
+        self._header_cache: Dict[str, tuple] = {}
+        self.matcher = matcher or build_matcher()
+        self.chunk_rows = chunk_rows
+
+    def can_process(self, file_path: str, source_type: str, opener=None) -> bool:
         if source_type == 'Amazon':
-            return True
+            # Everything in an Amazon export is a candidate; only the header
+            # decides whether it is worth a full parse.
+            return self.sniff_kind(file_path, opener) == CSV_KIND_ORDERS
         if 'Retail.OrderHistory' in file_path:
             return True
         return False
 
+    def classify_file(self, file_path: str) -> Optional[str]:
+        """
+        Returns the known export kind for a CSV path, or None if unrecognised.
+        """
+        if not file_path.lower().endswith('.csv'):
+            return None
+        for kind, pattern in AMAZON_FILE_PATTERNS.items():
+            if pattern.search(file_path):
+                return kind
+        return None
+
+    @staticmethod
+    def resolve_columns(columns: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Maps logical fields (id, date, desc, price, status) to actual header names.
+        """
+        cols_lower = [str(c).lower() for c in columns]
+
+        def get_col(candidates):
+            for c in candidates:
+                for i, col in enumerate(cols_lower):
+                    if c in col: return columns[i]
+            return None
+
+        return {field: get_col(candidates) for field, candidates in COLUMN_CANDIDATES.items()}
+
+    @staticmethod
+    def classify_header(columns: List[str]) -> str:
+        """
+        Classifies a CSV by its header row alone.
+        """
+        resolved = AmazonProcessor.resolve_columns(columns)
+        if resolved['desc'] and resolved['price']:
+            return CSV_KIND_ORDERS
+        if any('orderid' in _normalize_header(c) for c in columns):
+            return CSV_KIND_RETURNS
+        return CSV_KIND_UNKNOWN
+
+    def _read_header(self, file_path: str, opener=None) -> List[str]:
+        """
+        Reads only the first line of a CSV (one small decompressed chunk for
+        archive members) and parses it as a header row.
+        """
+        open_fn = opener or (lambda path: open(path, 'rb'))
+        with open_fn(file_path) as fh:
+            first_line = fh.readline()
+        text = first_line.decode('utf-8-sig', errors='replace')
+        return next(csv.reader(io.StringIO(text)), [])
+
+    def sniff_header(self, file_path: str, opener=None) -> tuple:
+        """
+        Returns (columns, kind) for a CSV, cached for the lifetime of this
+        processor (one archive).
+        """
+        cached = self._header_cache.get(file_path)
+        if cached is not None:
+            return cached
+
+        columns, kind = [], CSV_KIND_UNKNOWN
+        if file_path.lower().endswith('.csv'):
+            try:
+                columns = self._read_header(file_path, opener)
+                kind = self.classify_header(columns)
+            except Exception as e:
+                logger.warning(f"Header sniff failed for {file_path}: {e}")
+
+        self._header_cache[file_path] = (columns, kind)
+        return columns, kind
+
+    def sniff_kind(self, file_path: str, opener=None) -> str:
+        return self.sniff_header(file_path, opener)[1]
+
+    def _read_csv(self, file_path: str, opener=None, **read_kwargs) -> pd.DataFrame:
+        """
+        Reads a CSV from disk, or through `opener` (e.g. ZipFile.open) when the
+        file is an archive member that was never extracted.
+        """
+        if opener is None:
+            return pd.read_csv(file_path, **read_kwargs)
+        with opener(file_path) as fh:
+            return pd.read_csv(fh, **read_kwargs)
+
+    def _iter_csv_chunks(self, file_path: str, usecols: List[str], opener=None):
+        """
+        Yields DataFrames of at most chunk_rows rows holding only `usecols`,
+        all read as strings. Uses pyarrow's streaming reader when installed,
+        otherwise the pandas C parser. The index runs on across chunks so
+        row numbers match a single-shot read.
+        """
+        open_fn = opener or (lambda path: open(path, 'rb'))
+        with open_fn(file_path) as fh:
+            if pa_csv is not None:
+                reader = pa_csv.open_csv(
+                    fh,
+                    read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_BYTES),
+                    # Gift messages and item notes hold quoted newlines that can
+                    # straddle a block boundary
+                    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                    convert_options=pa_csv.ConvertOptions(
+                        include_columns=usecols,
+                        column_types={c: pa.string() for c in usecols},
+                        strings_can_be_null=True
+                    )
+                )
+                offset = 0
+                for batch in reader:
+                    for start in range(0, batch.num_rows, self.chunk_rows):
+                        piece = batch.slice(start, self.chunk_rows).to_pandas()
+                        piece.index = pd.RangeIndex(offset, offset + len(piece))
+                        offset += len(piece)
+                        yield piece
+            else:
+                yield from pd.read_csv(fh, usecols=usecols, dtype=str, chunksize=self.chunk_rows)
+
     def is_likely_asset(self, description: str, price: float) -> bool:
-        desc_lower = description.lower()
-        
-        for asset_word in ASSET_KEYWORDS:
-            if asset_word in desc_lower:
-                return True
+        match = self.matcher.classify(description)
+
+        # Asset keywords win even for cheap / consumable-looking items
+        if match == MATCH_ASSET:
+            return True
 
         if price < DEFAULT_MIN_PRICE:
             return False
 
-        for keyword in DEFAULT_IGNORE_KEYWORDS:
-            if keyword in desc_lower:
-                return False
-                
-        return True
+        return match != MATCH_IGNORE
+
+    def triage_mask(self, descriptions: pd.Series, prices: pd.Series) -> pd.Series:
+        """
+        Vectorized is_likely_asset over aligned description/price Series.
+        """
+        matches = self.matcher.classify_series(descriptions)
+        # NaN prices are not below the floor, matching the scalar comparison
+        return (matches == MATCH_ASSET) | (~(prices < DEFAULT_MIN_PRICE) & (matches != MATCH_IGNORE))
 
-    def _parse_returns(self, file_path: str) -> set:
+    def _extract_items(self, df: pd.DataFrame, resolved: Dict[str, Optional[str]],
+                       returns: ReturnsIndex, debug_mode: bool,
+                       dedup: Optional[DedupIndex] = None) -> tuple:
+        """
+        Applies the status, returns and asset-triage filters to the whole
+        DataFrame at once, then builds shard / exclusion records in row order.
+        With a dedup index, lines it already holds (or that repeat within the
+        frame) are excluded and the remaining shards are added to it.
+        """
+        n_rows = len(df)
+        descs = _as_str(df[resolved['desc']])
+        prices = _per_unique(df[resolved['price']], _parse_prices).astype('float64')
+        dates = _as_str(df[resolved['date']]) if resolved['date'] else pd.Series([None] * n_rows, index=df.index, dtype=object)
+        statuses = _as_str(df[resolved['status']]) if resolved['status'] else pd.Series(['Unknown'] * n_rows, index=df.index, dtype=object)
+        order_ids = _as_str(df[resolved['id']]) if resolved['id'] else pd.Series([None] * n_rows, index=df.index, dtype=object)
+
+        is_status_excluded = _per_unique(statuses, lambda s: (
+            s.str.lower().str.contains('returned', regex=False)
+            | s.str.lower().str.contains('cancelled', regex=False)
+        )).astype(bool)
+        if resolved['id'] and len(returns):
+            is_returned = returns.isin(order_ids) & (order_ids != '')
+        else:
+            is_returned = pd.Series(False, index=df.index)
+        is_asset = self.triage_mask(descs, prices)
+
+        # First matching filter wins, same precedence as the original row loop
+        reasons = np.select(
+            [is_status_excluded.to_numpy(dtype=bool), is_returned.to_numpy(dtype=bool), ~is_asset.to_numpy(dtype=bool)],
+            [REASON_STATUS, REASON_RETURNS_FILE, REASON_TRIAGE],
+            default=''
+        )
+
+        line_keys = None
+        if dedup is not None:
+            line_keys = order_line_keys(order_ids, descs, prices, dates)
+            candidates = np.flatnonzero(reasons == '')
+            reasons[candidates[dedup.mark_duplicates(line_keys[candidates])]] = REASON_DUPLICATE
+
+        rows = df.index.tolist()
+        desc_list = descs.tolist()
+        price_list = prices.tolist()
+        date_list = dates.tolist()
+        status_list = statuses.tolist()
+        id_list = order_ids.tolist()
+
+        shards = []
+        for pos in np.flatnonzero(reasons == ''):
+            shards.append({
+                "item_name": desc_list[pos],
+                "total_amount": price_list[pos],
+                "currency": "USD",
+                "date": date_list[pos],
+                "merchant": "Amazon",
+                "confidence": "High",
+                "category": "Uncategorized",
+                "order_id": id_list[pos],
+                "source_meta": {
+                    "original_row": rows[pos],
+                    "status": status_list[pos],
+                    "filter_method": "heuristic_v1"
+                }
+            })
+            if line_keys is not None:
+                shards[-1]["source_meta"]["line_key"] = f"{line_keys[pos]:016x}"
+
+        n_duplicates = int((reasons == REASON_DUPLICATE).sum())
+        if n_duplicates:
+            logger.info(f"Skipped {n_duplicates} already imported order lines.")
+
+        n_returned = int((reasons == REASON_RETURNS_FILE).sum())
+        if n_returned:
+            logger.info(f"Skipped {n_returned} items found in returns file.")
+
+        excluded = []
+        if debug_mode:
+            for pos in np.flatnonzero(reasons != ''):
+                reason = str(reasons[pos])
+                record = {
+                    "item_name": desc_list[pos],
+                    "reason": reason,
+                    "order_id": id_list[pos],
+                }
+                if reason == REASON_TRIAGE:
+                    record["price"] = price_list[pos]
+                record["original_row"] = rows[pos]
+                excluded.append(record)
+
+        return shards, excluded
+
+    def build_context(self, file_paths: List[str], opener=None,
+                      dedup: Optional[DedupIndex] = None) -> AmazonArchiveContext:
+        """
+        Sniffs every CSV header in the archive once and parses the returns
+        file(s) once, producing the context passed to each process() call.
+        """
+        context = AmazonArchiveContext(opener=opener, dedup=dedup)
+        returned_ids = set()
+        for path in file_paths or []:
+            columns, kind = self.sniff_header(path, opener)
+            context.headers[path] = (columns, kind)
+            if kind == CSV_KIND_ORDERS:
+                context.columns[path] = self.resolve_columns(columns)
+            elif kind == CSV_KIND_RETURNS and 'Retail.OrdersReturned' in path:
+                returned_ids |= self._parse_returns(path, opener)
+                context.returns_files.append(path)
+
+        context.returns = ReturnsIndex(returned_ids)
+        logger.info(f"Archive context: {len(context.columns)} order files, {len(context.returns)} returned orders.")
+        return context
+
+    def _parse_returns(self, file_path: str, opener=None) -> set:
         returned_ids = set()
         try:
             logger.info(f"Parsing returns from {file_path}...")
-            df = pd.read_csv(file_path)
-            col_id = next((c for c in df.columns if 'orderid' in c.lower()), None)
+            columns, _ = self.sniff_header(file_path, opener)
+            col_id = next((c for c in columns if 'orderid' in _normalize_header(c)), None)
             
             if col_id:
-                returned_ids = set(df[col_id].dropna().astype(str).unique())
+                df = self._read_csv(file_path, opener, usecols=[col_id], dtype=str)
+                returned_ids = set(df[col_id].dropna().unique())
                 logger.info(f"Found {len(returned_ids)} returned orders.")
             else:
                 logger.warning("Could not find OrderID column in returns file.")
@@ -67,121 +532,88 @@ class AmazonProcessor:
             logger.error(f"Error parsing returns: {e}", exc_info=True)
         return returned_ids
 
-    def process(self, file_path: str, original_filename: str, sibling_files: List[str] = None, **kwargs) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-        shards = []
-        excluded = []
+    def drop_repeated(self, shards: List[Dict[str, Any]], excluded: List[Dict[str, Any]],
+                      dedup: Optional[DedupIndex], debug_mode: bool = False) -> tuple:
+        """
+        Drops order lines already seen in earlier files or batches and records
+        the kept lines in `dedup`. Each process() call only dedupes within its
+        own file, so applying this to every batch in input order (the earliest
+        file wins) is what makes parallel and serial runs agree.
+        """
+        if dedup is None or not shards:
+            return shards, excluded
+
+        keys = np.array([int(s["source_meta"]["line_key"], 16) for s in shards], dtype=np.uint64)
+        duplicate = dedup.mark_duplicates(keys)
+        if duplicate.any():
+            logger.info(f"Skipped {int(duplicate.sum())} order lines repeated across files.")
+            if debug_mode:
+                excluded = excluded + [{
+                    "item_name": s["item_name"],
+                    "reason": REASON_DUPLICATE,
+                    "order_id": s["order_id"],
+                    "original_row": s["source_meta"]["original_row"],
+                } for s, d in zip(shards, duplicate) if d]
+            shards = [s for s, d in zip(shards, duplicate) if not d]
+        return shards, excluded
+
+    def _iter_batches(self, file_path: str, sibling_files: Optional[List[str]], kwargs: Dict[str, Any]):
+        """
+        Yields (shards, excluded) for each CSV chunk of file_path. Errors
+        propagate; process() and iter_process() decide how to report them.
+        """
         debug_mode = kwargs.get('debug', False)
+        context = kwargs.get('context')
 
-        try:
-            if not file_path.endswith('.csv'):
-                logger.info(f"Skipping non-CSV file: {file_path}")
-                return [], []
-
-            returned_order_ids = set()
-            if sibling_files:
-                for s_path in sibling_files:
-                    if 'Retail.OrdersReturned' in s_path and s_path.endswith('.csv'):
-                        returned_order_ids = self._parse_returns(s_path)
-                        break
-
-            logger.info(f"Analyzing {file_path}...")
-            
-            try:
-                df = pd.read_csv(file_path)
-            except Exception as e:
-                logger.error(f"Pandas read error: {e}")
-                return [], []
+        if context is None:
+            # Standalone call: build the archive context from the siblings
+            context = self.build_context(
+                list(dict.fromkeys(list(sibling_files or []) + [file_path])),
+                kwargs.get('opener'),
+                dedup=kwargs.get('dedup')
+            )
+        # Dedupe within this file only; drop_repeated handles cross-file repeats
+        seen = context.dedup.fork() if context.dedup is not None else None
 
-            cols = df.columns.tolist()
-            cols_lower = [c.lower() for c in cols]
-            
-            def get_col(candidates):
-                for c in candidates:
-                    for i, col in enumerate(cols_lower):
-                        if c in col: return cols[i]
-                return None
-
-            col_id = get_col(['order id', 'order_id'])
-            col_date = get_col(['order date', 'date'])
-            col_desc = get_col(['item description', 'description', 'title', 'product name'])
-            col_price = get_col(['unit price', 'price', 'amount'])
-            col_status = get_col(['status', 'order status'])
-            
-            if not col_desc or not col_price:
-                logger.warning("Critical columns not found. Falling back.")
-                return [], []
-
-            for index, row in df.iterrows():
-                try:
-                    desc = str(row[col_desc])
-                    price_str = str(row[col_price]).replace('$', '').replace(',', '').strip()
-                    date_str = str(row[col_date]) if col_date else None
-                    status = str(row[col_status]) if col_status else 'Unknown'
-                    order_id = str(row[col_id]) if col_id else None
-                    
-                    if 'returned' in status.lower() or 'cancelled' in status.lower():
-                        if debug_mode:
-                            excluded.append({
-                                "item_name": desc,
-                                "reason": "status_returned_or_cancelled",
-                                "order_id": order_id,
-                                "original_row": index
-                            })
-                        continue
-                    
-                    if order_id and order_id in returned_order_ids:
-                        logger.info(f"Skipping returned item: {desc} (Order {order_id})")
-                        if debug_mode:
-                            excluded.append({
-                                "item_name": desc,
-                                "reason": "found_in_returns_file",
-                                "order_id": order_id,
-                                "original_row": index
-                            })
-                        continue
-                        
-                    try:
-                        price = float(price_str)
-                    except:
-                        price = 0.0
-                    
-                    if not self.is_likely_asset(desc, price):
-                        if debug_mode:
-                             excluded.append({
-                                "item_name": desc,
-                                "reason": "asset_triage_filtered",
-                                "order_id": order_id,
-                                "price": price,
-                                "original_row": index
-                            })
-                        continue
-
-                    shard_data = {
-                        "item_name": desc,
-                        "total_amount": price,
-                        "currency": "USD",
-                        "date": date_str,
-                        "merchant": "Amazon",
-                        "confidence": "High", 
-                        "category": "Uncategorized", 
-                        "order_id": order_id, 
-                        "source_meta": {
-                            "original_row": index,
-                            "status": status,
-                            "filter_method": "heuristic_v1"
-                        }
-                    }
-                    shards.append(shard_data)
-                    
-                except Exception as row_err:
-                    logger.error(f"Row error: {row_err}")
-                    continue
-
-            logger.info(f"Extracted {len(shards)} valid items.")
-            if debug_mode:
-                logger.info(f"Captured {len(excluded)} excluded items.")
-            return shards, excluded
+        if not file_path.endswith('.csv'):
+            logger.info(f"Skipping non-CSV file: {file_path}")
+            return
+
+        resolved = context.columns.get(file_path)
+        if resolved is None:
+            logger.info(f"No order columns in header of {file_path}. Skipping.")
+            return
+
+        logger.info(f"Analyzing {file_path}...")
+
+        # Only the mapped columns are parsed, in fixed-size chunks
+        usecols = list(dict.fromkeys(c for c in resolved.values() if c))
+        for chunk in self._iter_csv_chunks(file_path, usecols, context.opener):
+            yield self._extract_items(chunk, resolved, context.returns, debug_mode, seen)
 
+    def iter_process(self, file_path: str, original_filename: str, sibling_files: List[str] = None, **kwargs) -> Iterator[tuple]:
+        """
+        Streaming form of process(): yields (shards, excluded) one CSV chunk
+        at a time, so callers can write output while parsing continues and
+        memory stays bounded by chunk_rows. A read error ends the stream;
+        batches already yielded stand.
+        """
+        try:
+            yield from self._iter_batches(file_path, sibling_files, kwargs)
+        except Exception as e:
+            logger.error(f"CSV read error: {e}", exc_info=True)
+
+    def process(self, file_path: str, original_filename: str, sibling_files: List[str] = None, **kwargs) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        shards, excluded = [], []
+        try:
+            for chunk_shards, chunk_excluded in self._iter_batches(file_path, sibling_files, kwargs):
+                shards.extend(chunk_shards)
+                excluded.extend(chunk_excluded)
         except Exception as e:
             logger.error(f"Critical Error: {e}", exc_info=True)
             return [], []
+
+        logger.info(f"Extracted {len(shards)} valid items.")
+        if kwargs.get('debug', False):
+            logger.info(f"Captured {len(excluded)} excluded items.")
+        return shards, excluded
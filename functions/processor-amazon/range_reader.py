@@ -0,0 +1,193 @@
+import io
+import logging
+import re
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_MAX_BLOCKS = 64
+# Upper bound of the read-ahead window, in blocks (4 MiB by default)
+DEFAULT_MAX_READAHEAD_BLOCKS = 16
+
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class HttpRangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file object backed by HTTP Range requests.
+
+    Lets zipfile read a Drive-hosted archive's central directory and only the
+    members it opens, instead of downloading the whole file. Fetched data is
+    kept in a small LRU cache of fixed-size blocks.
+
+    Sequential reads (zipfile streams a member a few KiB at a time) read
+    ahead: each miss that continues the previous fetch doubles the extra
+    blocks requested, up to `max_readahead` (and half the cache), so a large
+    member costs a handful of round-trips instead of one per block.
+    """
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None,
+                 session=None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 max_blocks: int = DEFAULT_MAX_BLOCKS,
+                 max_readahead: int = DEFAULT_MAX_READAHEAD_BLOCKS):
+        super().__init__()
+        self.url = url
+        self.headers = dict(headers or {})
+        self.session = session or requests.Session()
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._pos = 0
+        self.max_readahead = max(0, min(max_readahead, max_blocks // 2))
+        self._readahead = 0
+        # Block right after the last fetch; a miss there is a sequential read
+        self._next_block = None
+
+        # Transfer stats (useful for logging / tests)
+        self.bytes_fetched = 0
+        self.request_count = 0
+
+        self._size = self._probe_size()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _get_range(self, start: int, end: int):
+        """
+        Issues a streamed Range request and returns the 206 response.
+        Any other answer is closed unread, so a server that ignores Range and
+        sends the whole file costs no body transfer, and raises OSError.
+        """
+        headers = dict(self.headers)
+        headers['Range'] = f"bytes={start}-{end}"
+        response = self.session.get(self.url, headers=headers, stream=True)
+        self.request_count += 1
+        if response.status_code != 206:
+            response.close()
+            raise OSError(f"Range request {start}-{end} failed (HTTP {response.status_code})")
+        return response
+
+    def _read_body(self, response) -> bytes:
+        try:
+            data = response.content
+        finally:
+            response.close()
+        self.bytes_fetched += len(data)
+        return data
+
+    def _probe_size(self) -> int:
+        """
+        Issues a one-byte range request to learn the total size from the
+        Content-Range header. Raises OSError if the server does not honour
+        Range requests.
+        """
+        response = self._get_range(0, 0)
+        try:
+            match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        finally:
+            response.close()
+        if not match or match.group(3) == '*':
+            raise OSError("Missing total size in Content-Range header")
+        return int(match.group(3))
+
+    def _fetch(self, first_block: int, last_block: int):
+        """
+        Fetches a contiguous run of blocks with a single Range request.
+        """
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, self._size) - 1
+        data = self._read_body(self._get_range(start, end))
+        for index in range(first_block, last_block + 1):
+            offset = (index - first_block) * self.block_size
+            self._store(index, data[offset:offset + self.block_size])
+
+    def _readahead_end(self, first: int, last: int) -> int:
+        """
+        Last block to fetch for the missing run first..last, widened by the
+        read-ahead window when the run continues the previous fetch.
+        """
+        if first == self._next_block:
+            self._readahead = min(max(1, self._readahead * 2), self.max_readahead)
+        else:
+            self._readahead = 0
+        final_block = (self._size - 1) // self.block_size
+        end = min(last + self._readahead, final_block)
+        self._next_block = end + 1
+        return end
+
+    def _store(self, index: int, data: bytes):
+        self._blocks[index] = data
+        self._blocks.move_to_end(index)
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+
+    def _read_span(self, start: int, length: int) -> bytes:
+        first_block = start // self.block_size
+        last_block = (start + length - 1) // self.block_size
+
+        if last_block - first_block + 1 > self.max_blocks:
+            # Larger than the cache; stream it straight through
+            return self._read_body(self._get_range(start, start + length - 1))
+
+        missing = [i for i in range(first_block, last_block + 1) if i not in self._blocks]
+        if missing:
+            # One request for the whole missing run keeps large member reads cheap
+            self._fetch(missing[0], self._readahead_end(missing[0], missing[-1]))
+
+        parts = []
+        for index in range(first_block, last_block + 1):
+            self._blocks.move_to_end(index)
+            parts.append(self._blocks[index])
+
+        data = b''.join(parts)
+        offset = start - first_block * self.block_size
+        return data[offset:offset + length]
+
+    # --- io.RawIOBase interface ---
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            new_pos = offset
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            new_pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if new_pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = new_pos
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self._size - self._pos)
+        if length <= 0:
+            return 0
+        data = self._read_span(self._pos, length)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._size - self._pos
+        length = min(size, self._size - self._pos)
+        if length <= 0:
+            return b''
+        data = self._read_span(self._pos, length)
+        self._pos += len(data)
+        return data
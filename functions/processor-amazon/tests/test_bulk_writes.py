@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import MagicMock, patch
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.api_core import exceptions as gcp_exceptions
+import bulk_writes
+from bulk_writes import FirestoreBulkWriter
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock(spec=['collection', 'batch', 'bulk_writer'])
+    return db
+
+def test_uses_bulk_writer_when_available(mock_db):
+    writer = FirestoreBulkWriter(mock_db)
+    for i in range(3):
+        writer.set("shards", f"s{i}", {"i": i})
+    writer.close()
+
+    bulk = mock_db.bulk_writer.return_value
+    assert bulk.set.call_count == 3
+    bulk.close.assert_called_once()
+    bulk.on_write_error.assert_called_once()
+
+def test_retries_only_retryable_failures(mock_db):
+    writer = FirestoreBulkWriter(mock_db, max_attempts=3)
+
+    throttled = MagicMock(code=8, attempts=1, message="slow down")
+    exhausted = MagicMock(code=8, attempts=3, message="slow down")
+    invalid = MagicMock(code=3, attempts=1, message="bad doc")
+
+    assert writer._on_write_error(throttled, None) is True
+    assert writer._on_write_error(exhausted, None) is False
+    assert writer._on_write_error(invalid, None) is False
+    assert writer.stats["retried"] == 1
+    assert writer.stats["failed"] == 2
+    assert writer.stats["throttled"] == 2
+
+def test_batch_fallback_chunks_at_500(mock_db):
+    writer = FirestoreBulkWriter(mock_db, use_bulk_writer=False)
+    for i in range(1200):
+        writer.set("debug_excluded_items", f"d{i}", {"i": i})
+    stats = writer.close()
+
+    batch = mock_db.batch.return_value
+    assert batch.commit.call_count == 3
+    assert batch.set.call_count == 1200
+    assert stats["written"] == 1200
+
+def test_batch_fallback_retries_throttling(mock_db):
+    batch = mock_db.batch.return_value
+    batch.commit.side_effect = [gcp_exceptions.ResourceExhausted("quota"), None]
+
+    with patch.object(bulk_writes, 'BACKOFF_BASE_SECONDS', 0):
+        writer = FirestoreBulkWriter(mock_db, use_bulk_writer=False)
+        writer.set("shards", "s1", {})
+        stats = writer.close()
+
+    assert batch.commit.call_count == 2
+    assert stats["written"] == 1
+    assert stats["retried"] == 1
+    assert stats["throttled"] == 1
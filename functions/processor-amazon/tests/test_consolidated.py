@@ -0,0 +1,38 @@
+import sys
+import os
+import json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from consolidated import encode_ndjson, item_range, build_item_index, NdjsonBuffer
+
+def test_items_are_addressable_by_offset():
+    items = [
+        {"item_name": "Cordless Drill", "total_amount": 99.0},
+        {"item_name": "Café Table – Oak", "total_amount": 250.0},
+        {"item_name": "Lamp", "total_amount": None},
+    ]
+    payload, offsets = encode_ndjson(items)
+
+    assert len(offsets) == len(items) + 1
+    assert offsets[-1] == len(payload)
+    for i, item in enumerate(items):
+        offset, length = item_range(offsets, i)
+        assert json.loads(payload[offset:offset + length].decode('utf-8')) == item
+
+def test_build_item_index():
+    _, offsets = encode_ndjson([{"a": 1}, {"b": 2}])
+    index = build_item_index("Retail.OrderHistory.1.csv", "drive_id", offsets)
+
+    assert index["count"] == 2
+    assert index["sidecar"] == "Retail.OrderHistory.1.csv.kintsu.ndjson"
+    assert index["offsets"] == offsets
+
+def test_buffer_matches_one_shot_encoding():
+    items = [{"item_name": f"Item {i}", "total_amount": float(i)} for i in range(7)]
+    buffer = NdjsonBuffer()
+    for start in range(0, len(items), 3):
+        buffer.extend(items[start:start + 3])
+
+    assert len(buffer) == len(items)
+    assert (buffer.getvalue(), buffer.offsets) == encode_ndjson(items)
@@ -0,0 +1,41 @@
+import pytest
+import sys
+import os
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from keyword_matcher import KeywordMatcher, get_matcher, MATCH_ASSET, MATCH_IGNORE
+from processor import AmazonProcessor, build_matcher
+
+@pytest.fixture
+def matcher():
+    return KeywordMatcher(['kit', 'tool'], ['snack', 'coffee', ' oz '])
+
+def test_classify(matcher):
+    assert matcher.classify("Socket Tool Set") == MATCH_ASSET
+    assert matcher.classify("Coffee Beans 12 OZ bag") == MATCH_IGNORE
+    assert matcher.classify("Standing Desk") is None
+
+def test_asset_wins_over_ignore(matcher):
+    assert matcher.classify("Coffee Maker Kit") == MATCH_ASSET
+    # Overlapping keywords ('snack' + 'kit') must both be seen
+    assert matcher.classify("snackit") == MATCH_ASSET
+
+def test_classify_series(matcher):
+    series = pd.Series(["Drill Kit", "Coffee", "Lamp", "Drill Kit"], index=[10, 11, 12, 13])
+    result = matcher.classify_series(series)
+
+    assert result.tolist() == [MATCH_ASSET, MATCH_IGNORE, None, MATCH_ASSET]
+    assert result.index.tolist() == [10, 11, 12, 13]
+
+def test_matcher_cached_by_version():
+    first = get_matcher("user1:v1", ['kit'], ['tea'])
+    assert get_matcher("user1:v1", ['kit'], ['tea']) is first
+    assert get_matcher("user1:v2", ['kit'], ['tea', 'lamp']) is not first
+
+def test_user_overrides_apply_to_processor():
+    processor = AmazonProcessor(matcher=build_matcher("test-overrides:v1", extra_ignore_keywords=['lamp']))
+
+    assert not processor.is_likely_asset("Floor Lamp", 80.0)
+    assert AmazonProcessor().is_likely_asset("Floor Lamp", 80.0)
@@ -0,0 +1,51 @@
+import pytest
+import sys
+import os
+import io
+import zipfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from manifest import ArchiveManifest
+from processor import AmazonProcessor
+
+ORDER_HISTORY = "Takeout/Retail.OrderHistory.1/Retail.OrderHistory.1.csv"
+RETURNS = "Takeout/Retail.OrdersReturned.1/Retail.OrdersReturned.1.csv"
+
+@pytest.fixture
+def archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        z.writestr(ORDER_HISTORY,
+                   "Order ID,Order Date,Title,Unit Price,Order Status\n"
+                   "A1,2024-01-01,Cordless Drill,$99.00,Shipped\n"
+                   "A2,2024-01-02,Standing Desk,$250.00,Shipped\n")
+        z.writestr(RETURNS, "OrderID,Return Date\nA2,2024-01-10\n")
+        z.writestr("Takeout/Devices.Clickstream/events.csv", "a,b\n1,2\n")
+        z.writestr("__MACOSX/._Retail.OrderHistory.1.csv", "junk")
+    buffer.seek(0)
+    with zipfile.ZipFile(buffer) as z:
+        yield z
+
+def test_manifest_selects_known_members(archive):
+    manifest = ArchiveManifest(archive)
+
+    assert manifest.names('order_history') == [ORDER_HISTORY]
+    assert manifest.names('returns') == [RETURNS]
+    assert "Takeout/Devices.Clickstream/events.csv" not in manifest.names()
+    assert manifest.selected_size < manifest.total_size
+
+def test_process_streams_members_from_archive(archive):
+    manifest = ArchiveManifest(archive)
+    processor = AmazonProcessor()
+
+    shards, excluded = processor.process(
+        ORDER_HISTORY,
+        os.path.basename(ORDER_HISTORY),
+        sibling_files=manifest.names(),
+        debug=True,
+        opener=manifest.open
+    )
+
+    assert [s['item_name'] for s in shards] == ["Cordless Drill"]
+    assert excluded[0]['reason'] == "found_in_returns_file"
@@ -0,0 +1,120 @@
+import pytest
+import sys
+import os
+import zipfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# drive_transport.py is vendored in at build time from shared/
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'shared')))
+
+import parallel
+from parallel import ArchiveSource, iter_files, process_files
+from drive_transport import DEFAULT_QUOTA_PER_MINUTE, user_bucket
+from processor import AmazonProcessor
+
+HEADER = "Order ID,Order Date,Title,Unit Price,Order Status\n"
+
+def _order_csv(prefix, count):
+    rows = [f"{prefix}{i},2024-01-{(i % 28) + 1:02d},Cordless Drill {prefix}{i},$99.00,Shipped\n" for i in range(count)]
+    return HEADER + "".join(rows)
+
+@pytest.fixture
+def csv_files(tmp_path):
+    files = {
+        "Retail.OrderHistory.1.csv": _order_csv("A", 40),
+        "Retail.OrderHistory.2.csv": _order_csv("B", 5),
+        "Retail.OrderHistory.3.csv": _order_csv("C", 20),
+        "Retail.OrdersReturned.1.csv": "OrderID,Return Date\nA3,2024-02-01\nC7,2024-02-02\n",
+    }
+    paths = {}
+    for name, content in files.items():
+        path = tmp_path / name
+        path.write_text(content)
+        paths[name] = str(path)
+    return paths
+
+def _run(source, paths, opener=None, max_workers=None):
+    processor = AmazonProcessor()
+    context = processor.build_context(paths, opener)
+    orders = [(p, os.path.basename(p)) for p in paths if 'OrderHistory' in p]
+    return process_files(processor, context, source, orders, debug=True, max_workers=max_workers), context
+
+def test_parallel_matches_serial_on_disk(csv_files):
+    paths = list(csv_files.values())
+
+    serial, _ = _run(ArchiveSource(), paths, max_workers=1)
+    parallel, context = _run(ArchiveSource(), paths, max_workers=2)
+
+    assert parallel == serial
+    assert [s['item_name'] for s in parallel[1][0]] == [f"Cordless Drill B{i}" for i in range(5)]
+    assert len(parallel[0][1]) == 1 and len(parallel[2][1]) == 1
+    assert context.opener is None
+
+def test_parallel_reads_members_from_local_zip(csv_files, tmp_path):
+    zip_path = str(tmp_path / "export.zip")
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for name, path in csv_files.items():
+            z.write(path, f"Takeout/{name}")
+
+    with zipfile.ZipFile(zip_path) as z:
+        members = sorted(z.namelist())
+        opener = lambda name: z.open(name, 'r')
+        serial, _ = _run(ArchiveSource(zip_path=zip_path), members, opener, max_workers=1)
+        parallel, context = _run(ArchiveSource(zip_path=zip_path), members, opener, max_workers=2)
+
+    assert parallel == serial
+    assert sum(len(shards) for shards, _ in parallel) == 63
+    assert context.opener is opener
+
+def test_iter_files_streams_batches_in_input_order(csv_files):
+    paths = list(csv_files.values())
+    processor = AmazonProcessor(chunk_rows=8)
+    context = processor.build_context(paths)
+    orders = [(p, os.path.basename(p)) for p in paths if 'OrderHistory' in p]
+
+    batches = list(iter_files(processor, context, ArchiveSource(), orders, max_workers=1))
+
+    assert [index for index, _, _ in batches] == [0] * 5 + [1] + [2] * 3
+    assert all(len(shards) <= 8 for _, shards, _ in batches)
+
+def test_workers_split_the_user_quota():
+    source = ArchiveSource(url="http://fake", user_key="user-1")
+
+    assert source.transport().bucket.rate == DEFAULT_QUOTA_PER_MINUTE / 60.0
+    worker_source = source.for_workers(4)
+    assert worker_source.url == source.url and worker_source.user_key == "user-1"
+    assert worker_source.transport().bucket.rate == DEFAULT_QUOTA_PER_MINUTE / 60.0 / 4
+
+def test_parent_keeps_only_its_share_while_workers_run(csv_files):
+    paths = list(csv_files.values())
+    processor = AmazonProcessor()
+    context = processor.build_context(paths)
+    orders = [(p, os.path.basename(p)) for p in paths if 'OrderHistory' in p]
+    bucket = user_bucket("user-parent")
+    rate = bucket.rate
+
+    batches = iter_files(processor, context, ArchiveSource(user_key="user-parent"), orders, max_workers=2)
+    next(batches)
+    # Two workers and the parent split the quota three ways
+    assert bucket.rate == pytest.approx(rate / 3)
+    list(batches)
+    assert bucket.rate == rate
+
+def test_worker_registers_archive_cleanup(csv_files, tmp_path, monkeypatch):
+    zip_path = str(tmp_path / "export.zip")
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        for name, path in csv_files.items():
+            z.write(path, f"Takeout/{name}")
+    registered = []
+    monkeypatch.setattr(parallel.atexit, 'register', lambda fn, *args: registered.append((fn, args)))
+    monkeypatch.setattr(parallel, '_worker', {})
+    processor = AmazonProcessor()
+    context = processor.build_context([])
+
+    parallel._init_worker(processor, context, ArchiveSource(zip_path=zip_path))
+    assert context.opener("Takeout/Retail.OrderHistory.2.csv").read().startswith(b"Order ID")
+
+    fn, args = registered[0]
+    fn(*args)
+    with pytest.raises(ValueError):
+        context.opener("Takeout/Retail.OrderHistory.2.csv")
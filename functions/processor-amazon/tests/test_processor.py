@@ -0,0 +1,194 @@
+import pytest
+import sys
+import os
+import pandas as pd
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from processor import AmazonProcessor, ReturnsIndex, DedupIndex, REASON_DUPLICATE, CSV_KIND_ORDERS, CSV_KIND_RETURNS, CSV_KIND_UNKNOWN
+
+@pytest.fixture
+def export_dir(tmp_path):
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    orders.write_text(
+        "﻿Order ID,Order Date,Title,Unit Price,Order Status\n"
+        "A1,2024-01-01,Cordless Drill,$99.00,Shipped\n"
+    )
+    returns = tmp_path / "Retail.OrdersReturned.1.csv"
+    returns.write_text("OrderID,Return Date\nA9,2024-01-10\n")
+    clicks = tmp_path / "Retail.Clickstream.csv"
+    clicks.write_text("session,url,timestamp\n1,/x,2024\n")
+    return {"orders": str(orders), "returns": str(returns), "clicks": str(clicks)}
+
+def test_classify_header():
+    assert AmazonProcessor.classify_header(["Order ID", "Title", "Unit Price"]) == CSV_KIND_ORDERS
+    assert AmazonProcessor.classify_header(["OrderID", "Return Date"]) == CSV_KIND_RETURNS
+    assert AmazonProcessor.classify_header(["session", "url"]) == CSV_KIND_UNKNOWN
+
+def test_can_process_rejects_non_order_csv(export_dir):
+    processor = AmazonProcessor()
+
+    assert processor.can_process(export_dir["orders"], "Amazon")
+    assert not processor.can_process(export_dir["clicks"], "Amazon")
+    assert not processor.can_process(export_dir["returns"], "Amazon")
+
+def test_rejected_csv_is_never_fully_parsed(export_dir):
+    processor = AmazonProcessor()
+
+    with patch.object(processor, '_read_csv') as mock_read:
+        shards, excluded = processor.process(export_dir["clicks"], "Retail.Clickstream.csv")
+
+    assert (shards, excluded) == ([], [])
+    mock_read.assert_not_called()
+
+def test_archive_context_parses_returns_once(export_dir):
+    processor = AmazonProcessor()
+    context = processor.build_context(list(export_dir.values()))
+
+    assert "A9" in context.returns
+    assert context.returns_files == [export_dir["returns"]]
+    assert list(context.columns) == [export_dir["orders"]]
+
+    with patch.object(processor, '_parse_returns') as mock_returns, \
+            patch.object(processor, '_read_header') as mock_header:
+        for _ in range(3):
+            shards, _ = processor.process(export_dir["orders"], "Retail.OrderHistory.1.csv", context=context)
+        mock_returns.assert_not_called()
+        mock_header.assert_not_called()
+
+    assert [s['item_name'] for s in shards] == ["Cordless Drill"]
+
+def test_returns_index_membership():
+    index = ReturnsIndex(["A1", "B2"])
+
+    assert "A1" in index and "C3" not in index
+    assert index.isin(pd.Series(["B2", "C3", "A1"])).tolist() == [True, False, True]
+    assert not ReturnsIndex().isin(pd.Series(["A1"])).any()
+
+def test_vectorized_filters_match_row_semantics(tmp_path):
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    orders.write_text(
+        "Order ID,Order Date,Title,Unit Price,Order Status\n"
+        "A1,2024-01-01,Cordless Drill,\"$1,249.00\",Shipped\n"
+        "A2,2024-01-02,Standing Desk,$250.00,Cancelled\n"
+        "A3,2024-01-03,Office Chair,$180.00,Shipped\n"
+        "A4,2024-01-04,Coffee Beans,$30.00,Shipped\n"
+        "A5,2024-01-05,Rechargeable Batteries,$9.00,Shipped\n"
+        "A6,,Mystery Box,call for price,\n"
+    )
+    returns = tmp_path / "Retail.OrdersReturned.1.csv"
+    returns.write_text("OrderID\nA3\n")
+
+    processor = AmazonProcessor()
+    shards, excluded = processor.process(
+        str(orders), orders.name, sibling_files=[str(returns)], debug=True
+    )
+
+    assert [(s['item_name'], s['total_amount']) for s in shards] == [
+        ("Cordless Drill", 1249.0),
+        ("Rechargeable Batteries", 9.0),
+    ]
+    assert shards[0]['source_meta'] == {
+        "original_row": 0, "status": "Shipped", "filter_method": "heuristic_v1"
+    }
+    assert [(e['order_id'], e['reason']) for e in excluded] == [
+        ("A2", "status_returned_or_cancelled"),
+        ("A3", "found_in_returns_file"),
+        ("A4", "asset_triage_filtered"),
+        ("A6", "asset_triage_filtered"),
+    ]
+    # Unparseable price falls back to 0.0, as float() did
+    assert excluded[-1]['price'] == 0.0
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_chunked_read_matches_single_shot(tmp_path, use_pyarrow):
+    if use_pyarrow:
+        pytest.importorskip("pyarrow")
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    lines = ["Website,Order ID,Order Date,Title,Unit Price,Order Status,Shipping Address"]
+    for i in range(250):
+        title = ["Cordless Drill", "Coffee Beans", "Office Chair", ""][i % 4]
+        lines.append(f"Amazon.com,A{i},2024-01-01,{title},${10 + i}.00,Shipped,\"1 Main St, Town\"")
+    orders.write_text("\n".join(lines) + "\n")
+
+    import processor as processor_module
+    columns = ["Order ID", "Title", "Unit Price"]
+    with patch.object(processor_module, 'pa_csv', processor_module.pa_csv if use_pyarrow else None):
+        processor = AmazonProcessor(chunk_rows=16)
+        chunked = pd.concat(list(processor._iter_csv_chunks(str(orders), columns)))
+        shards, excluded = processor.process(str(orders), orders.name, debug=True)
+
+    single = pd.read_csv(orders, usecols=columns, dtype=str)
+    pd.testing.assert_frame_equal(chunked[columns], single, check_index_type=False)
+    assert len(shards) + len(excluded) == 250
+    assert shards[-1]['source_meta']['original_row'] == 248
+
+@pytest.mark.parametrize("use_pyarrow", [True, False])
+def test_quoted_newlines_across_blocks(tmp_path, use_pyarrow):
+    if use_pyarrow:
+        pytest.importorskip("pyarrow")
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    lines = ["Order ID,Order Date,Title,Unit Price,Order Status,Gift Message"]
+    for i in range(2000):
+        lines.append(f"A{i},2024-01-01,Cordless Drill,$99.00,Shipped,\"Happy\nbirthday\"")
+    orders.write_text("\n".join(lines) + "\n")
+
+    import processor as processor_module
+    with patch.object(processor_module, 'pa_csv', processor_module.pa_csv if use_pyarrow else None), \
+            patch.object(processor_module, 'CSV_BLOCK_BYTES', 4096):
+        shards, _ = AmazonProcessor().process(str(orders), orders.name)
+
+    assert len(shards) == 2000
+
+def test_only_mapped_columns_are_read(tmp_path):
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    orders.write_text("Order ID,Title,Unit Price,Shipping Address\nA1,Drill,$99.00,1 Main St\n")
+    processor = AmazonProcessor()
+
+    chunks = list(processor._iter_csv_chunks(str(orders), ["Order ID", "Title", "Unit Price"]))
+    assert list(chunks[0].columns) == ["Order ID", "Title", "Unit Price"]
+
+def test_dedup_drops_lines_repeated_across_partitions_and_imports(tmp_path):
+    header = "Order ID,Order Date,Title,Unit Price,Order Status\n"
+    first = tmp_path / "Retail.OrderHistory.1.csv"
+    first.write_text(header +
+                     "A1,2024-01-01,Cordless Drill,$99.00,Shipped\n"
+                     "A1,2024-01-01,Cordless Drill,$99.00,Shipped\n"
+                     "A2,2024-01-02,Standing Desk,$250.00,Shipped\n")
+    second = tmp_path / "Retail.OrderHistory.2.csv"
+    second.write_text(header +
+                      "A2,2024-01-02,Standing Desk,$250.00,Shipped\n"
+                      "A2,2024-01-02,Standing Desk,$260.00,Shipped\n")
+    paths = [str(first), str(second)]
+
+    def run(dedup):
+        processor = AmazonProcessor()
+        context = processor.build_context(paths, dedup=dedup)
+        results = [processor.process(p, os.path.basename(p), debug=True, context=context) for p in paths]
+        return [processor.drop_repeated(shards, excluded, context.dedup, debug_mode=True) for shards, excluded in results]
+
+    dedup = DedupIndex()
+    results = run(dedup)
+
+    assert [(s['order_id'], s['total_amount']) for s in results[0][0]] == [("A1", 99.0), ("A2", 250.0)]
+    assert [(s['order_id'], s['total_amount']) for s in results[1][0]] == [("A2", 260.0)]
+    assert [e['original_row'] for e in results[0][1] if e['reason'] == REASON_DUPLICATE] == [1]
+    assert [e['original_row'] for e in results[1][1] if e['reason'] == REASON_DUPLICATE] == [0]
+    assert len(dedup) == 3
+
+    # A repeat import of the same export writes nothing new
+    repeat = run(DedupIndex.from_bytes(dedup.to_bytes()))
+    assert [shards for shards, _ in repeat] == [[], []]
+
+def test_iter_process_streams_chunks(tmp_path):
+    orders = tmp_path / "Retail.OrderHistory.1.csv"
+    orders.write_text("Order ID,Order Date,Title,Unit Price,Order Status\n" + "".join(
+        f"A{i},2024-01-01,Cordless Drill {i},$99.00,Shipped\n" for i in range(10)
+    ))
+    processor = AmazonProcessor(chunk_rows=4)
+
+    batches = list(processor.iter_process(str(orders), orders.name))
+
+    assert [len(shards) for shards, _ in batches] == [4, 4, 2]
+    assert [s for shards, _ in batches for s in shards] == processor.process(str(orders), orders.name)[0]
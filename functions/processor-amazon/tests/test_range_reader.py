@@ -0,0 +1,130 @@
+import pytest
+import sys
+import os
+import io
+import zipfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from range_reader import HttpRangeReader
+
+class FakeResponse:
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self._content = content
+        self.headers = headers or {}
+        self.consumed = False
+        self.closed = False
+
+    @property
+    def content(self):
+        self.consumed = True
+        return self._content
+
+    def close(self):
+        self.closed = True
+
+class FakeRangeSession:
+    """In-memory stand-in for a Drive alt=media endpoint."""
+    def __init__(self, data, supports_range=True):
+        self.data = data
+        self.supports_range = supports_range
+        self.requests = []
+        self.responses = []
+
+    def get(self, url, headers=None, stream=False):
+        assert stream, "range reads must be streamed"
+        range_header = (headers or {}).get('Range')
+        self.requests.append(range_header)
+        if not self.supports_range or not range_header:
+            response = FakeResponse(200, self.data)
+        else:
+            start, end = [int(x) for x in range_header.replace('bytes=', '').split('-')]
+            end = min(end, len(self.data) - 1)
+            response = FakeResponse(
+                206,
+                self.data[start:end + 1],
+                {'Content-Range': f"bytes {start}-{end}/{len(self.data)}"}
+            )
+        self.responses.append(response)
+        return response
+
+def build_archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as z:
+        # Large incompressible noise that should never be fetched
+        z.writestr("Takeout/Clickstream/events.bin", os.urandom(2 * 1024 * 1024))
+        z.writestr("Takeout/Retail.OrderHistory.1/Retail.OrderHistory.1.csv",
+                   "Order ID,Title,Unit Price\n1,Drill,$99.00\n")
+    return buffer.getvalue()
+
+def test_read_and_seek():
+    data = bytes(range(256)) * 100
+    reader = HttpRangeReader("http://fake", session=FakeRangeSession(data), block_size=1024)
+
+    assert reader.size == len(data)
+    assert reader.read(10) == data[:10]
+    reader.seek(-5, io.SEEK_END)
+    assert reader.read() == data[-5:]
+    reader.seek(3000)
+    assert reader.read(2500) == data[3000:5500]
+
+def test_blocks_are_cached():
+    data = b'x' * 8192
+    session = FakeRangeSession(data)
+    reader = HttpRangeReader("http://fake", session=session, block_size=1024)
+
+    reader.read(100)
+    reader.seek(0)
+    reader.read(100)
+    # Probe + one block fetch
+    assert len(session.requests) == 2
+
+def test_sequential_reads_read_ahead():
+    data = os.urandom(64 * 1024)
+    session = FakeRangeSession(data)
+    reader = HttpRangeReader("http://fake", session=session, block_size=1024, max_readahead=8)
+
+    # zipfile-style small sequential reads
+    chunks = iter(lambda: reader.read(300), b'')
+    assert b''.join(chunks) == data
+    # 64 blocks in windows of 1, 2, 3, 5, 9, then 9 at a time: far fewer than one request per block
+    assert len(session.requests) - 1 < 16
+    assert reader.bytes_fetched == len(data)
+
+def test_random_reads_do_not_read_ahead():
+    data = os.urandom(64 * 1024)
+    session = FakeRangeSession(data)
+    reader = HttpRangeReader("http://fake", session=session, block_size=1024, max_readahead=8)
+
+    for offset in (40000, 5000, 60000, 20000):
+        reader.seek(offset)
+        assert reader.read(10) == data[offset:offset + 10]
+    assert reader.bytes_fetched == 4 * 1024
+
+def test_zip_reads_only_needed_member():
+    archive = build_archive()
+    session = FakeRangeSession(archive)
+    reader = HttpRangeReader("http://fake", session=session, block_size=16 * 1024)
+
+    with zipfile.ZipFile(reader) as z:
+        content = z.read("Takeout/Retail.OrderHistory.1/Retail.OrderHistory.1.csv")
+
+    assert b"Drill" in content
+    assert reader.bytes_fetched < len(archive) // 10
+    # The probe's size comes from its headers; every response is released
+    assert not session.responses[0].consumed
+    assert all(response.closed for response in session.responses)
+
+def test_range_not_supported():
+    session = FakeRangeSession(b'abc', supports_range=False)
+    with pytest.raises(OSError):
+        HttpRangeReader("http://fake", session=session)
+
+def test_ignored_range_is_closed_unread():
+    # A server that ignores Range answers 200 with the whole file
+    session = FakeRangeSession(b'x' * 1024, supports_range=False)
+    with pytest.raises(OSError):
+        HttpRangeReader("http://fake", session=session)
+    assert session.responses[0].closed
+    assert not session.responses[0].consumed
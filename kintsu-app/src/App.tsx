@@ -29,6 +29,8 @@ interface Shard {
   sourceType: string;
   status: 'unprocessed' | 'refined' | 'error';
   driveFileId?: string;
+  driveItemOffset?: number;
+  driveItemLength?: number;
   createdAt: Timestamp;
 }
 
@@ -50,7 +52,10 @@ const RefinedShardItem = ({ shard, getIcon }: { shard: Shard, getIcon: (s: strin
       const fetchData = async () => {
         setLoading(true);
         try {
-          const content = await DriveService.getFileContent(shard.driveFileId!);
+          const range = shard.driveItemLength != null
+            ? { offset: shard.driveItemOffset ?? 0, length: shard.driveItemLength }
+            : undefined;
+          const content = await DriveService.getFileContent(shard.driveFileId!, range);
           setData(JSON.parse(content));
         } catch (e) {
           console.error("Error loading sidecar:", e);
@@ -60,7 +65,7 @@ const RefinedShardItem = ({ shard, getIcon }: { shard: Shard, getIcon: (s: strin
       };
       fetchData();
     }
-  }, [isRefined, shard.driveFileId, data]);
+  }, [isRefined, shard.driveFileId, shard.driveItemOffset, shard.driveItemLength, data]);
 
   return (
     <div
@@ -225,9 +225,13 @@ export class DriveService {
     }
   }
 
-  static async getFileContent(fileId: string): Promise<string> {
+  static async getFileContent(fileId: string, range?: { offset: number; length: number }): Promise<string> {
     try {
-      const response = await this._fetch(`https://www.googleapis.com/drive/v3/files/${fileId}?alt=media`);
+      // Consolidated sidecars (NDJSON) are read one item at a time via a byte range
+      const options: RequestInit = range
+        ? { headers: { Range: `bytes=${range.offset}-${range.offset + range.length - 1}` } }
+        : {};
+      const response = await this._fetch(`https://www.googleapis.com/drive/v3/files/${fileId}?alt=media`, options);
       const text = await response.text();
       return text;
     } catch (e) {
@@ -0,0 +1,271 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Drive's default per-user quota is 12,000 queries per minute
+DEFAULT_QUOTA_PER_MINUTE = int(os.getenv("DRIVE_USER_QUOTA_PER_MINUTE", "12000"))
+DEFAULT_POOL_SIZE = int(os.getenv("DRIVE_POOL_SIZE", "16"))
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+# (connect, read) seconds for every call; a stalled socket otherwise hangs forever
+DEFAULT_TIMEOUT = (
+    float(os.getenv("DRIVE_CONNECT_TIMEOUT_SECONDS", "10")),
+    float(os.getenv("DRIVE_READ_TIMEOUT_SECONDS", "120")),
+)
+# A bucket unused this long has refilled, so dropping it loses nothing
+BUCKET_IDLE_SECONDS = 15 * 60
+
+RATE_LIMIT_STATUSES = {429}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+SERVER_ERROR_STATUSES = {500, 502, 503, 504}
+
+
+def retry_kind(status: Optional[int], content) -> Optional[str]:
+    """
+    'throttled' for quota answers (429, 403 rate limit reasons), 'error' for
+    transient server errors, None when retrying would not help.
+    """
+    if status in RATE_LIMIT_STATUSES:
+        return 'throttled'
+    if status in SERVER_ERROR_STATUSES:
+        return 'error'
+    if status == 403 and content:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+        if any(reason in content for reason in RATE_LIMIT_REASONS):
+            return 'throttled'
+    return None
+
+
+class TokenBucket:
+    """
+    Blocking token bucket: `rate` calls per second with bursts of `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, sleeping until one is available. Returns the wait.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # A negative balance is this caller's place in the queue
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+    def idle_seconds(self) -> float:
+        with self._lock:
+            return self._clock() - self._updated
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def user_bucket(user_key: str, quota_per_minute: int = DEFAULT_QUOTA_PER_MINUTE) -> TokenBucket:
+    """
+    The process-wide bucket of one Drive user, shared by all their transports.
+    Key it by a stable user ID, not a token: tokens rotate. Buckets idle for
+    BUCKET_IDLE_SECONDS are dropped, so warm processes do not accumulate them.
+    """
+    with _buckets_lock:
+        for key in [key for key, bucket in _buckets.items() if bucket.idle_seconds() > BUCKET_IDLE_SECONDS]:
+            del _buckets[key]
+        if user_key not in _buckets:
+            _buckets[user_key] = TokenBucket(quota_per_minute / 60.0)
+        return _buckets[user_key]
+
+
+class TransportMetrics:
+    """
+    Counters of one transport. `throttled` counts quota answers that were
+    backed off and retried; `failed` counts calls that still failed after
+    every retry (those are the ones a caller may lose).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "failed": self.failed,
+                "waitSeconds": round(self.wait_seconds, 3),
+            }
+
+
+class DriveTransport:
+    """
+    Every Drive call goes through here: pooled keep-alive sessions, the
+    user's token bucket, and exponential backoff with jitter (honouring
+    Retry-After) on rate limits and transient server errors.
+
+    Safe to share between threads: requests sessions are not guaranteed to
+    be thread-safe, so each thread lazily gets its own session (and
+    connection pool) while the bucket and metrics stay shared.
+
+    Pass `access_token` for a user's OAuth token, or a `session_factory`
+    returning authorized sessions (e.g. google.auth AuthorizedSession) for
+    service credentials.
+    """
+
+    def __init__(self, user_key: str, access_token: Optional[str] = None,
+                 session_factory: Optional[Callable[[], requests.Session]] = None,
+                 bucket: Optional[TokenBucket] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 max_attempts: int = MAX_ATTEMPTS, sleep: Callable[[float], None] = time.sleep,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT):
+        self.user_key = user_key
+        self.timeout = timeout
+        self.bucket = bucket if bucket is not None else user_bucket(user_key)
+        self.max_attempts = max_attempts
+        self.metrics = TransportMetrics()
+        self._access_token = access_token
+        self._session_factory = session_factory or requests.Session
+        self._pool_size = pool_size
+        self._sleep = sleep
+        self._local = threading.local()
+        self._sessions: List[requests.Session] = []
+        self._sessions_lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The calling thread's session.
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._session_factory()
+            if self._access_token:
+                session.headers["Authorization"] = f"Bearer {self._access_token}"
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self._pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            with self._sessions_lock:
+                self._sessions.append(session)
+            self._local.session = session
+        return session
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+        return delay + random.uniform(0, delay / 2)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends one Drive call and returns the final response; callers check
+        its status as before. Connection errors that outlast every retry
+        are re-raised.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        body = kwargs.get("data")
+        if hasattr(body, "read"):
+            # A retry must send the same bytes again
+            kwargs["data"] = body.read()
+
+        for attempt in range(1, self.max_attempts + 1):
+            waited = self.bucket.acquire()
+            self.metrics.add(requests=1, wait_seconds=waited)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_attempts:
+                    self.metrics.add(failed=1)
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"Drive {method} failed ({e}); retrying in {delay:.1f}s")
+                self.metrics.add(retried=1, wait_seconds=delay)
+                self._sleep(delay)
+                continue
+
+            # Only a 403 body needs reading; streamed downloads stay unread
+            kind = retry_kind(response.status_code, response.content if response.status_code == 403 else None)
+            if kind is None:
+                return response
+            if attempt == self.max_attempts:
+                self.metrics.add(failed=1)
+                logger.error(f"Drive {method} gave up after {attempt} attempts ({response.status_code})")
+                return response
+
+            delay = self._backoff(attempt, response)
+            self.metrics.add(wait_seconds=delay, **{"throttled" if kind == 'throttled' else "retried": 1})
+            logger.warning(f"Drive {method} answered {response.status_code}; retrying in {delay:.1f}s")
+            # Hand the connection back to the pool rather than holding it through the sleep
+            response.close()
+            self._sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def http(self) -> "DriveHttp":
+        return DriveHttp(self)
+
+    def close(self):
+        with self._sessions_lock:
+            sessions, self._sessions = self._sessions, []
+            self._local = threading.local()
+        for session in sessions:
+            session.close()
+
+
+class DriveHttp:
+    """
+    httplib2-compatible facade, so googleapiclient services built with
+    `http=transport.http()` share the transport's pool, bucket and retries.
+    """
+
+    def __init__(self, transport: DriveTransport):
+        self.transport = transport
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        response = self.transport.request(method, uri, data=body, headers=headers)
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # requests already decoded the body
+        info.pop("content-encoding", None)
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        self.transport.close()
+
@@ -0,0 +1,17 @@
+#!/bin/bash
+# Copies the modules shared by several deployables into each deployable's
+# source directory, so every image/function ships the same file. Cloud Build
+# runs this before any build or deploy step; run it yourself before deploying
+# by hand. The copies are git-ignored: edit shared/, never a copy.
+set -euo pipefail
+
+ROOT="$(cd "$(dirname "$0")/.." && pwd)"
+SHARED_MODULES=(drive_transport.py)
+TARGETS=(backend backend/workers/mbox functions/ingest-shard functions/processor-amazon)
+
+for target in "${TARGETS[@]}"; do
+  for module in "${SHARED_MODULES[@]}"; do
+    cp "$ROOT/shared/$module" "$ROOT/$target/$module"
+  done
+done
+echo "Vendored ${SHARED_MODULES[*]} into ${TARGETS[*]}"